@@ -1,58 +1,109 @@
 import streamlit as st
-from schema_detector import get_sqlite_schema, get_postgres_schema, get_mongodb_schema, get_redis_schema, generate_schema_description
-from db_connectors import execute_sqlite_query, execute_postgres_query, execute_mongodb_query, execute_redis_query
-from query_generator import generate_query
+from schema_cache import get_cached_schema, get_cached_schema_description
+from db_connectors import execute_redis_query, stream_mongodb_query, wants_enriched_view
+from arrow_results import stream_sqlite_arrow, stream_postgres_arrow, concat_tables, is_truncated
+from query_generator import generate_query, invalidate_query
+from connection_manager import default_db_config
+from query_cache import get_query_cache
+from result_cache import cached_result, get_result_cache
+from index_advisor import record_query
+from cost_guard import QueryRejectedError
+from metrics import trace, stage, record_stage, record_result, get_registry, start_metrics_server
+from profiling import NLQ_PROFILE, PROFILE_DIR, profile_request, profile_stage
 import json
 import sqlite3
 from dotenv import load_dotenv
 import os
-import redis
+import time
 import pandas as pd
+import pyarrow as pa
 
 # Load environment variables
 load_dotenv()
+# Prometheus /metrics endpoint, if METRICS_PORT is set; started once per process
+start_metrics_server()
+
+def collect_stream(chunks):
+    """Render the first chunk as soon as it arrives and collect all chunks into one DataFrame."""
+    preview = st.empty()
+    progress = st.empty()
+    frames = []
+    for chunk in chunks:
+        if not frames:
+            preview.dataframe(chunk)
+        frames.append(chunk)
+        progress.caption(f"Loaded {sum(len(frame) for frame in frames)} rows...")
+    preview.empty()
+    progress.empty()
+    if not frames:
+        return pd.DataFrame()
+    result = pd.concat(frames, ignore_index=True)
+    result.attrs['truncated'] = frames[-1].attrs.get('truncated', False)
+    return result
+
+def collect_arrow(tables):
+    """Render the first Arrow batch as soon as it arrives and combine all batches into one pa.Table."""
+    preview = st.empty()
+    progress = st.empty()
+    batches = []
+    for table in tables:
+        if not batches:
+            preview.dataframe(table)
+        batches.append(table)
+        progress.caption(f"Loaded {sum(batch.num_rows for batch in batches)} rows...")
+    preview.empty()
+    progress.empty()
+    return concat_tables(batches)
+
+def run_sql(db_type, db_config, query):
+    """Run a SQLite/PostgreSQL query through the result cache; results stay in Arrow from the cursor to st.dataframe."""
+    if db_type == 'sqlite':
+        return cached_result('sqlite', db_config, query,
+                             lambda: collect_arrow(stream_sqlite_arrow(db_config["db_path"], query)), kind='table')
+    return cached_result('postgresql', db_config, query,
+                         lambda: collect_arrow(stream_postgres_arrow(db_config, query)), kind='table')
 
 st.title("NLQ Pipeline with Multiple Databases")
 
+# Generated-query and result cache counters
+cache_stats = get_query_cache().stats()
+st.sidebar.caption(f"Query cache: {cache_stats['hits']} hits ({cache_stats['near_hits']} near), {cache_stats['misses']} misses, {cache_stats['entries']} entries")
+result_stats = get_result_cache().stats()
+st.sidebar.caption(f"Result cache: {result_stats['hits']} hits, {result_stats['misses']} misses, {result_stats['entries']} entries ({result_stats['bytes'] / 1e6:.1f} MB)")
+
+# Profile the next requests (cProfile, stack samples and allocations); NLQ_PROFILE=1 turns it on by default
+profile_enabled = st.sidebar.checkbox("Profile requests", value=NLQ_PROFILE)
+
 # Database selection
 db_type = st.selectbox("Select Database", ["SQLite", "PostgreSQL", "MongoDB", "Redis"])
 
 # Database parameters
-if db_type == "SQLite":
-    db_config = {"db_path": "sample.db"}
-elif db_type == "PostgreSQL":
-    db_config = {
-        "dbname": os.getenv("POSTGRES_DBNAME", "sample"),
-        "user": os.getenv("POSTGRES_USER", "postgres"),
-        "password": os.getenv("POSTGRES_PASSWORD", ""),
-        "host": os.getenv("POSTGRES_HOST", "localhost"),
-        "port": os.getenv("POSTGRES_PORT", "5432")
-    }
-elif db_type == "MongoDB":
-    db_config = {"db_name": os.getenv("MONGODB_DBNAME", "sample")}
-else:  # Redis
-    db_config = {}
-
-# Get schema
+db_config = default_db_config(db_type.lower())
+
+# Recent per-stage latencies for the selected backend
+latencies = get_registry().percentiles(db_type.lower())
+if latencies:
+    st.sidebar.caption("Latency over recent requests (seconds)")
+    st.sidebar.dataframe(pd.DataFrame([{"stage": stage_name, "p50": latency["p50"], "p95": latency["p95"], "requests": latency["count"]}
+                                       for (_, stage_name), latency in sorted(latencies.items())]), hide_index=True)
+
+# Get schema (re-detected only when the database's schema fingerprint changes)
+schema_start = time.perf_counter()
 try:
-    if db_type == "SQLite":
-        schema = get_sqlite_schema(db_config["db_path"])
-    elif db_type == "PostgreSQL":
-        schema = get_postgres_schema(db_config)
-    elif db_type == "MongoDB":
-        schema = get_mongodb_schema(db_config["db_name"])
-    else:
-        schema = get_redis_schema()
+    schema, schema_fingerprint = get_cached_schema(db_type.lower(), db_config)
 except sqlite3.DatabaseError as e:
     st.error(f"Error accessing SQLite database: {str(e)}. Please ensure 'sample.db' exists and is a valid SQLite database.")
     st.stop()
 except Exception as e:
     st.error(f"Error retrieving schema: {str(e)}")
     st.stop()
+schema_seconds = time.perf_counter() - schema_start
 
 # Display schema
 st.subheader("Database Schema")
-schema_desc = generate_schema_description(schema)
+describe_start = time.perf_counter()
+schema_desc = get_cached_schema_description(schema)
+describe_seconds = time.perf_counter() - describe_start
 st.write(schema_desc)
 
 # Natural language query input
@@ -62,110 +113,113 @@ if st.button("Execute Query"):
     if nl_query:
         # Clear previous results to avoid caching issues
         st.session_state.pop("query_result", None)
+        st.session_state.pop("query_trace", None)
+        st.session_state.pop("query_profile", None)
         
-        # Generate query
-        generated_query = generate_query(nl_query, schema, db_type.lower())
-        st.write(f"Generated Query: {generated_query}")  # Debug output
+        # Trace this request; schema detection and description ran earlier in this script run
+        with trace(db_type.lower(), nl_query) as request_trace, \
+                profile_request(nl_query, enabled=profile_enabled) as request_profile:
+            record_stage("schema", schema_start, schema_seconds)
+            record_stage("describe", describe_start, describe_seconds)
+            # Generate query
+            with stage("generate"), profile_stage("generate"):
+                generated_query = generate_query(nl_query, schema, db_type.lower())
+            st.write(f"Generated Query: {generated_query}")  # Debug output
         
-        # Execute query
-        try:
-            if db_type == "SQLite":
-                result = execute_sqlite_query(db_config["db_path"], generated_query)
-            elif db_type == "PostgreSQL":
-                result = execute_postgres_query(db_config, generated_query)
-            elif db_type == "MongoDB":
-                try:
-                    generated_query_dict = json.loads(generated_query)
-                except json.JSONDecodeError as e:
-                    st.error(f"Invalid MongoDB query format: {generated_query}. Expected a JSON string. Error: {str(e)}")
-                    st.stop()
-                result = execute_mongodb_query(db_config["db_name"], generated_query_dict)
-            else:  # Redis
-                try:
-                    generated_query_dict = json.loads(generated_query)
-                except json.JSONDecodeError as e:
-                    st.error(f"Invalid Redis query format: {generated_query}. Expected a JSON string. Error: {str(e)}")
-                    st.stop()
-                result = execute_redis_query(generated_query_dict)
-                
-                # For Redis queries, fetch additional data for joins and apply transformations
-                if db_type == "Redis" and "customer" in nl_query.lower() and "product" in nl_query.lower():
-                    redis_client = redis.Redis(host="localhost", port=6379, db=0, decode_responses=True)
+            # Execute query
+            try:
+                if db_type in ["SQLite", "PostgreSQL"]:
+                    try:
+                        with stage("execute"), profile_stage("execute"):
+                            result = run_sql(db_type.lower(), db_config, generated_query)
+                    except QueryRejectedError as e:
+                        # Too expensive to run as generated; ask the LLM once for a cheaper query
+                        st.warning(f"Query rejected by the cost guard: {str(e)}. Regenerating...")
+                        with stage("regenerate"), profile_stage("regenerate"):
+                            generated_query = generate_query(nl_query, schema, db_type.lower(), feedback=str(e))
+                        st.write(f"Regenerated Query: {generated_query}")
+                        with stage("execute:retry"), profile_stage("execute:retry"):
+                            result = run_sql(db_type.lower(), db_config, generated_query)
+                elif db_type == "MongoDB":
                     try:
-                        enriched_results = []
-                        for _, order in result.iterrows():
-                            # Fetch product
-                            product_key = f"product:{order['product_id']}"
-                            product_data = None
-                            try:
-                                product_hash = redis_client.hgetall(product_key)
-                                if product_hash:
-                                    product_data = {}
-                                    for field, value in product_hash.items():
-                                        if field in ["price", "discount", "stock_quantity"]:
-                                            product_data[field] = float(value)
-                                        else:
-                                            product_data[field] = value
-                            except redis.RedisError as e:
-                                print(f"Error fetching product {product_key}: {str(e)}")
-                                continue
-                            # Fetch customer
-                            customer_key = f"customer:{order['customer_id']}"
-                            customer_data = None
-                            try:
-                                customer_hash = redis_client.hgetall(customer_key)
-                                if customer_hash:
-                                    customer_data = {}
-                                    for field, value in customer_hash.items():
-                                        if field in ["credit_limit"]:
-                                            customer_data[field] = float(value)
-                                        else:
-                                            customer_data[field] = value
-                            except redis.RedisError as e:
-                                print(f"Error fetching customer {customer_key}: {str(e)}")
-                                continue
-                            if customer_data and product_data:
-                                enriched_row = {
-                                    "customer_name": f"{customer_data['first_name']} {customer_data['last_name']}",
-                                    "email": customer_data.get("email"),
-                                    "phone": customer_data.get("phone"),
-                                    "city": customer_data.get("city"),
-                                    "country": customer_data.get("country"),
-                                    "credit_limit": customer_data.get("credit_limit"),
-                                    "registration_date": customer_data.get("registration_date"),
-                                    "product_name": product_data.get("name"),
-                                    "category": product_data.get("category"),
-                                    "price": product_data.get("price"),
-                                    "stock_quantity": product_data.get("stock_quantity"),
-                                    "manufacturer": product_data.get("manufacturer"),
-                                    "release_date": product_data.get("release_date"),
-                                    "discount": product_data.get("discount"),
-                                    "order_id": int(order.get("order_id")),
-                                    "quantity": int(order.get("quantity")),
-                                    "order_date": order.get("order_date"),
-                                    "total_price": float(order.get("total_price")),
-                                    "status": order.get("status"),
-                                    "shipping_address": order.get("shipping_address"),
-                                    "payment_method": order.get("payment_method")
-                                }
-                                enriched_results.append(enriched_row)
-                        if enriched_results:
-                            result = pd.DataFrame(enriched_results)
-                        else:
-                            result = pd.DataFrame(columns=["customer_name", "email", "phone", "city", "country", "credit_limit", "registration_date", "product_name", "category", "price", "stock_quantity", "manufacturer", "release_date", "discount", "order_id", "quantity", "order_date", "total_price", "status", "shipping_address", "payment_method"])
-                    finally:
-                        redis_client.close()
-                
-            st.session_state.query_result = result
-        except Exception as e:
-            st.error(f"Error executing query: {str(e)}")
+                        generated_query_dict = json.loads(generated_query)
+                    except json.JSONDecodeError as e:
+                        st.error(f"Invalid MongoDB query format: {generated_query}. Expected a JSON string. Error: {str(e)}")
+                        invalidate_query(schema, db_type.lower(), generated_query)
+                        st.stop()
+                    with stage("execute"), profile_stage("execute"):
+                        result = cached_result('mongodb', db_config, generated_query_dict,
+                                               lambda: collect_stream(stream_mongodb_query(db_config["db_name"], generated_query_dict)))
+                else:  # Redis
+                    try:
+                        generated_query_dict = json.loads(generated_query)
+                    except json.JSONDecodeError as e:
+                        st.error(f"Invalid Redis query format: {generated_query}. Expected a JSON string. Error: {str(e)}")
+                        invalidate_query(schema, db_type.lower(), generated_query)
+                        st.stop()
+                    enriched = wants_enriched_view(nl_query)
+                    with stage("execute"), profile_stage("execute"):
+                        result = cached_result('redis', db_config, generated_query_dict,
+                                               lambda: execute_redis_query(generated_query_dict, enriched=enriched),
+                                               options={"enriched": enriched})
+
+                record_result(result)
+                st.session_state.query_result = result
+                record_query(db_type.lower(), db_config, generated_query, schema)
+            except Exception as e:
+                request_trace.status = "error"
+                # Don't serve a query that fails to run from the cache again
+                invalidate_query(schema, db_type.lower(), generated_query)
+                st.error(f"Error executing query: {str(e)}")
+        st.session_state.query_trace = request_trace.to_dict()
+        if request_profile:
+            # Saved when profile_request exited
+            st.session_state.query_profile = request_profile
     else:
         st.warning("Please enter a query.")
 
 # Display the result if it exists
 if "query_result" in st.session_state:
     st.subheader("Query Result")
-    if not st.session_state.query_result.empty:
-        st.dataframe(st.session_state.query_result)
+    result = st.session_state.query_result
+    # SQL backends return a pyarrow Table, MongoDB and Redis a DataFrame
+    if isinstance(result, pa.Table):
+        truncated = is_truncated(result)
     else:
-        st.warning("No results found.")
\ No newline at end of file
+        truncated = result.attrs.get('truncated')
+    if len(result) > 0:
+        if truncated:
+            st.warning(f"Result truncated to the first {len(result)} rows.")
+        render_start = time.perf_counter()
+        st.dataframe(result)
+        render_seconds = time.perf_counter() - render_start
+        request_info = st.session_state.get("query_trace")
+        # Rendering happens after the request's trace closed; count it once per result
+        if request_info and not any(span["stage"] == "render" for span in request_info["spans"]):
+            request_info["spans"].append({"stage": "render", "start": None, "seconds": round(render_seconds, 6)})
+            get_registry().observe(request_info["backend"], "render", render_seconds)
+    else:
+        st.warning("No results found.")
+
+# Per-request trace: stage timings, result size, LLM tokens and cache outcomes
+if "query_trace" in st.session_state:
+    request_info = st.session_state.query_trace
+    with st.expander(f"Request trace ({request_info['request_id']})"):
+        st.dataframe(pd.DataFrame(request_info["spans"]), hide_index=True)
+        st.json({"values": request_info["values"], "caches": request_info["caches"]})
+
+# Profile of the last request: hottest functions, allocations and flame graph input
+if "query_profile" in st.session_state:
+    request_profile = st.session_state.query_profile
+    profile_summary = request_profile.summary()
+    with st.expander(f"Profile ({request_profile.request_id})"):
+        st.caption(f"Saved to {os.path.join(PROFILE_DIR, request_profile.request_id)}; peak traced memory "
+                   f"{profile_summary['peak_bytes'] / 1e6:.1f} MB, {profile_summary['samples']} stack samples")
+        st.dataframe(pd.DataFrame(profile_summary["stages"]), hide_index=True)
+        st.caption("Functions by cumulative time")
+        st.dataframe(pd.DataFrame(profile_summary["functions"]), hide_index=True)
+        if profile_summary["allocations"]:
+            st.caption("Allocations still held at the end of the request")
+            st.dataframe(pd.DataFrame(profile_summary["allocations"]), hide_index=True)
+        st.download_button("Collapsed stacks (flamegraph.pl / speedscope)", request_profile.collapsed_stacks(),
+                           file_name=f"{request_profile.request_id}.collapsed")
@@ -0,0 +1,248 @@
+import io
+from urllib.parse import quote
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+from connection_manager import sqlite_connection, postgres_connection, postgres_params
+from db_connectors import STREAM_CHUNK_ROWS, MAX_RESULT_ROWS, MAX_RESULT_BYTES
+from cost_guard import guard_sql, sqlite_deadline, set_statement_timeout
+from nlq_logging import get_logger
+
+logger = get_logger(__name__)
+
+# ADBC drivers are optional; without them SQLite uses fetchmany batches and PostgreSQL uses COPY
+try:
+    import adbc_driver_sqlite.dbapi as adbc_sqlite
+except ImportError:
+    adbc_sqlite = None
+try:
+    import adbc_driver_postgresql.dbapi as adbc_postgresql
+except ImportError:
+    adbc_postgresql = None
+
+# PostgreSQL type OIDs -> Arrow types for parsing COPY output; other types are inferred from the text
+POSTGRES_ARROW_TYPES = {
+    16: pa.bool_(),
+    20: pa.int64(),
+    21: pa.int16(),
+    23: pa.int32(),
+    700: pa.float32(),
+    701: pa.float64(),
+    25: pa.string(),
+    1042: pa.string(),
+    1043: pa.string(),
+    1082: pa.date32(),
+    1114: pa.timestamp('us'),
+}
+POSTGRES_NUMERIC_OID = 1700
+
+def is_truncated(table):
+    """Whether a table from this module was cut at the row or byte cap."""
+    return bool(table.schema.metadata and table.schema.metadata.get(b'truncated') == b'true')
+
+def unique_column_names(names):
+    """
+    Suffix repeated column names, as a join without aliases returns them (e.g., two product_id
+    columns become product_id and product_id_1), so the table can be concatenated, cached and displayed.
+    """
+    taken = set(names)
+    seen = set()
+    unique = []
+    for name in names:
+        candidate = name
+        suffix = 0
+        # A suffixed name must not clash with a real column either
+        while candidate in seen or (candidate != name and candidate in taken):
+            suffix += 1
+            candidate = f"{name}_{suffix}"
+        seen.add(candidate)
+        unique.append(candidate)
+    return unique
+
+def _with_unique_names(table):
+    names = unique_column_names(table.column_names)
+    return table if names == table.column_names else table.rename_columns(names)
+
+def _to_arrow_array(values):
+    # SQLite columns can mix storage classes; such a column is kept as text rather than failing
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array([None if value is None else str(value) for value in values], type=pa.string())
+
+def _cap_tables(tables, max_rows=None, max_bytes=None):
+    """
+    Pass Arrow tables through until the row or byte cap is reached, then stop the source.
+    The last table of a truncated stream carries schema metadata truncated=true.
+    """
+    max_rows = MAX_RESULT_ROWS if max_rows is None else max_rows
+    max_bytes = MAX_RESULT_BYTES if max_bytes is None else max_bytes
+    rows = 0
+    size = 0
+    try:
+        for table in tables:
+            table = _with_unique_names(table)
+            truncated = False
+            if max_rows and rows + table.num_rows > max_rows:
+                table = table.slice(0, max_rows - rows)
+                truncated = True
+            if max_bytes and table.num_rows and size + table.nbytes > max_bytes:
+                table = table.slice(0, int(table.num_rows * (max_bytes - size) / table.nbytes))
+                truncated = True
+            rows += table.num_rows
+            size += table.nbytes
+            if truncated:
+                logger.info("Result truncated at %d rows / %d bytes", rows, size)
+                yield table.replace_schema_metadata({'truncated': 'true'})
+                return
+            yield table
+    finally:
+        if hasattr(tables, 'close'):
+            tables.close()
+
+def concat_tables(tables):
+    """
+    Combine streamed tables into one, promoting types that widened between batches
+    (e.g., all-null to int, int to float). Columns whose types conflict become strings.
+    Args:
+        tables (list): Tables from a stream_*_arrow call.
+    Returns:
+        pa.Table: The combined table, keeping the truncated marker of the last one.
+    """
+    if not tables:
+        return pa.table({})
+    if len(tables) == 1:
+        return _with_unique_names(tables[0])
+    truncated = is_truncated(tables[-1])
+    tables = [_with_unique_names(table.replace_schema_metadata(None)) for table in tables]
+    try:
+        table = pa.concat_tables(tables, promote_options='permissive')
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        conflicting = {i for i in range(tables[0].num_columns)
+                       if len({table.schema.field(i).type for table in tables} - {pa.null()}) > 1}
+        tables = [pa.table([pc.cast(column, pa.string()) if i in conflicting else column
+                            for i, column in enumerate(table.columns)], names=table.column_names)
+                  for table in tables]
+        table = pa.concat_tables(tables, promote_options='permissive')
+    return table.replace_schema_metadata({'truncated': 'true'}) if truncated else table
+
+def _sqlite_tables(db_path, query, batch_size):
+    if adbc_sqlite is not None:
+        with adbc_sqlite.connect(db_path) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(query)
+                for batch in cursor.fetch_record_batch():
+                    yield pa.Table.from_batches([batch])
+        return
+    with sqlite_connection(db_path) as conn, sqlite_deadline(conn):
+        cursor = conn.execute(query)
+        if cursor.description is None:
+            return
+        names = [col[0] for col in cursor.description]
+        empty = True
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            empty = False
+            yield pa.table([_to_arrow_array(list(column)) for column in zip(*rows)], names=names)
+        if empty:
+            yield pa.table([pa.array([], type=pa.null()) for _ in names], names=names)
+
+def stream_sqlite_arrow(db_path, query, batch_size=None, max_rows=None, max_bytes=None):
+    """
+    Stream a SQLite query as Arrow tables, one per fetchmany batch (or per ADBC record batch).
+    Args:
+        db_path (str): Path to the SQLite database file.
+        query (str): The SQL query.
+        batch_size (int): Rows per batch; defaults to STREAM_CHUNK_ROWS.
+        max_rows (int): Row cap; defaults to MAX_RESULT_ROWS, 0 disables it.
+        max_bytes (int): Arrow buffer size cap; defaults to MAX_RESULT_BYTES, 0 disables it.
+    Returns:
+        iterator: pa.Table batches.
+    """
+    max_rows = MAX_RESULT_ROWS if max_rows is None else max_rows
+    query = guard_sql('sqlite', {"db_path": db_path}, query, limit=max_rows + 1 if max_rows else None)
+    return _cap_tables(_sqlite_tables(db_path, query, batch_size or STREAM_CHUNK_ROWS), max_rows, max_bytes)
+
+def _postgres_uri(db_params):
+    params = postgres_params(db_params)
+    return (f"postgresql://{quote(params['user'] or '')}:{quote(params['password'] or '')}"
+            f"@{params['host']}:{params['port']}/{quote(params['dbname'] or '')}")
+
+def _postgres_copy_table(db_params, query):
+    with postgres_connection(db_params) as conn:
+        with conn.cursor() as cursor:
+            set_statement_timeout(cursor)
+            # Column names and types come from a zero-row run; the rows themselves arrive as CSV text
+            cursor.execute(f"SELECT * FROM ({query}) AS nlq_arrow LIMIT 0")
+            names = [col.name for col in cursor.description]
+            # Parse under positional names so duplicate column names (e.g., two joined 'id's) survive;
+            # _cap_tables then makes them unique
+            column_types = {}
+            for i, col in enumerate(cursor.description):
+                if col.type_code in POSTGRES_ARROW_TYPES:
+                    column_types[f"c{i}"] = POSTGRES_ARROW_TYPES[col.type_code]
+                elif col.type_code == POSTGRES_NUMERIC_OID:
+                    column_types[f"c{i}"] = (pa.decimal128(col.precision, col.scale)
+                                             if col.precision and col.scale is not None and col.precision <= 38
+                                             else pa.float64())
+            buffer = io.BytesIO()
+            cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true)", buffer)
+    buffer.seek(0)
+    table = pa_csv.read_csv(
+        buffer,
+        read_options=pa_csv.ReadOptions(column_names=[f"c{i}" for i in range(len(names))], skip_rows=1),
+        convert_options=pa_csv.ConvertOptions(
+            column_types=column_types,
+            # COPY writes NULL as an empty unquoted field and '' as a quoted one
+            null_values=[""],
+            strings_can_be_null=True,
+            quoted_strings_can_be_null=False,
+            true_values=["t"],
+            false_values=["f"],
+        ),
+    )
+    return table.rename_columns(names)
+
+def _postgres_tables(db_params, query):
+    if adbc_postgresql is not None:
+        with adbc_postgresql.connect(_postgres_uri(db_params)) as conn:
+            with conn.cursor() as cursor:
+                # The ADBC connection is not pooled, so a session-level timeout doesn't leak
+                set_statement_timeout(cursor, local=False)
+                cursor.execute(query)
+                for batch in cursor.fetch_record_batch():
+                    yield pa.Table.from_batches([batch])
+        return
+    yield _postgres_copy_table(db_params, query)
+
+def stream_postgres_arrow(db_params, query, max_rows=None, max_bytes=None):
+    """
+    Run a PostgreSQL query into Arrow without building Python row tuples.
+    Uses ADBC when installed; otherwise COPY (query) TO STDOUT as CSV, parsed by pyarrow
+    with column types taken from the query's result description.
+    Args:
+        db_params (dict): Connection parameters, as accepted by execute_postgres_query.
+        query (str): A single SELECT statement.
+        max_rows (int): Row cap, applied in SQL; defaults to MAX_RESULT_ROWS, 0 disables it.
+        max_bytes (int): Arrow buffer size cap; defaults to MAX_RESULT_BYTES, 0 disables it.
+    Returns:
+        iterator: pa.Table batches.
+    """
+    max_rows = MAX_RESULT_ROWS if max_rows is None else max_rows
+    query = query.strip().rstrip(';')
+    if max_rows:
+        # One extra row tells _cap_tables the result was cut
+        query = f"SELECT * FROM ({query}) AS nlq_capped LIMIT {max_rows + 1}"
+    # The cap is already in the SQL, so the guard can only reject
+    query = guard_sql('postgresql', db_params, query)
+    return _cap_tables(_postgres_tables(db_params, query), max_rows, max_bytes)
+
+def execute_sqlite_arrow(db_path, query, max_rows=None, max_bytes=None):
+    """Run a SQLite query into a single pa.Table; see stream_sqlite_arrow."""
+    return concat_tables(list(stream_sqlite_arrow(db_path, query, max_rows=max_rows, max_bytes=max_bytes)))
+
+def execute_postgres_arrow(db_params, query, max_rows=None, max_bytes=None):
+    """Run a PostgreSQL query into a single pa.Table; see stream_postgres_arrow."""
+    return concat_tables(list(stream_postgres_arrow(db_params, query, max_rows, max_bytes)))
@@ -0,0 +1,127 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from dotenv import load_dotenv
+from connection_manager import default_db_config
+from pipeline import RateLimiter, fetch_schemas, run_nlq
+from metrics import get_registry
+from profiling import NLQ_PROFILE, profile_request
+
+load_dotenv()
+
+DB_TYPES = ['sqlite', 'postgresql', 'mongodb', 'redis']
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 4))
+# LLM requests per minute across the whole batch; 0 disables the limit
+BATCH_LLM_RPM = float(os.getenv("BATCH_LLM_RPM", 60))
+
+def load_questions(path):
+    """
+    Read questions from a file.
+    Plain text files have one question per line; blank lines and lines starting with '#' are skipped.
+    .jsonl files have one {"question": ...} object per line, optionally with "db_types" to
+    override the targets for that question.
+    Args:
+        path (str): Path to the questions file.
+    Returns:
+        list: Dicts with "question" and optionally "db_types".
+    """
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            questions.append(json.loads(line) if path.endswith('.jsonl') else {"question": line})
+    return questions
+
+async def _run_one(index, item, db_type, db_config, schema, semaphore, limiter, output_dir, profile):
+    record = {"index": index, "question": item["question"], "db_type": db_type}
+    async with semaphore:
+        start = time.perf_counter()
+        profile_dir = os.path.join(output_dir, "profiles", f"{index:04d}_{db_type}")
+        if profile:
+            record["profile"] = profile_dir
+        try:
+            with profile_request(item["question"], profile_dir, enabled=profile):
+                answer = await run_nlq(item["question"], db_type, db_config, schema=schema, describe=False,
+                                       llm_limiter=limiter)
+            result = answer["result"]
+            result_file = os.path.join(output_dir, f"{index:04d}_{db_type}.csv")
+            result.to_csv(result_file, index=False)
+            record.update(status="ok", query=answer["query"], rows=len(result),
+                          result_file=result_file, timings=answer["timings"], trace=answer["trace"])
+        except Exception as e:
+            record.update(status="error", error=f"{type(e).__name__}: {str(e)}",
+                          timings={"total": time.perf_counter() - start})
+    print(f"[{record['status']}] #{index} {db_type}: {item['question']}")
+    return record
+
+async def run_batch(questions, db_types, output_dir, concurrency=None, llm_rpm=None, profile=False):
+    """
+    Answer many questions against several backends with bounded concurrency.
+    Schemas are detected once per backend and pooled connections are shared by every question.
+    Args:
+        questions (list): Dicts from load_questions.
+        db_types (list): Default targets for questions that don't name their own.
+        output_dir (str): Directory for per-question CSV results, results.jsonl and metrics.prom.
+        concurrency (int): Questions in flight at once; defaults to BATCH_CONCURRENCY.
+        llm_rpm (float): LLM requests per minute; defaults to BATCH_LLM_RPM, 0 disables the limit.
+        profile (bool): Save a profile of every run under <output_dir>/profiles/ (see profiling.py).
+    Returns:
+        list: One record per (question, db_type) with status, query, rows, error and stage timings.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    concurrency = concurrency or BATCH_CONCURRENCY
+    llm_rpm = BATCH_LLM_RPM if llm_rpm is None else llm_rpm
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = RateLimiter(llm_rpm) if llm_rpm else None
+
+    targets = {db_type: default_db_config(db_type)
+               for db_type in set(db_types).union(*(item.get("db_types", []) for item in questions))}
+    schemas = await fetch_schemas(targets)
+
+    tasks = []
+    skipped = []
+    for index, item in enumerate(questions):
+        for db_type in item.get("db_types", db_types):
+            schema = schemas[db_type]
+            if isinstance(schema, BaseException):
+                skipped.append({"index": index, "question": item["question"], "db_type": db_type,
+                                "status": "error", "error": f"Schema detection failed: {str(schema)}"})
+                continue
+            tasks.append(_run_one(index, item, db_type, targets[db_type], schema, semaphore, limiter, output_dir, profile))
+    records = skipped + list(await asyncio.gather(*tasks))
+    records.sort(key=lambda record: (record["index"], record["db_type"]))
+
+    with open(os.path.join(output_dir, "results.jsonl"), "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, default=str) + "\n")
+    with open(os.path.join(output_dir, "metrics.prom"), "w", encoding="utf-8") as f:
+        f.write(get_registry().render_prometheus())
+    return records
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a file of natural language questions against one or more databases.")
+    parser.add_argument("questions", help="Questions file: one per line, or .jsonl with {\"question\", \"db_types\"}")
+    parser.add_argument("--db", nargs="+", choices=DB_TYPES, default=["sqlite"], help="Target database types")
+    parser.add_argument("--output", default="batch_results", help="Output directory")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="Questions in flight at once")
+    parser.add_argument("--llm-rpm", type=float, default=BATCH_LLM_RPM, help="LLM requests per minute (0 = unlimited)")
+    parser.add_argument("--profile", action="store_true", default=NLQ_PROFILE, help="Save cProfile/tracemalloc artifacts per run")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    records = asyncio.run(run_batch(load_questions(args.questions), args.db, args.output,
+                                    args.concurrency, args.llm_rpm, args.profile))
+    failed = sum(record["status"] != "ok" for record in records)
+    print(f"Finished {len(records)} runs ({failed} failed) in {time.perf_counter() - start:.1f}s; "
+          f"results in {os.path.join(args.output, 'results.jsonl')}")
+    if args.profile:
+        print(f"Profiles in {os.path.join(args.output, 'profiles')} (stacks.collapsed is flame graph input)")
+    for (db_type, stage), latency in sorted(get_registry().percentiles().items()):
+        print(f"  {db_type:<10} {stage:<14} p50 {latency['p50']:.3f}s  p95 {latency['p95']:.3f}s  ({latency['count']} samples)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+import pandas as pd
+import pyarrow as pa
+from dotenv import load_dotenv
+from connection_manager import default_db_config, override_client, postgres_connection, get_mongo_client, get_redis_client
+from generate_data import generate_dataset, load_sqlite, load_postgres, load_mongodb, load_redis
+from llm_client import set_llm
+from schema_detector import get_schema
+from query_generator import generate_query
+from db_connectors import execute_sqlite_query, execute_postgres_query, execute_mongodb_query, execute_redis_query
+from arrow_results import execute_sqlite_arrow, execute_postgres_arrow
+from metrics import percentile
+from nlq_logging import get_logger
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+load_dotenv()
+logger = get_logger(__name__)
+
+DB_TYPES = ['sqlite', 'postgresql', 'mongodb', 'redis']
+# Generated SQLite files and the default results file live here
+BENCHMARK_DIR = os.getenv("BENCHMARK_DIR", "bench_data")
+# Dedicated targets on real servers; their contents are replaced on every run
+BENCHMARK_POSTGRES_DBNAME = os.getenv("BENCHMARK_POSTGRES_DBNAME", "nlq_bench")
+BENCHMARK_MONGODB_DBNAME = os.getenv("BENCHMARK_MONGODB_DBNAME", "nlq_bench")
+BENCHMARK_REDIS_DB = int(os.getenv("BENCHMARK_REDIS_DB", 15))
+BENCHMARK_REPEAT = int(os.getenv("BENCHMARK_REPEAT", 5))
+# Zipf exponent for customer/product popularity in the generated data (see generate_data.py)
+BENCHMARK_SKEW = float(os.getenv("BENCHMARK_SKEW", 1.0))
+# mongomock and fakeredis run everything in Python (mongomock's $lookup is quadratic); larger sizes are skipped
+STAND_IN_MAX_ORDERS = int(os.getenv("BENCHMARK_STAND_IN_MAX_ORDERS", 10000))
+# A workload is a regression when its p50 grows by more than this fraction over the baseline
+BENCHMARK_TOLERANCE = float(os.getenv("BENCHMARK_TOLERANCE", 0.2))
+# ...and by more than this many seconds, so sub-millisecond jitter isn't reported
+BENCHMARK_MIN_DELTA = float(os.getenv("BENCHMARK_MIN_DELTA", 0.001))
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+# Benchmark questions: (name, question, canned LLM output per query language). The SQL is fenced
+# and the JSON carries surrounding prose, as real model output does, so cleaning has work to do.
+CANNED_QUERIES = [
+    ("filter", "Show all shipped orders", {
+        'sql': "```sql\nSELECT * FROM orders WHERE status = 'Shipped';\n```",
+        'mongodb': {"collection": "orders", "pipeline": [{"$match": {"status": "Shipped"}}, {"$project": {"_id": 0}}]},
+        'redis': {"key": "order:*", "date_condition": {"gt": "2025-01-01"}},
+    }),
+    ("spending", "What is the total spending of each customer?", {
+        'sql': "```sql\nSELECT c.customer_id, c.first_name, c.last_name, SUM(o.total_price) AS total_spending\n"
+               "FROM orders o JOIN customers c ON o.customer_id = c.customer_id\n"
+               "GROUP BY c.customer_id, c.first_name, c.last_name;\n```",
+        'mongodb': {"collection": "orders", "pipeline": [
+            {"$group": {"_id": "$customer_id", "total_spending": {"$sum": "$total_price"}}},
+            {"$lookup": {"from": "customers", "localField": "_id", "foreignField": "customer_id", "as": "customer"}},
+            {"$unwind": "$customer"},
+            {"$project": {"_id": 0, "customer_id": "$_id", "first_name": "$customer.first_name",
+                          "last_name": "$customer.last_name", "total_spending": 1}}]},
+        'redis': {"key": "order:*", "nl_query": "total spending per customer"},
+    }),
+    ("category_quantity", "What is the total quantity ordered per product category?", {
+        'sql': "```sql\nSELECT p.category, SUM(o.quantity) AS total_quantity\n"
+               "FROM orders o JOIN products p ON o.product_id = p.product_id\nGROUP BY p.category;\n```",
+        'mongodb': {"collection": "orders", "pipeline": [
+            {"$group": {"_id": "$product_id", "quantity": {"$sum": "$quantity"}}},
+            {"$lookup": {"from": "products", "localField": "_id", "foreignField": "product_id", "as": "product"}},
+            {"$unwind": "$product"},
+            {"$group": {"_id": "$product.category", "total_quantity": {"$sum": "$quantity"}}},
+            {"$project": {"_id": 0, "category": "$_id", "total_quantity": 1}}]},
+        'redis': {"key": "order:*", "nl_query": "total quantity ordered per category"},
+    }),
+    ("filtered_join", "Show orders in 2025 for Electronics category products", {
+        'sql': "```sql\nSELECT o.*, p.name AS product_name\nFROM orders o JOIN products p ON o.product_id = p.product_id\n"
+               "WHERE p.category = 'Electronics' AND o.order_date >= '2025-01-01' AND o.order_date < '2026-01-01';\n```",
+        'mongodb': {"collection": "orders", "pipeline": [
+            {"$match": {"order_date": {"$gte": "2025-01-01", "$lt": "2026-01-01"}}},
+            {"$lookup": {"from": "products", "localField": "product_id", "foreignField": "product_id", "as": "product"}},
+            {"$unwind": "$product"},
+            {"$match": {"product.category": "Electronics"}},
+            {"$project": {"_id": 0, "product": 0}}]},
+        'redis': {"key": "order:*", "year": 2025, "category": "Electronics"},
+    }),
+]
+
+class FakeLLM:
+    """
+    Deterministic stand-in for the chat model.
+    invoke() answers a query-generation prompt with the canned output for the benchmark
+    question it contains, and any other prompt (e.g., schema descriptions) with a fixed text.
+    """
+
+    def __init__(self, db_type):
+        language = 'sql' if db_type in ['sqlite', 'postgresql'] else db_type
+        self.responses = {}
+        for _, question, outputs in CANNED_QUERIES:
+            output = outputs[language]
+            if not isinstance(output, str):
+                output = f"Here is the query:\n```json\n{json.dumps(output, indent=2)}\n```"
+            self.responses[question] = output
+
+    def invoke(self, prompt):
+        content = next((output for question, output in self.responses.items() if question in prompt),
+                       "Customers place orders for products.")
+        # Roughly four characters per token, as reported by the real client
+        usage = {"input_tokens": len(prompt) // 4, "output_tokens": len(content) // 4}
+        usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+        return SimpleNamespace(content=content, usage_metadata=usage)
+
+def _use_benchmark_redis_db():
+    # get_redis_client() picks its database from REDIS_DB, for the load and the queries alike
+    os.environ["REDIS_DB"] = str(BENCHMARK_REDIS_DB)
+
+def prepare_target(db_type, orders, stand_ins=False, skew=None):
+    """
+    Point db_type at a benchmark target holding `orders` generated orders.
+    SQLite files are generated once per size and skew under BENCHMARK_DIR and reused; server
+    targets (or the in-process stand-ins) are reloaded. A Redis server is switched to
+    BENCHMARK_REDIS_DB first, so the application's database is never overwritten.
+    Args:
+        db_type (str): The backend.
+        orders (int): Number of orders.
+        stand_ins (bool): Use mongomock/fakeredis instead of the MongoDB/Redis servers.
+        skew (float): Popularity skew of the generated data; defaults to BENCHMARK_SKEW.
+    Returns:
+        dict: The db_config to benchmark against.
+    """
+    skew = BENCHMARK_SKEW if skew is None else skew
+    if db_type == 'sqlite':
+        db_path = os.path.join(BENCHMARK_DIR, f"orders_{orders}_skew{skew:g}.db")
+        if not os.path.exists(db_path):
+            os.makedirs(BENCHMARK_DIR, exist_ok=True)
+            load_sqlite(db_path + ".tmp", generate_dataset(orders, skew=skew))
+            os.replace(db_path + ".tmp", db_path)
+        return {"db_path": db_path}
+    if db_type == 'postgresql':
+        db_config = dict(default_db_config('postgresql'), dbname=BENCHMARK_POSTGRES_DBNAME)
+        load_postgres(db_config, generate_dataset(orders, skew=skew))
+        return db_config
+    if db_type == 'mongodb':
+        if stand_ins:
+            override_client('mongodb', mongomock.MongoClient())
+        db_config = {"db_name": BENCHMARK_MONGODB_DBNAME}
+        load_mongodb(db_config["db_name"], generate_dataset(orders, skew=skew))
+        return db_config
+    if db_type == 'redis':
+        if stand_ins:
+            override_client('redis', fakeredis.FakeRedis(decode_responses=True))
+        else:
+            _use_benchmark_redis_db()
+        load_redis(generate_dataset(orders, skew=skew))
+        return {}
+    raise ValueError(f"Unsupported database type: {db_type}")
+
+def _result_rows(result):
+    # DataFrames and tables count their rows; a schema counts its tables; a query counts as one
+    if isinstance(result, (pd.DataFrame, pa.Table, dict)):
+        return len(result)
+    return 1
+
+def measure(fn, repeat=None):
+    """
+    Time fn over `repeat` runs after one warm-up run, then measure its peak traced memory in a
+    separate run so tracemalloc's overhead stays out of the timings.
+    Only Python allocations are traced; memory allocated inside database drivers is not.
+    Returns:
+        dict: runs, rows (in the last result), p50/p95/mean seconds, ops_per_s, rows_per_s and peak_mb.
+    """
+    repeat = repeat or BENCHMARK_REPEAT
+    fn()
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        durations.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    durations.sort()
+    rows = _result_rows(result)
+    p50 = percentile(durations, 0.5)
+    return {
+        "runs": repeat,
+        "rows": rows,
+        "p50": p50,
+        "p95": percentile(durations, 0.95),
+        "mean": sum(durations) / repeat,
+        "ops_per_s": repeat / sum(durations) if sum(durations) else float('inf'),
+        "rows_per_s": rows / p50 if p50 else float('inf'),
+        "peak_mb": peak / 1e6,
+    }
+
+def _executors(db_type, db_config):
+    # execute_* functions run directly, bypassing the result cache; name -> callable(query)
+    if db_type == 'sqlite':
+        return {"execute_sqlite_query": lambda query: execute_sqlite_query(db_config["db_path"], query),
+                "execute_sqlite_arrow": lambda query: execute_sqlite_arrow(db_config["db_path"], query)}
+    if db_type == 'postgresql':
+        return {"execute_postgres_query": lambda query: execute_postgres_query(db_config, query),
+                "execute_postgres_arrow": lambda query: execute_postgres_arrow(db_config, query)}
+    if db_type == 'mongodb':
+        return {"execute_mongodb_query": lambda query: execute_mongodb_query(db_config["db_name"], json.loads(query))}
+    return {"execute_redis_query": lambda query: execute_redis_query(json.loads(query))}
+
+def run_benchmarks(db_types, sizes, stand_ins=False, repeat=None, skew=None):
+    """
+    Run every workload for each backend and dataset size.
+    Workloads are schema detection, query generation with its post-processing (the LLM call
+    itself is FakeLLM, so this measures cleaning and validation), and each execute_* function
+    on the cleaned canned queries.
+    Returns:
+        list: Result dicts with backend, orders, workload and query plus the measure() fields.
+    """
+    results = []
+    for db_type in db_types:
+        set_llm(FakeLLM(db_type))
+        try:
+            for orders in sizes:
+                if stand_ins and db_type in ['mongodb', 'redis'] and orders > STAND_IN_MAX_ORDERS:
+                    logger.warning("Skipping %s with %d orders: above the stand-in limit of %d",
+                                   db_type, orders, STAND_IN_MAX_ORDERS)
+                    continue
+                start = time.perf_counter()
+                db_config = prepare_target(db_type, orders, stand_ins, skew)
+                logger.info("Prepared %s with %d orders in %.1fs", db_type, orders, time.perf_counter() - start)
+                schema = get_schema(db_type, db_config)
+                results.append({"backend": db_type, "orders": orders, "workload": "get_schema", "query": None,
+                                **measure(lambda: get_schema(db_type, db_config), repeat)})
+                for name, question, _ in CANNED_QUERIES:
+                    results.append({"backend": db_type, "orders": orders, "workload": "generate_query", "query": name,
+                                    **measure(lambda: generate_query(question, schema, db_type, use_cache=False), repeat)})
+                    query = generate_query(question, schema, db_type, use_cache=False)
+                    for workload, execute in _executors(db_type, db_config).items():
+                        results.append({"backend": db_type, "orders": orders, "workload": workload, "query": name,
+                                        **measure(lambda: execute(query), repeat)})
+        finally:
+            set_llm(None)
+            if db_type in ['mongodb', 'redis']:
+                override_client(db_type, None)
+    return results
+
+def result_key(result):
+    """Identify a result across runs, e.g. 'sqlite/10000/execute_sqlite_query/spending'."""
+    return "/".join(str(part) for part in (result["backend"], result["orders"], result["workload"], result["query"]) if part)
+
+def compare(results, baseline, tolerance=None):
+    """
+    Compare p50 latencies with a baseline run.
+    Args:
+        results (list): Current results.
+        baseline (list): Results loaded from a previous --output file.
+        tolerance (float): Allowed relative slowdown; defaults to BENCHMARK_TOLERANCE.
+    Returns:
+        list: (key, baseline p50, current p50, ratio, regressed) for results present in both.
+    """
+    tolerance = BENCHMARK_TOLERANCE if tolerance is None else tolerance
+    previous = {result_key(result): result for result in baseline}
+    rows = []
+    for result in results:
+        base = previous.get(result_key(result))
+        if base is None:
+            continue
+        ratio = result["p50"] / base["p50"] if base["p50"] else float('inf')
+        regressed = ratio > 1 + tolerance and result["p50"] - base["p50"] > BENCHMARK_MIN_DELTA
+        rows.append((result_key(result), base["p50"], result["p50"], ratio, regressed))
+    return rows
+
+def _reachable(db_type, stand_ins):
+    if db_type in ['mongodb', 'redis'] and stand_ins:
+        module = mongomock if db_type == 'mongodb' else fakeredis
+        if module is None:
+            logger.warning("Skipping %s: install %s for the in-process stand-in",
+                           db_type, 'mongomock' if db_type == 'mongodb' else 'fakeredis')
+        return module is not None
+    try:
+        if db_type == 'postgresql':
+            with postgres_connection(dict(default_db_config('postgresql'), dbname=BENCHMARK_POSTGRES_DBNAME)):
+                pass
+        elif db_type == 'mongodb':
+            get_mongo_client().admin.command("ping")
+        elif db_type == 'redis':
+            get_redis_client().ping()
+    except Exception as e:
+        logger.warning("Skipping %s: %s", db_type, e)
+        return False
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark schema detection, query post-processing and execution.")
+    parser.add_argument("--db", nargs="+", choices=DB_TYPES, default=['sqlite'], help="Backends to benchmark")
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES, help="Dataset sizes in orders (up to 10M)")
+    parser.add_argument("--stand-ins", action="store_true", help="Use mongomock/fakeredis instead of MongoDB/Redis servers")
+    parser.add_argument("--skew", type=float, default=BENCHMARK_SKEW, help="Customer/product popularity skew of the data")
+    parser.add_argument("--repeat", type=int, default=BENCHMARK_REPEAT, help="Timed runs per workload")
+    parser.add_argument("--output", default=os.path.join(BENCHMARK_DIR, "results.json"), help="Where to write the results")
+    parser.add_argument("--baseline", help="Results file of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=BENCHMARK_TOLERANCE, help="Allowed p50 slowdown (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    # Check reachability against the benchmark's Redis database too (prepare_target switches to it anyway)
+    _use_benchmark_redis_db()
+    db_types = [db_type for db_type in args.db if _reachable(db_type, args.stand_ins)]
+    results = run_benchmarks(db_types, args.sizes, args.stand_ins, args.repeat, args.skew)
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"{'benchmark':<56} {'rows':>8} {'p50 ms':>9} {'p95 ms':>9} {'ops/s':>9} {'rows/s':>11} {'peak MB':>8}")
+    for result in results:
+        print(f"{result_key(result):<56} {result['rows']:>8} {result['p50'] * 1000:>9.2f} {result['p95'] * 1000:>9.2f} "
+              f"{result['ops_per_s']:>9.1f} {result['rows_per_s']:>11.0f} {result['peak_mb']:>8.2f}")
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            rows = compare(results, json.load(f), args.tolerance)
+        regressions = [row for row in rows if row[4]]
+        print(f"\nCompared with {args.baseline} ({len(rows)} matching benchmarks):")
+        for key, before, after, ratio, regressed in rows:
+            print(f"{key:<56} {before * 1000:>9.2f} -> {after * 1000:>9.2f} ms  x{ratio:.2f}{'  REGRESSION' if regressed else ''}")
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) slower than the baseline by more than {args.tolerance:.0%}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
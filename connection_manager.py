@@ -0,0 +1,264 @@
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+import psycopg2
+from psycopg2 import pool as pg_pool
+from pymongo import MongoClient
+import redis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Pool size limits per backend
+SQLITE_POOL_MAX = int(os.getenv("SQLITE_POOL_MAX", 4))
+POSTGRES_POOL_MIN = int(os.getenv("POSTGRES_POOL_MIN", 1))
+POSTGRES_POOL_MAX = int(os.getenv("POSTGRES_POOL_MAX", 10))
+MONGODB_POOL_MAX = int(os.getenv("MONGODB_POOL_MAX", 20))
+REDIS_POOL_MAX = int(os.getenv("REDIS_POOL_MAX", 20))
+# Seconds to wait for a free connection before giving up
+POOL_TIMEOUT = float(os.getenv("POOL_TIMEOUT", 30))
+
+_lock = threading.Lock()
+_sqlite_pools = {}    # db_path -> (idle connection queue, open connection list)
+_postgres_pools = {}  # connection params -> (ThreadedConnectionPool, semaphore)
+_mongo_clients = {}   # uri -> MongoClient
+_redis_pools = {}     # (host, port, db) -> BlockingConnectionPool
+_client_overrides = {}  # 'mongodb' / 'redis' -> client returned instead of the pooled one
+
+def default_db_config(db_type):
+    """
+    Build the connection configuration for a backend from the environment.
+    Args:
+        db_type (str): One of 'sqlite', 'postgresql', 'mongodb' or 'redis'.
+    Returns:
+        dict: The db_config accepted by schema_detector.get_schema and db_connectors.execute_query.
+    """
+    if db_type == 'sqlite':
+        return {"db_path": os.getenv("SQLITE_DB_PATH", "sample.db")}
+    elif db_type == 'postgresql':
+        return {
+            "dbname": os.getenv("POSTGRES_DBNAME", "sample"),
+            "user": os.getenv("POSTGRES_USER", "postgres"),
+            "password": os.getenv("POSTGRES_PASSWORD", ""),
+            "host": os.getenv("POSTGRES_HOST", "localhost"),
+            "port": os.getenv("POSTGRES_PORT", "5432")
+        }
+    elif db_type == 'mongodb':
+        return {"db_name": os.getenv("MONGODB_DBNAME", "sample")}
+    elif db_type == 'redis':
+        return {}
+    raise ValueError(f"Unsupported database type: {db_type}")
+
+def postgres_params(db_params):
+    """Resolve dbname/user/password overrides against the environment; host and port always come from it."""
+    return {
+        "dbname": db_params.get("dbname", os.getenv("POSTGRES_DBNAME")),
+        "user": db_params.get("user", os.getenv("POSTGRES_USER")),
+        "password": db_params.get("password", os.getenv("POSTGRES_PASSWORD")),
+        "host": os.getenv("POSTGRES_HOST", "localhost"),
+        "port": os.getenv("POSTGRES_PORT", "5432"),
+    }
+
+@contextmanager
+def sqlite_connection(db_path):
+    """
+    Check out a reusable SQLite connection for db_path.
+    Connections are opened lazily up to SQLITE_POOL_MAX per file and returned to the pool on exit.
+    Args:
+        db_path (str): Path to the SQLite database file.
+    Yields:
+        sqlite3.Connection: A healthy connection.
+    """
+    with _lock:
+        if db_path not in _sqlite_pools:
+            _sqlite_pools[db_path] = (queue.LifoQueue(), [])
+        idle, opened = _sqlite_pools[db_path]
+        conn = None
+        if idle.empty() and len(opened) < SQLITE_POOL_MAX:
+            conn = sqlite3.connect(db_path, check_same_thread=False)
+            opened.append(conn)
+    if conn is None:
+        try:
+            conn = idle.get(timeout=POOL_TIMEOUT)
+        except queue.Empty:
+            raise TimeoutError(f"No SQLite connection for {db_path} became free within {POOL_TIMEOUT}s")
+        try:
+            conn.execute("SELECT 1")
+        except sqlite3.Error:
+            # Replace a connection that went bad while idle
+            with _lock:
+                opened.remove(conn)
+                conn = sqlite3.connect(db_path, check_same_thread=False)
+                opened.append(conn)
+    try:
+        yield conn
+    finally:
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            pass
+        idle.put(conn)
+
+@contextmanager
+def postgres_connection(db_params):
+    """
+    Check out a connection from the process-wide ThreadedConnectionPool for these parameters.
+    Callers block for up to POOL_TIMEOUT seconds when all POSTGRES_POOL_MAX connections are in use.
+    Args:
+        db_params (dict): dbname/user/password overrides; host and port come from the environment.
+    Yields:
+        psycopg2.extensions.connection: A live connection; any open transaction is rolled back on return.
+    """
+    params = postgres_params(db_params)
+    pool_key = tuple(sorted(params.items()))
+    with _lock:
+        if pool_key not in _postgres_pools:
+            _postgres_pools[pool_key] = (
+                pg_pool.ThreadedConnectionPool(POSTGRES_POOL_MIN, POSTGRES_POOL_MAX, **params),
+                threading.BoundedSemaphore(POSTGRES_POOL_MAX),
+            )
+        pool, slots = _postgres_pools[pool_key]
+    if not slots.acquire(timeout=POOL_TIMEOUT):
+        raise TimeoutError(f"No PostgreSQL connection became free within {POOL_TIMEOUT}s")
+    conn = None
+    try:
+        conn = pool.getconn()
+        if conn.closed:
+            # The server dropped this connection while it sat in the pool
+            pool.putconn(conn, close=True)
+            conn = pool.getconn()
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        if conn is not None:
+            pool.putconn(conn, close=True)
+            conn = None
+        raise
+    finally:
+        if conn is not None:
+            broken = bool(conn.closed)
+            if not broken:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+            pool.putconn(conn, close=broken)
+        slots.release()
+
+def get_mongo_client():
+    """
+    Return the long-lived MongoClient for MONGODB_URI; it pools connections internally.
+    Returns:
+        pymongo.MongoClient: The shared client. Do not close it.
+    """
+    mongodb_uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017/")
+    with _lock:
+        if 'mongodb' in _client_overrides:
+            return _client_overrides['mongodb']
+        if mongodb_uri not in _mongo_clients:
+            _mongo_clients[mongodb_uri] = MongoClient(mongodb_uri, maxPoolSize=MONGODB_POOL_MAX)
+        return _mongo_clients[mongodb_uri]
+
+def get_redis_client():
+    """
+    Return a Redis client backed by the shared connection pool.
+    Returns:
+        redis.Redis: A client with decode_responses=True. Closing it does not close the pool.
+    """
+    host = os.getenv("REDIS_HOST", "localhost")
+    port = int(os.getenv("REDIS_PORT", 6379))
+    db = int(os.getenv("REDIS_DB", 0))
+    with _lock:
+        if 'redis' in _client_overrides:
+            return _client_overrides['redis']
+        if (host, port, db) not in _redis_pools:
+            _redis_pools[(host, port, db)] = redis.BlockingConnectionPool(
+                host=host,
+                port=port,
+                db=db,
+                password=os.getenv("REDIS_PASSWORD", None),
+                decode_responses=True,
+                max_connections=REDIS_POOL_MAX,
+                timeout=POOL_TIMEOUT,
+                health_check_interval=30,
+            )
+        return redis.Redis(connection_pool=_redis_pools[(host, port, db)])
+
+def override_client(db_type, client):
+    """
+    Make get_mongo_client() or get_redis_client() return `client` instead of a pooled client,
+    e.g., a mongomock.MongoClient or fakeredis.FakeRedis(decode_responses=True) for benchmarks.
+    Args:
+        db_type (str): 'mongodb' or 'redis'.
+        client: The client to hand out, or None to go back to the pools.
+    """
+    if db_type not in ['mongodb', 'redis']:
+        raise ValueError(f"Client overrides are not supported for {db_type}")
+    with _lock:
+        if client is None:
+            _client_overrides.pop(db_type, None)
+        else:
+            _client_overrides[db_type] = client
+
+def health_check():
+    """
+    Ping every backend that has been used in this process.
+    Returns:
+        dict: Backend name -> "ok" or the error message.
+    """
+    status = {}
+    with _lock:
+        sqlite_paths = list(_sqlite_pools)
+        postgres_keys = list(_postgres_pools)
+        mongo_uris = list(_mongo_clients)
+        redis_keys = list(_redis_pools)
+    for db_path in sqlite_paths:
+        try:
+            with sqlite_connection(db_path) as conn:
+                conn.execute("SELECT 1")
+            status[f"sqlite:{db_path}"] = "ok"
+        except (sqlite3.Error, TimeoutError) as e:
+            status[f"sqlite:{db_path}"] = str(e)
+    for pool_key in postgres_keys:
+        params = dict(pool_key)
+        try:
+            with postgres_connection(params) as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+            status[f"postgresql:{params['dbname']}"] = "ok"
+        except (psycopg2.Error, TimeoutError) as e:
+            status[f"postgresql:{params['dbname']}"] = str(e)
+    for mongodb_uri in mongo_uris:
+        try:
+            _mongo_clients[mongodb_uri].admin.command("ping")
+            status["mongodb"] = "ok"
+        except Exception as e:
+            status["mongodb"] = str(e)
+    for host, port, db in redis_keys:
+        try:
+            redis.Redis(connection_pool=_redis_pools[(host, port, db)]).ping()
+            status[f"redis:{host}:{port}/{db}"] = "ok"
+        except redis.RedisError as e:
+            status[f"redis:{host}:{port}/{db}"] = str(e)
+    return status
+
+def close_all():
+    """Close every pooled connection and client. Registered to run at interpreter exit."""
+    with _lock:
+        for _, opened in _sqlite_pools.values():
+            for conn in opened:
+                conn.close()
+        _sqlite_pools.clear()
+        for pool, _ in _postgres_pools.values():
+            pool.closeall()
+        _postgres_pools.clear()
+        for client in _mongo_clients.values():
+            client.close()
+        _mongo_clients.clear()
+        for pool in _redis_pools.values():
+            pool.disconnect()
+        _redis_pools.clear()
+
+atexit.register(close_all)
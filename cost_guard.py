@@ -0,0 +1,215 @@
+import os
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+import psycopg2
+from dotenv import load_dotenv
+from connection_manager import sqlite_connection, postgres_connection
+from nlq_logging import get_logger
+
+load_dotenv()
+logger = get_logger(__name__)
+
+COST_GUARD_ENABLED = os.getenv("COST_GUARD_ENABLED", "1") == "1"
+# PostgreSQL planner cost units (the top node's total cost)
+COST_GUARD_MAX_COST = float(os.getenv("COST_GUARD_MAX_COST", 1e6))
+# Estimated rows a query reads (SQLite) or returns (PostgreSQL)
+COST_GUARD_MAX_ROWS = float(os.getenv("COST_GUARD_MAX_ROWS", 1e7))
+# 'limit' wraps an over-threshold query in a LIMIT when that brings it under; 'reject' never rewrites
+COST_GUARD_ACTION = os.getenv("COST_GUARD_ACTION", "limit")
+# Applied to every SQLite/PostgreSQL statement; 0 disables it
+COST_GUARD_STATEMENT_TIMEOUT_MS = int(os.getenv("COST_GUARD_STATEMENT_TIMEOUT_MS", 60000))
+
+SQL_KEYWORDS = {'ON', 'WHERE', 'JOIN', 'INNER', 'LEFT', 'RIGHT', 'FULL', 'OUTER', 'CROSS', 'NATURAL', 'GROUP',
+                'ORDER', 'LIMIT', 'USING', 'UNION', 'HAVING', 'AS', 'SELECT', 'OFFSET', 'WINDOW'}
+SQL_TABLE_REF = r'"?(\w+)"?(?:\s+(?:AS\s+)?"?(\w+)"?)?'
+# FROM a x, b y lists as well as JOIN b y
+SQL_FROM_PATTERN = re.compile(rf'\b(?:FROM|JOIN)\s+({SQL_TABLE_REF}(?:\s*,\s*{SQL_TABLE_REF})*)', re.IGNORECASE)
+SQL_TABLE_PATTERN = re.compile(SQL_TABLE_REF, re.IGNORECASE)
+SQL_LIMIT_PATTERN = re.compile(r'\bLIMIT\s+(\d+)(?:\s+OFFSET\s+\d+)?\s*;?\s*$', re.IGNORECASE)
+SQL_AGGREGATE_PATTERN = re.compile(r'\b(?:COUNT|SUM|AVG|MIN|MAX|TOTAL|GROUP_CONCAT)\s*\(', re.IGNORECASE)
+SQLITE_PLAN_PATTERN = re.compile(r'^(SCAN|SEARCH) (?:TABLE )?(\w+)')
+# SQLite's own guess for the rows an equality lookup on a non-unique index returns
+SQLITE_SEARCH_ROWS = 10
+
+class QueryRejectedError(ValueError):
+    """
+    A generated query was estimated to be too expensive to run.
+    The message states why and is meant to be passed back to generate_query as feedback.
+    """
+
+    def __init__(self, message, estimate):
+        super().__init__(message)
+        self.estimate = estimate
+
+def sql_tables(sql):
+    """
+    Find the tables a SQL query reads from.
+    Returns:
+        tuple: (tables in FROM/JOIN order, {alias or lower-cased table name: table}).
+    """
+    aliases = {}
+    tables = []
+    references = [reference for match in SQL_FROM_PATTERN.finditer(sql) for reference in match.group(1).split(',')]
+    for reference in references:
+        table, alias = SQL_TABLE_PATTERN.match(reference.strip()).groups()
+        tables.append(table)
+        aliases[table.lower()] = table
+        if alias and alias.upper() not in SQL_KEYWORDS:
+            aliases[alias.lower()] = table
+    return list(dict.fromkeys(tables)), aliases
+
+def _sqlite_table_rows(conn, table):
+    # MAX(rowid) is a single b-tree seek; tables without a rowid (and CTEs) count as one row
+    try:
+        return conn.execute(f'SELECT MAX(rowid) FROM "{table}"').fetchone()[0] or 0
+    except sqlite3.Error:
+        return 1
+
+def _sqlite_estimate(db_path, query):
+    _, aliases = sql_tables(query)
+    with sqlite_connection(db_path) as conn:
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()
+        # Plan rows under the same parent are nested loops: their row estimates multiply
+        loops = {}
+        full_scans = []
+        nested_scans = {}
+        for _, parent, _, detail in plan:
+            match = SQLITE_PLAN_PATTERN.match(detail)
+            if not match:
+                continue
+            table = aliases.get(match.group(2).lower(), match.group(2))
+            if match.group(1) == 'SCAN':
+                rows = _sqlite_table_rows(conn, table)
+                full_scans.append(table)
+                nested_scans.setdefault(parent, []).append(table)
+            elif 'rowid=?' in detail or 'PRIMARY KEY' in detail:
+                rows = 1
+            else:
+                rows = SQLITE_SEARCH_ROWS
+            loops[parent] = loops.get(parent, 1) * max(rows, 1)
+    rows = sum(loops.values())
+    limit = SQL_LIMIT_PATTERN.search(query)
+    blocking = any('TEMP B-TREE' in row[3] for row in plan) or SQL_AGGREGATE_PATTERN.search(query)
+    if limit and not blocking:
+        # A streaming plan stops once LIMIT rows have been produced
+        rows = min(rows, int(limit.group(1)))
+    cartesian = [tables for tables in nested_scans.values() if len(tables) > 1]
+    return {"cost": None, "rows": rows, "full_scans": sorted(set(full_scans)),
+            "cartesian": sorted(set(cartesian[0])) if cartesian else []}
+
+def _walk_plan(node):
+    yield node
+    for child in node.get('Plans', []):
+        yield from _walk_plan(child)
+
+def _postgres_estimate(db_config, query):
+    with postgres_connection(db_config) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {query.strip().rstrip(';')}")
+            plan = cursor.fetchone()[0][0]["Plan"]
+    nodes = list(_walk_plan(plan))
+    # A nested loop with no join condition anywhere below it is a cross join
+    cartesian = [node for node in nodes if node['Node Type'] == 'Nested Loop' and 'Join Filter' not in node
+                 and not any('Index Cond' in child or 'Recheck Cond' in child for child in _walk_plan(node))]
+    return {
+        "cost": plan["Total Cost"],
+        "rows": plan["Plan Rows"],
+        "full_scans": sorted({node['Relation Name'] for node in nodes if node['Node Type'] == 'Seq Scan'}),
+        "cartesian": sorted({child['Relation Name'] for node in cartesian[:1] for child in _walk_plan(node)
+                             if 'Relation Name' in child}),
+    }
+
+def estimate_query(db_type, db_config, query):
+    """
+    EXPLAIN a SQL query without running it.
+    SQLite has no cost model, so its estimate multiplies the table sizes of nested full scans.
+    Args:
+        db_type (str): 'sqlite' or 'postgresql'.
+        db_config (dict): The backend configuration.
+        query (str): The SQL query.
+    Returns:
+        dict: cost (PostgreSQL only), rows, full_scans (tables) and cartesian (tables cross-joined, if any).
+    """
+    if db_type == 'sqlite':
+        return _sqlite_estimate(db_config["db_path"], query)
+    elif db_type == 'postgresql':
+        return _postgres_estimate(db_config, query)
+    raise ValueError(f"Cost estimates are not supported for {db_type}")
+
+def _over_threshold(estimate):
+    reasons = []
+    if estimate["cost"] is not None and estimate["cost"] > COST_GUARD_MAX_COST:
+        reasons.append(f"estimated cost {estimate['cost']:.3g} exceeds {COST_GUARD_MAX_COST:.3g}")
+    if estimate["rows"] > COST_GUARD_MAX_ROWS:
+        reasons.append(f"estimated {estimate['rows']:.3g} rows exceed {COST_GUARD_MAX_ROWS:.3g}")
+    return reasons
+
+def guard_sql(db_type, db_config, query, limit=None):
+    """
+    Check a SQL query's planner estimate before it runs.
+    Queries over COST_GUARD_MAX_COST/COST_GUARD_MAX_ROWS are wrapped in a LIMIT if that brings
+    them under (COST_GUARD_ACTION='limit'), otherwise rejected.
+    Args:
+        db_type (str): 'sqlite' or 'postgresql'.
+        db_config (dict): The backend configuration.
+        query (str): The SQL query.
+        limit (int): Rows to keep when rewriting; None never rewrites.
+    Returns:
+        str: The query to run, possibly rewritten.
+    Raises:
+        QueryRejectedError: The query is too expensive even with a LIMIT.
+    """
+    if not COST_GUARD_ENABLED:
+        return query
+    try:
+        estimate = estimate_query(db_type, db_config, query)
+    except (sqlite3.Error, psycopg2.Error) as e:
+        # Invalid SQL fails the same way when executed; let that report the error
+        logger.warning("Cost estimate failed: %s", e)
+        return query
+    reasons = _over_threshold(estimate)
+    if not reasons:
+        return query
+    if COST_GUARD_ACTION == 'limit' and limit and not SQL_LIMIT_PATTERN.search(query):
+        limited = f"SELECT * FROM ({query.strip().rstrip(';')}) AS nlq_guarded LIMIT {limit}"
+        try:
+            if not _over_threshold(estimate_query(db_type, db_config, limited)):
+                logger.info("Cost guard added LIMIT %d: %s", limit, "; ".join(reasons))
+                return limited
+        except (sqlite3.Error, psycopg2.Error) as e:
+            logger.warning("Cost estimate failed: %s", e)
+    message = "; ".join(reasons)
+    if estimate["cartesian"]:
+        message += f". {' and '.join(estimate['cartesian'])} are cross-joined: add a join condition"
+    elif estimate["full_scans"]:
+        message += f". Full scans of {', '.join(estimate['full_scans'])}: add a selective WHERE clause or a LIMIT"
+    raise QueryRejectedError(message, estimate)
+
+@contextmanager
+def sqlite_deadline(conn, timeout_ms=None):
+    """
+    Interrupt statements on conn that run past timeout_ms (default COST_GUARD_STATEMENT_TIMEOUT_MS).
+    An interrupted statement raises sqlite3.OperationalError('interrupted').
+    """
+    timeout_ms = COST_GUARD_STATEMENT_TIMEOUT_MS if timeout_ms is None else timeout_ms
+    if not timeout_ms:
+        yield conn
+        return
+    deadline = time.monotonic() + timeout_ms / 1000
+    conn.set_progress_handler(lambda: time.monotonic() > deadline, 10000)
+    try:
+        yield conn
+    finally:
+        conn.set_progress_handler(None, 0)
+
+def set_statement_timeout(cursor, timeout_ms=None, local=True):
+    """
+    Set PostgreSQL's statement_timeout on the cursor's connection (default COST_GUARD_STATEMENT_TIMEOUT_MS).
+    With local=True the setting lasts until the current transaction ends, so it doesn't leak
+    into other users of a pooled connection.
+    """
+    timeout_ms = COST_GUARD_STATEMENT_TIMEOUT_MS if timeout_ms is None else timeout_ms
+    if timeout_ms:
+        cursor.execute(f"SET {'LOCAL ' if local else ''}statement_timeout = {int(timeout_ms)}")
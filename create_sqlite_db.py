@@ -87,6 +87,12 @@ cursor.execute("INSERT INTO orders (order_id, customer_id, product_id, quantity,
 cursor.execute("INSERT INTO orders (order_id, customer_id, product_id, quantity, order_date, status, total_price, shipping_address, payment_method) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", 
                (5, 4, 4, 3, '2025-05-01', 'Shipped', 119.97, '101 Elm St, Sydney, Australia', 'Credit Card'))
 
+# Indexes on the join keys and the columns questions most often filter on
+cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_customer_id ON orders (customer_id)")
+cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_product_id ON orders (product_id)")
+cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_order_date ON orders (order_date)")
+cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_category ON products (category)")
+
 # Commit changes and close connection
 conn.commit()
 conn.close()
\ No newline at end of file
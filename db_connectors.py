@@ -1,271 +1,680 @@
-import sqlite3
-import psycopg2
-from pymongo import MongoClient
 import redis
 import pandas as pd
 from bson.objectid import ObjectId
+import json
 import os
+import uuid
 from dotenv import load_dotenv
+from redis_utils import scan_keys, chunked, decode_frame
+from redis_indexes import resolve_candidate_keys
+from result_cache import cached_result
+from connection_manager import sqlite_connection, postgres_connection, get_mongo_client, get_redis_client
+from cost_guard import guard_sql, sqlite_deadline, set_statement_timeout
+from nlq_logging import get_logger
 
 # Load environment variables
 load_dotenv()
+logger = get_logger(__name__)
+
+# Number of Redis keys fetched and joined per pipelined round trip
+REDIS_CHUNK_SIZE = int(os.getenv("REDIS_CHUNK_SIZE", 1000))
+# Rows per DataFrame chunk when streaming results
+STREAM_CHUNK_ROWS = int(os.getenv("STREAM_CHUNK_ROWS", 5000))
+# Hard caps on streamed results so a runaway query cannot exhaust memory (0 disables a cap)
+MAX_RESULT_ROWS = int(os.getenv("MAX_RESULT_ROWS", 100000))
+MAX_RESULT_BYTES = int(os.getenv("MAX_RESULT_BYTES", 256 * 1024 * 1024))
+# Server-side cursor batch size and time limit for MongoDB queries
+MONGODB_BATCH_SIZE = int(os.getenv("MONGODB_BATCH_SIZE", 1000))
+MONGODB_MAX_TIME_MS = int(os.getenv("MONGODB_MAX_TIME_MS", 60000))
+
+# nl_query phrases that execute_redis_query answers by aggregating or reshaping the joined rows
+REDIS_INTENTS = ['total spending', 'total quantity ordered', 'average total price', 'phone numbers', 'names and emails']
+# Intents that reduce the joined rows to one row per group; the rest are row-wise projections
+REDIS_AGGREGATE_INTENTS = ['total spending', 'total quantity ordered', 'average total price', 'phone numbers']
+# Columns of the enriched customer+product+order view (after customer_name) -> joined column
+ENRICHED_COLUMNS = {
+    'email': 'customer_email',
+    'phone': 'customer_phone',
+    'city': 'customer_city',
+    'country': 'customer_country',
+    'credit_limit': 'customer_credit_limit',
+    'registration_date': 'customer_registration_date',
+    'product_name': 'product_name',
+    'category': 'product_category',
+    'price': 'product_price',
+    'stock_quantity': 'product_stock_quantity',
+    'manufacturer': 'product_manufacturer',
+    'release_date': 'product_release_date',
+    'discount': 'product_discount',
+    'order_id': 'order_id',
+    'quantity': 'quantity',
+    'order_date': 'order_date',
+    'total_price': 'total_price',
+    'status': 'status',
+    'shipping_address': 'shipping_address',
+    'payment_method': 'payment_method',
+}
+
+def _read_capped(query, conn, max_rows):
+    # Build at most max_rows + 1 rows; the extra one tells whether the result was cut
+    if not max_rows:
+        return pd.read_sql_query(query, conn)
+    chunks = pd.read_sql_query(query, conn, chunksize=max_rows + 1)
+    try:
+        df = next(chunks)
+    finally:
+        chunks.close()
+    if len(df) > max_rows:
+        df = df.iloc[:max_rows]
+        df.attrs['truncated'] = True
+    return df
 
-def execute_sqlite_query(db_path, query):
-    conn = sqlite3.connect(db_path)
-    df = pd.read_sql_query(query, conn)
-    conn.close()
+def execute_sqlite_query(db_path, query, max_rows=None):
+    """
+    Run a SQLite query after the cost guard has checked it.
+    Args:
+        db_path (str): Path to the SQLite database file.
+        query (str): The SQL query.
+        max_rows (int): Row cap; defaults to MAX_RESULT_ROWS, 0 disables it.
+    Returns:
+        pd.DataFrame: The result; attrs['truncated'] is set if capped.
+    """
+    max_rows = MAX_RESULT_ROWS if max_rows is None else max_rows
+    query = guard_sql('sqlite', {"db_path": db_path}, query, limit=max_rows + 1 if max_rows else None)
+    with sqlite_connection(db_path) as conn:
+        with sqlite_deadline(conn):
+            return _read_capped(query, conn, max_rows)
+
+def execute_postgres_query(db_params, query, max_rows=None):
+    """
+    Run a PostgreSQL query after the cost guard has checked it, under the statement timeout.
+    Args:
+        db_params (dict): Connection parameters.
+        query (str): The SQL query.
+        max_rows (int): Row cap; defaults to MAX_RESULT_ROWS, 0 disables it.
+    Returns:
+        pd.DataFrame: The result; attrs['truncated'] is set if capped.
+    """
+    max_rows = MAX_RESULT_ROWS if max_rows is None else max_rows
+    query = guard_sql('postgresql', db_params, query, limit=max_rows + 1 if max_rows else None)
+    with postgres_connection(db_params) as conn:
+        with conn.cursor() as cursor:
+            set_statement_timeout(cursor)
+        return _read_capped(query, conn, max_rows)
+
+def parse_mongodb_query(query):
+    """
+    Split a generated MongoDB query into its target collection and operation.
+    Args:
+        query (list or dict): {"collection", "pipeline"}, a bare pipeline list (run on 'orders'),
+            or a {"collection", "filter"} find query.
+    Returns:
+        tuple: (collection name, 'aggregate' or 'find', pipeline list or filter dict).
+    """
+    if isinstance(query, list):
+        # Bare pipelines predate the {"collection", "pipeline"} format and target the orders collection
+        return 'orders', 'aggregate', query
+    if 'pipeline' in query:
+        return query.get('collection') or 'orders', 'aggregate', query['pipeline']
+    return query.get('collection', 'orders'), 'find', query.get('filter', {})
+
+def _mongodb_cursor(db_name, query, batch_size=None, limit=None):
+    db = get_mongo_client()[db_name]
+    collection, operation, spec = parse_mongodb_query(query)
+    batch_size = batch_size or MONGODB_BATCH_SIZE
+    if operation == 'aggregate':
+        pipeline = list(spec)
+        # $out/$merge must stay the last stage, so write pipelines get no safety limit
+        if limit and not (pipeline and ({'$out', '$merge'} & set(pipeline[-1]))):
+            pipeline.append({'$limit': limit})
+        # allowDiskUse lets $group/$sort spill past the 100MB per-stage memory limit on the server
+        return db[collection].aggregate(pipeline, allowDiskUse=True, batchSize=batch_size,
+                                        maxTimeMS=MONGODB_MAX_TIME_MS)
+    results = db[collection].find(spec).batch_size(batch_size).max_time_ms(MONGODB_MAX_TIME_MS)
+    return results.limit(limit) if limit else results
+
+def _stringify_object_ids(df):
+    # Convert ObjectId values column by column once the batch is a DataFrame
+    for column in df.columns:
+        if df[column].dtype != object:
+            continue
+        is_object_id = df[column].map(type) == ObjectId
+        if is_object_id.any():
+            df.loc[is_object_id, column] = df.loc[is_object_id, column].astype(str)
     return df
 
-def execute_postgres_query(db_params, query):
-    conn = psycopg2.connect(
-        dbname=db_params.get("dbname", os.getenv("POSTGRES_DBNAME")),
-        user=db_params.get("user", os.getenv("POSTGRES_USER")),
-        password=db_params.get("password", os.getenv("POSTGRES_PASSWORD")),
-        host=os.getenv("POSTGRES_HOST", "localhost"),
-        port=os.getenv("POSTGRES_PORT", "5432")
-    )
-    df = pd.read_sql_query(query, conn)
-    conn.close()
+def _mongodb_chunks(db_name, query, batch_size, limit=None):
+    results = _mongodb_cursor(db_name, query, batch_size, limit)
+    try:
+        for batch in chunked(results, batch_size):
+            yield _stringify_object_ids(pd.DataFrame(batch))
+    finally:
+        results.close()
+
+def execute_mongodb_query(db_name, query, max_rows=None):
+    """
+    Run a MongoDB query, building the DataFrame one cursor batch at a time.
+    Args:
+        db_name (str): The database name.
+        query (list or dict): As accepted by parse_mongodb_query.
+        max_rows (int): Safety $limit; defaults to MAX_RESULT_ROWS, 0 disables it.
+    Returns:
+        pd.DataFrame: The documents, with ObjectIds as strings; attrs['truncated'] is set if capped.
+    """
+    max_rows = MAX_RESULT_ROWS if max_rows is None else max_rows
+    # One extra document tells us whether the limit cut the result
+    frames = list(_mongodb_chunks(db_name, query, MONGODB_BATCH_SIZE, max_rows + 1 if max_rows else None))
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    if max_rows and len(df) > max_rows:
+        df = df.iloc[:max_rows]
+        df.attrs['truncated'] = True
     return df
 
-def execute_mongodb_query(db_name, query):
-    mongodb_uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017/")
-    client = MongoClient(mongodb_uri)
-    db = client[db_name]
+def _cap_chunks(chunks, max_rows=None, max_bytes=None):
+    """
+    Pass DataFrame chunks through until the row or byte cap is reached, then stop the source.
+    The last chunk of a truncated stream carries attrs['truncated'] = True.
+    """
+    max_rows = MAX_RESULT_ROWS if max_rows is None else max_rows
+    max_bytes = MAX_RESULT_BYTES if max_bytes is None else max_bytes
+    rows = 0
+    size = 0
     try:
-        # Check if query is a list (aggregation pipeline) or a dictionary (find query)
-        if isinstance(query, list):
-            # Use the 'orders' collection for aggregation pipelines
-            collection = db['orders']
-            results = collection.aggregate(query)
-        else:
-            # Fallback for find queries (though not expected with current query_generator.py)
-            collection = db[query.get('collection', 'orders')]
-            results = collection.find(query.get('filter', {}))
-
-        # Convert results to a list and handle ObjectId
-        results_list = []
-        for doc in results:
-            if '_id' in doc:
-                doc['_id'] = str(doc['_id'])  # Convert ObjectId to string
-            results_list.append(doc)
-        
-        df = pd.DataFrame(results_list) if results_list else pd.DataFrame()
-        return df
+        for chunk in chunks:
+            truncated = False
+            if max_rows and rows + len(chunk) > max_rows:
+                chunk = chunk.iloc[:max_rows - rows]
+                truncated = True
+            chunk_bytes = int(chunk.memory_usage(index=False, deep=True).sum())
+            if max_bytes and size + chunk_bytes > max_bytes:
+                # Keep as many rows as fit, assuming evenly sized rows within the chunk
+                keep = int(len(chunk) * (max_bytes - size) / chunk_bytes)
+                chunk = chunk.iloc[:keep]
+                chunk_bytes = int(chunk.memory_usage(index=False, deep=True).sum())
+                truncated = True
+            rows += len(chunk)
+            size += chunk_bytes
+            if truncated:
+                logger.info("Result truncated at %d rows / %d bytes", rows, size)
+                chunk.attrs['truncated'] = True
+                yield chunk
+                return
+            yield chunk
     finally:
-        client.close()
-
-def execute_redis_query(query):
-    r = redis.Redis(
-        host=os.getenv("REDIS_HOST", "localhost"),
-        port=int(os.getenv("REDIS_PORT", 6379)),
-        password=os.getenv("REDIS_PASSWORD", None),
-        decode_responses=True
-    )
+        # Release the cursor and pooled connection even if the consumer stops early
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+def _sqlite_chunks(db_path, query, chunksize):
+    with sqlite_connection(db_path) as conn:
+        with sqlite_deadline(conn):
+            yield from pd.read_sql_query(query, conn, chunksize=chunksize)
+
+def stream_sqlite_query(db_path, query, chunksize=None, max_rows=None, max_bytes=None):
+    """
+    Stream a SQLite query as DataFrame chunks read with fetchmany.
+    Args:
+        db_path (str): Path to the SQLite database file.
+        query (str): The SQL query.
+        chunksize (int): Rows per chunk; defaults to STREAM_CHUNK_ROWS.
+        max_rows (int): Row cap; defaults to MAX_RESULT_ROWS, 0 disables it.
+        max_bytes (int): In-memory size cap; defaults to MAX_RESULT_BYTES, 0 disables it.
+    Returns:
+        iterator: DataFrame chunks.
+    """
+    max_rows = MAX_RESULT_ROWS if max_rows is None else max_rows
+    query = guard_sql('sqlite', {"db_path": db_path}, query, limit=max_rows + 1 if max_rows else None)
+    return _cap_chunks(_sqlite_chunks(db_path, query, chunksize or STREAM_CHUNK_ROWS), max_rows, max_bytes)
+
+def _postgres_chunks(db_params, query, chunksize):
+    with postgres_connection(db_params) as conn:
+        # A named cursor is server-side: rows stay in PostgreSQL until fetched
+        with conn.cursor() as cursor:
+            set_statement_timeout(cursor)
+        with conn.cursor(name=f"nlq_stream_{uuid.uuid4().hex}") as cursor:
+            cursor.itersize = chunksize
+            cursor.execute(query.strip().rstrip(';'))
+            while True:
+                rows = cursor.fetchmany(chunksize)
+                if not rows:
+                    break
+                yield pd.DataFrame(rows, columns=[col[0] for col in cursor.description])
+
+def stream_postgres_query(db_params, query, chunksize=None, max_rows=None, max_bytes=None):
+    """
+    Stream a PostgreSQL query as DataFrame chunks through a server-side cursor.
+    Args:
+        db_params (dict): Connection parameters, as accepted by execute_postgres_query.
+        query (str): A single SELECT statement.
+        chunksize (int): Rows per chunk; defaults to STREAM_CHUNK_ROWS.
+        max_rows (int): Row cap; defaults to MAX_RESULT_ROWS, 0 disables it.
+        max_bytes (int): In-memory size cap; defaults to MAX_RESULT_BYTES, 0 disables it.
+    Returns:
+        iterator: DataFrame chunks.
+    """
+    max_rows = MAX_RESULT_ROWS if max_rows is None else max_rows
+    query = guard_sql('postgresql', db_params, query, limit=max_rows + 1 if max_rows else None)
+    return _cap_chunks(_postgres_chunks(db_params, query, chunksize or STREAM_CHUNK_ROWS), max_rows, max_bytes)
+
+def stream_mongodb_query(db_name, query, batch_size=None, max_rows=None, max_bytes=None):
+    """
+    Stream a MongoDB query as DataFrame chunks, one per cursor batch.
+    Args:
+        db_name (str): The database name.
+        query (list or dict): As accepted by parse_mongodb_query.
+        batch_size (int): Documents per batch and chunk; defaults to STREAM_CHUNK_ROWS.
+        max_rows (int): Row cap, also sent as a $limit stage; defaults to MAX_RESULT_ROWS, 0 disables it.
+        max_bytes (int): In-memory size cap; defaults to MAX_RESULT_BYTES, 0 disables it.
+    Returns:
+        iterator: DataFrame chunks.
+    """
+    max_rows = MAX_RESULT_ROWS if max_rows is None else max_rows
+    limit = max_rows + 1 if max_rows else None
+    return _cap_chunks(_mongodb_chunks(db_name, query, batch_size or STREAM_CHUNK_ROWS, limit), max_rows, max_bytes)
+
+def plan_redis_filters(query):
+    """
+    Translate the filter fields of a Redis query into predicates that can be checked while fetching.
+    Args:
+        query (dict): The Redis query.
+    Returns:
+        list: (entity, column, op, value) tuples. entity is 'base' for the scanned hash itself,
+        or 'customer'/'product' for the joined hash; column is the joined DataFrame column
+        and op is one of 'eq', 'startswith', 'gt' or 'lt'.
+    Raises:
+        ValueError: If a numeric condition has a non-numeric value.
+    """
+    predicates = []
+    if 'year' in query:
+        predicates.append(('base', 'order_date', 'startswith', str(query['year'])))
+    if 'category' in query:
+        predicates.append(('product', 'product_category', 'eq', query['category']))
+    if 'manufacturer' in query:
+        predicates.append(('product', 'product_manufacturer', 'eq', query['manufacturer']))
+    if 'customer_city' in query:
+        predicates.append(('customer', 'customer_city', 'eq', query['customer_city']))
+    if 'price_condition' in query:
+        try:
+            if query['price_condition'].get('gt'):
+                predicates.append(('product', 'product_price', 'gt', float(query['price_condition']['gt'])))
+            elif query['price_condition'].get('lt'):
+                predicates.append(('product', 'product_price', 'lt', float(query['price_condition']['lt'])))
+        except (ValueError, TypeError, AttributeError) as e:
+            raise ValueError(f"Invalid price_condition {query['price_condition']}: {str(e)}")
+    numeric_conditions = [
+        ('discount_condition', 'product', 'product_discount'),
+        ('stock_condition', 'product', 'product_stock_quantity'),
+        ('credit_limit_condition', 'customer', 'customer_credit_limit'),
+    ]
+    string_conditions = [
+        ('date_condition', 'base', 'order_date'),
+        ('release_date_condition', 'product', 'product_release_date'),
+    ]
+    for condition, entity, column in numeric_conditions + string_conditions:
+        if condition not in query:
+            continue
+        for op in ['gt', 'lt']:
+            if op in query[condition]:
+                value = query[condition][op]
+                if (condition, entity, column) in numeric_conditions:
+                    try:
+                        value = float(value)
+                    except (ValueError, TypeError) as e:
+                        raise ValueError(f"Invalid {condition} {query[condition]}: {str(e)}")
+                predicates.append((entity, column, op, value))
+    return predicates
+
+def _matches(record, predicates):
+    for _, column, op, value in predicates:
+        field = record.get(column)
+        if field is None:
+            return False
+        try:
+            if isinstance(value, float):
+                field = float(field)
+            if op == 'eq':
+                matched = field == value
+            elif op == 'startswith':
+                matched = isinstance(field, str) and field.startswith(value)
+            elif op == 'gt':
+                matched = field > value
+            else:
+                matched = field < value
+        except (ValueError, TypeError):
+            matched = False
+        if not matched:
+            return False
+    return True
+
+def _join_redis_chunk(r, keys, customers, products, predicates=(), verdicts=None):
+    """
+    Fetch, filter and join one chunk of Redis keys using two pipelined round trips.
+    Predicates on the scanned hash are checked before any joins are fetched, and predicates on
+    a customer or product are evaluated once per id, so failing rows are never joined.
+    Args:
+        r (redis.Redis): The Redis client.
+        keys (list): The keys in this chunk.
+        customers (dict): Raw customer hashes (customer_-prefixed fields) by id, shared across chunks.
+        products (dict): Raw product hashes (product_-prefixed fields) by id, shared across chunks.
+        predicates (list): Filters from plan_redis_filters.
+        verdicts (dict): (entity, id) -> whether that customer/product passes, shared across chunks.
+    Returns:
+        pd.DataFrame: One row per matching hash key, with typed columns decoded once per chunk.
+    """
+    verdicts = {} if verdicts is None else verdicts
+    base_predicates = [p for p in predicates if p[0] == 'base']
+    entity_predicates = {
+        entity: [p for p in predicates if p[0] == entity] for entity in ['customer', 'product']
+    }
+
+    # Round trip 1: TYPE and HGETALL for every key in the chunk
+    pipe = r.pipeline(transaction=False)
+    for key in keys:
+        pipe.type(key)
+        pipe.hgetall(key)
+    replies = pipe.execute(raise_on_error=False)
+
+    records = []
+    skipped = 0
+    for key, key_type, order_data in zip(keys, replies[0::2], replies[1::2]):
+        if key_type != 'hash' or not order_data:
+            skipped += 1
+            continue
+        record = {'key': key, **order_data}
+        # Predicates compare raw strings (numeric ones cast per value), so decoding waits until the join
+        # Skip rows whose own fields, or an already rejected customer/product, rule them out
+        if not _matches(record, base_predicates):
+            continue
+        if verdicts.get(('customer', record.get('customer_id'))) is False:
+            continue
+        if verdicts.get(('product', record.get('product_id'))) is False:
+            continue
+        records.append(record)
+    if skipped:
+        logger.debug("Skipped %d of %d keys that are not non-empty hashes", skipped, len(keys))
+
+    # Round trip 2: customers and products not seen in earlier chunks, deduplicated
+    customer_ids = {rec['customer_id'] for rec in records if rec.get('customer_id')} - customers.keys()
+    product_ids = {rec['product_id'] for rec in records if rec.get('product_id')} - products.keys()
+    if customer_ids or product_ids:
+        customer_ids = list(customer_ids)
+        product_ids = list(product_ids)
+        pipe = r.pipeline(transaction=False)
+        for customer_id in customer_ids:
+            pipe.hgetall(f"customer:{customer_id}")
+        for product_id in product_ids:
+            pipe.hgetall(f"product:{product_id}")
+        replies = pipe.execute()
+        for customer_id, customer_data in zip(customer_ids, replies[:len(customer_ids)]):
+            customers[customer_id] = {f"customer_{field}": value for field, value in customer_data.items()}
+        for product_id, product_data in zip(product_ids, replies[len(customer_ids):]):
+            products[product_id] = {f"product_{field}": value for field, value in product_data.items()}
+
+    orders, customer_rows, product_rows = [], [], []
+    for rec in records:
+        for entity, cache in [('customer', customers), ('product', products)]:
+            entity_id = rec.get(f"{entity}_id")
+            verdict_key = (entity, entity_id)
+            if verdict_key not in verdicts:
+                verdicts[verdict_key] = _matches(cache[entity_id] if entity_id else {}, entity_predicates[entity])
+            if not verdicts[verdict_key]:
+                break
+        else:
+            orders.append(rec)
+            customer_rows.append(customers[rec['customer_id']] if rec.get('customer_id') else {})
+            product_rows.append(products[rec['product_id']] if rec.get('product_id') else {})
+    if not orders:
+        return pd.DataFrame()
+    df = pd.concat([pd.DataFrame(orders), pd.DataFrame(customer_rows), pd.DataFrame(product_rows)], axis=1)
+    return decode_frame(df, prefixes=('', 'customer_', 'product_'))
+
+def _redis_joined_chunks(r, key_pattern, chunk_size, scan_count, predicates=()):
+    # Narrow the keys with secondary indexes when they exist, otherwise stream them with SCAN;
+    # then filter and join chunk by chunk
+    keys = resolve_candidate_keys(r, key_pattern, predicates)
+    if keys is None:
+        keys = scan_keys(r, key_pattern, scan_count)
+    else:
+        logger.debug("Resolved %d candidate keys from indexes", len(keys))
+    customers = {}
+    products = {}
+    verdicts = {}
+    for chunk in chunked(keys, chunk_size):
+        try:
+            df = _join_redis_chunk(r, chunk, customers, products, predicates, verdicts)
+        except redis.RedisError as e:
+            logger.error("Error processing chunk starting at %s: %s", chunk[0], e)
+            continue
+        if not df.empty:
+            yield df
+
+def wants_enriched_view(nl_query):
+    """
+    Decide whether a question gets the flat customer+product+order view from Redis: questions
+    about customers and products do. Shared by the app and the batch pipeline so a question
+    returns the same columns (and result cache entry) everywhere.
+    Args:
+        nl_query (str): The user's question.
+    Returns:
+        bool: The `enriched` flag for execute_redis_query/execute_query.
+    """
+    nl_query = nl_query.lower()
+    return "customer" in nl_query and "product" in nl_query
+
+def _redis_intent(query):
+    # First intent named in the question, in REDIS_INTENTS priority order
+    nl_query = query.get('nl_query', '').lower()
+    return next((intent for intent in REDIS_INTENTS if intent in nl_query), None)
+
+def _unique_key_chunks(frames):
+    # SCAN can return a key twice while the keyspace is rehashing. Ids of '<prefix>:<int>' keys
+    # are kept as ints in one set per prefix (smaller than the key strings, and sized by the number
+    # of keys rather than the largest id); patterns like '*:*' cover several prefixes whose ids overlap.
+    seen_ids = {}  # prefix -> set of ids
+    seen_other = set()
+    for df in frames:
+        keep = []
+        for key in df['key']:
+            prefix, _, suffix = key.rpartition(':')
+            if suffix.isdigit():
+                seen, item = seen_ids.setdefault(prefix, set()), int(suffix)
+            else:
+                seen, item = seen_other, key
+            keep.append(item not in seen)
+            seen.add(item)
+        df = df[keep]
+        if not df.empty:
+            yield df
+
+def _enrich_redis_chunk(df):
+    # Flatten joined order rows into the customer+product+order view; rows missing either side are dropped
+    customer_columns = [column for column in df.columns if column.startswith('customer_') and column != 'customer_id']
+    product_columns = [column for column in df.columns if column.startswith('product_') and column != 'product_id']
+    if not customer_columns or not product_columns:
+        return pd.DataFrame(columns=['customer_name', *ENRICHED_COLUMNS])
+    df = df[df[customer_columns].notna().any(axis=1) & df[product_columns].notna().any(axis=1)]
+    enriched = df.reindex(columns=list(ENRICHED_COLUMNS.values()))
+    enriched.columns = list(ENRICHED_COLUMNS)
+    enriched.insert(0, 'customer_name', df['customer_first_name'] + ' ' + df['customer_last_name'])
+    return enriched.reset_index(drop=True)
+
+def _project_redis_chunk(df, intent, enriched=False):
+    # Row-wise intents, applied to one chunk at a time
+    if enriched and 'order_id' in df.columns:
+        return _enrich_redis_chunk(df)
+    if intent == 'names and emails':
+        # Select customer names and emails
+        df = df.assign(customer_name=df['customer_first_name'] + ' ' + df['customer_last_name'],
+                       email=df['customer_email'])
+        return df[['customer_name', 'email', 'product_name', 'total_price']]
+    return df
+
+def _aggregate_redis_chunks(frames, intent):
+    """
+    Apply an aggregate intent while consuming joined chunks.
+    Each chunk is reduced with groupby and folded into running totals, so memory grows with
+    the number of groups (customers, categories, distinct phones) rather than with orders.
+    Args:
+        frames (iterator): Deduplicated joined DataFrame chunks.
+        intent (str): One of the aggregate entries of REDIS_INTENTS.
+    Returns:
+        pd.DataFrame: The aggregated result, or an empty DataFrame if no rows matched.
+    """
+    totals = {}
+    count = 0
+    for df in frames:
+        if intent == 'total spending':
+            # Sum total_price per customer
+            names = df['customer_first_name'] + ' ' + df['customer_last_name']
+            partial = df['total_price'].groupby(names).sum()
+        elif intent == 'total quantity ordered':
+            # Sum quantity per category
+            partial = df['quantity'].groupby(df['product_category']).sum()
+        elif intent == 'average total price':
+            # Running sum and count of total_price
+            prices = df['total_price'].astype(float)
+            partial = {'total_price': prices.sum()}
+            count += prices.count()
+        else:
+            # Distinct phone numbers, in first-seen order
+            partial = dict.fromkeys(df['customer_phone'], 0)
+        for group, value in partial.items():
+            totals[group] = totals.get(group, 0) + value
+
+    if not totals:
+        logger.debug("No matching records found after processing keys")
+        return pd.DataFrame()
+    if intent == 'total spending':
+        df = pd.DataFrame({'customer_name': sorted(totals), 'total_spending': [totals[name] for name in sorted(totals)]})
+        logger.debug("DataFrame after grouping by customer for total spending:\n%s", df)
+    elif intent == 'total quantity ordered':
+        df = pd.DataFrame({'category': sorted(totals), 'total_quantity': [totals[category] for category in sorted(totals)]})
+        logger.debug("DataFrame after grouping by category for total quantity:\n%s", df)
+    elif intent == 'average total price':
+        df = pd.DataFrame({'average_total_price': [totals['total_price'] / count if count else float('nan')]})
+        logger.debug("DataFrame with average total price:\n%s", df)
+    else:
+        df = pd.DataFrame({'phone': list(totals)})
+        logger.debug("DataFrame with phone numbers:\n%s", df)
+    return df
+
+def execute_redis_query(query, chunk_size=None, scan_count=None, enriched=False):
+    """
+    Run a Redis query: fetch the matching hashes, join their customers and products, and apply
+    the intent named in query['nl_query'].
+    Args:
+        query (dict): {'key': <pattern>} plus optional filters and 'nl_query'.
+        chunk_size (int): Keys joined per pipelined chunk; defaults to REDIS_CHUNK_SIZE.
+        scan_count (int): COUNT hint for SCAN; defaults to REDIS_SCAN_COUNT.
+        enriched (bool): Return order rows as the flat customer+product+order view (ENRICHED_COLUMNS),
+            built from the already joined data. Ignored for aggregate intents and non-order keys.
+    Returns:
+        pd.DataFrame: The result; empty on errors or when nothing matches.
+    """
+    r = get_redis_client()
     try:
         if not isinstance(query, dict) or 'key' not in query:
-            print("Error: Invalid query format. Expected {'key': '<key_name>'}")
+            logger.error("Invalid query format %s. Expected {'key': '<key_name>'}", query)
             return pd.DataFrame()
 
         key_pattern = query['key']
-        print(f"Executing Redis query with key pattern: {key_pattern}")  # Debug log
+        chunk_size = chunk_size or REDIS_CHUNK_SIZE
+        logger.debug("Executing Redis query with key pattern: %s", key_pattern, extra={"key_pattern": key_pattern})
 
-        # Fetch matching keys
         try:
-            matching_keys = r.keys(key_pattern)
-            print(f"Matching keys: {matching_keys}")  # Debug log
-        except redis.RedisError as e:
-            print(f"Error fetching keys for pattern {key_pattern}: {str(e)}")
+            predicates = plan_redis_filters(query)
+        except ValueError as e:
+            logger.error("Error applying filters: %s", e)
             return pd.DataFrame()
+        logger.debug("Pushed-down filters: %s", predicates)
 
-        if not matching_keys:
-            print("No matching keys found")
+        intent = _redis_intent(query)
+        try:
+            frames = _unique_key_chunks(_redis_joined_chunks(r, key_pattern, chunk_size, scan_count, predicates))
+            if intent in REDIS_AGGREGATE_INTENTS:
+                return _aggregate_redis_chunks(frames, intent)
+            frames = [df for df in (_project_redis_chunk(df, intent, enriched) for df in frames) if not df.empty]
+        except redis.RedisError as e:
+            logger.error("Error scanning keys for pattern %s: %s", key_pattern, e)
             return pd.DataFrame()
 
-        # Process each key and fetch related data
-        results = []
-        for key in matching_keys:
-            try:
-                key_type = r.type(key)
-                print(f"Type of {key}: {key_type}")  # Debug log
-                if key_type != 'hash':
-                    print(f"Skipping {key} because type is {key_type}, expected hash")
-                    continue
-
-                # Fetch order data
-                order_data = r.hgetall(key)
-                if not order_data:
-                    print(f"No data found for {key}")
-                    continue
-
-                # Convert order data with proper types
-                result = {'key': key}
-                for field, value in order_data.items():
-                    try:
-                        if field in ['total_price', 'price', 'discount', 'stock_quantity']:
-                            result[field] = float(value)
-                        elif field in ['order_id', 'customer_id', 'product_id', 'quantity']:
-                            result[field] = int(value)
-                        else:
-                            result[field] = value
-                    except (ValueError, TypeError) as e:
-                        print(f"Error converting field {field} with value {value} in key {key}: {str(e)}")
-                        result[field] = value
-
-                # Fetch customer data
-                customer_id = result.get('customer_id')
-                customer_data = r.hgetall(f"customer:{customer_id}") if customer_id else {}
-                for field, value in customer_data.items():
-                    try:
-                        if field == 'credit_limit':
-                            result[f"customer_{field}"] = float(value)
-                        else:
-                            result[f"customer_{field}"] = value
-                    except (ValueError, TypeError) as e:
-                        print(f"Error converting customer field {field} with value {value}: {str(e)}")
-                        result[f"customer_{field}"] = value
-
-                # Fetch product data
-                product_id = result.get('product_id')
-                product_data = r.hgetall(f"product:{product_id}") if product_id else {}
-                for field, value in product_data.items():
-                    try:
-                        if field in ['price', 'discount', 'stock_quantity']:
-                            result[f"product_{field}"] = float(value)
-                        else:
-                            result[f"product_{field}"] = value
-                    except (ValueError, TypeError) as e:
-                        print(f"Error converting product field {field} with value {value}: {str(e)}")
-                        result[f"product_{field}"] = value
-
-                results.append(result)
-            except redis.RedisError as e:
-                print(f"Error processing key {key}: {str(e)}")
-                continue
-
-        if not results:
-            print("No matching records found after processing keys")
+        if not frames:
+            logger.debug("No matching records found after processing keys")
             return pd.DataFrame()
 
         # Create DataFrame from results
-        df = pd.DataFrame(results)
-        print(f"Initial DataFrame:\n{df}")  # Debug log
-
-        # Apply filters
-        if 'year' in query:
-            df = df[df['order_date'].str.startswith(str(query['year']))]
-            print(f"Filtered DataFrame (year = {query['year']}):\n{df}")
-
-        if 'category' in query:
-            df = df[df['product_category'] == query['category']]
-            print(f"Filtered DataFrame (category = {query['category']}):\n{df}")
-
-        if 'manufacturer' in query:
-            df = df[df['product_manufacturer'] == query['manufacturer']]
-            print(f"Filtered DataFrame (manufacturer = {query['manufacturer']}):\n{df}")
-
-        if 'customer_city' in query:
-            df = df[df['customer_city'] == query['customer_city']]
-            print(f"Filtered DataFrame (customer_city = {query['customer_city']}):\n{df}")
-
-        if 'price_condition' in query:
-            try:
-                if query['price_condition'].get('gt'):
-                    threshold = float(query['price_condition']['gt'])
-                    df = df[df['product_price'] > threshold]
-                    print(f"Filtered DataFrame (price > {threshold}):\n{df}")
-                elif query['price_condition'].get('lt'):
-                    threshold = float(query['price_condition']['lt'])
-                    df = df[df['product_price'] < threshold]
-                    print(f"Filtered DataFrame (price < {threshold}):\n{df}")
-            except (ValueError, TypeError) as e:
-                print(f"Error applying price filter: {str(e)}")
-                return pd.DataFrame()
-
-        if 'date_condition' in query:
-            date_cond = query['date_condition']
-            if 'lt' in date_cond:
-                df = df[df['order_date'] < date_cond['lt']]
-                print(f"Filtered DataFrame (order_date < {date_cond['lt']}):\n{df}")
-            if 'gt' in date_cond:
-                df = df[df['order_date'] > date_cond['gt']]
-                print(f"Filtered DataFrame (order_date > {date_cond['gt']}):\n{df}")
-
-        if 'discount_condition' in query:
-            discount_cond = query['discount_condition']
-            if 'gt' in discount_cond:
-                df = df[df['product_discount'].astype(float) > discount_cond['gt']]
-                print(f"Filtered DataFrame (discount > {discount_cond['gt']}):\n{df}")
-            if 'lt' in discount_cond:
-                df = df[df['product_discount'].astype(float) < discount_cond['lt']]
-                print(f"Filtered DataFrame (discount < {discount_cond['lt']}):\n{df}")
-
-        if 'stock_condition' in query:
-            stock_cond = query['stock_condition']
-            if 'gt' in stock_cond:
-                df = df[df['product_stock_quantity'].astype(float) > stock_cond['gt']]
-                print(f"Filtered DataFrame (stock_quantity > {stock_cond['gt']}):\n{df}")
-            if 'lt' in stock_cond:
-                df = df[df['product_stock_quantity'].astype(float) < stock_cond['lt']]
-                print(f"Filtered DataFrame (stock_quantity < {stock_cond['lt']}):\n{df}")
-
-        if 'credit_limit_condition' in query:
-            credit_limit_cond = query['credit_limit_condition']
-            if 'gt' in credit_limit_cond:
-                df = df[df['customer_credit_limit'].astype(float) > credit_limit_cond['gt']]
-                print(f"Filtered DataFrame (credit_limit > {credit_limit_cond['gt']}):\n{df}")
-            if 'lt' in credit_limit_cond:
-                df = df[df['customer_credit_limit'].astype(float) < credit_limit_cond['lt']]
-                print(f"Filtered DataFrame (credit_limit < {credit_limit_cond['lt']}):\n{df}")
-
-        if 'release_date_condition' in query:
-            release_date_cond = query['release_date_condition']
-            if 'gt' in release_date_cond:
-                df = df[df['product_release_date'] > release_date_cond['gt']]
-                print(f"Filtered DataFrame (release_date > {release_date_cond['gt']}):\n{df}")
-            if 'lt' in release_date_cond:
-                df = df[df['product_release_date'] < release_date_cond['lt']]
-                print(f"Filtered DataFrame (release_date < {release_date_cond['lt']}):\n{df}")
-
-        # Handle specific query requirements
-        if 'total spending' in query.get('nl_query', '').lower():
-            # Group by customer and sum total_price
-            df['customer_name'] = df['customer_first_name'] + ' ' + df['customer_last_name']
-            df = df.groupby('customer_name').agg({
-                'total_price': 'sum'
-            }).reset_index()
-            df.rename(columns={'total_price': 'total_spending'}, inplace=True)
-            print(f"DataFrame after grouping by customer for total spending:\n{df}")
-
-        elif 'total quantity ordered' in query.get('nl_query', '').lower():
-            # Group by category and sum quantity
-            df = df.groupby('product_category').agg({
-                'quantity': 'sum'
-            }).reset_index()
-            df.rename(columns={'product_category': 'category', 'quantity': 'total_quantity'}, inplace=True)
-            print(f"DataFrame after grouping by category for total quantity:\n{df}")
-
-        elif 'average total price' in query.get('nl_query', '').lower():
-            # Calculate average total_price
-            avg_price = df['total_price'].astype(float).mean()
-            df = pd.DataFrame({'average_total_price': [avg_price]})
-            print(f"DataFrame with average total price:\n{df}")
-
-        elif 'phone numbers' in query.get('nl_query', '').lower():
-            # Select phone numbers
-            df['phone'] = df['customer_phone']
-            df = df[['phone']].drop_duplicates()
-            print(f"DataFrame with phone numbers:\n{df}")
-
-        elif 'names and emails' in query.get('nl_query', '').lower():
-            # Select customer names and emails
-            df['customer_name'] = df['customer_first_name'] + ' ' + df['customer_last_name']
-            df['email'] = df['customer_email']
-            df['product_name'] = df['product_name']
-            df = df[['customer_name', 'email', 'product_name', 'total_price']]
-            print(f"DataFrame with names, emails, product names, and total prices:\n{df}")
-
+        df = pd.concat(frames, ignore_index=True)
+        logger.debug("Filtered DataFrame:\n%s", df)
         return df
 
     finally:
-        r.close()
\ No newline at end of file
+        r.close()
+
+def _redis_stream_chunks(query, chunk_size, scan_count, enriched=False):
+    if not isinstance(query, dict) or 'key' not in query:
+        logger.error("Invalid query format %s. Expected {'key': '<key_name>'}", query)
+        return
+    intent = _redis_intent(query)
+    if intent in REDIS_AGGREGATE_INTENTS:
+        # Aggregates are only known once every chunk has been folded in
+        yield execute_redis_query(query, chunk_size, scan_count, enriched)
+        return
+    try:
+        predicates = plan_redis_filters(query)
+    except ValueError as e:
+        logger.error("Error applying filters: %s", e)
+        return
+    r = get_redis_client()
+    try:
+        frames = _redis_joined_chunks(r, query['key'], chunk_size or REDIS_CHUNK_SIZE, scan_count, predicates)
+        for df in _unique_key_chunks(frames):
+            df = _project_redis_chunk(df, intent, enriched)
+            if not df.empty:
+                yield df
+    finally:
+        r.close()
+
+def stream_redis_query(query, chunk_size=None, scan_count=None, max_rows=None, max_bytes=None, enriched=False):
+    """
+    Stream a Redis query as filtered DataFrame chunks, one per pipelined key chunk.
+    Queries with an aggregate intent (REDIS_AGGREGATE_INTENTS) yield a single final DataFrame.
+    Args:
+        query (dict): The Redis query, as accepted by execute_redis_query.
+        chunk_size (int): Keys joined per chunk; defaults to REDIS_CHUNK_SIZE.
+        scan_count (int): COUNT hint for SCAN; defaults to REDIS_SCAN_COUNT.
+        max_rows (int): Row cap; defaults to MAX_RESULT_ROWS, 0 disables it.
+        max_bytes (int): In-memory size cap; defaults to MAX_RESULT_BYTES, 0 disables it.
+        enriched (bool): Yield the customer+product+order view, as for execute_redis_query.
+    Returns:
+        iterator: DataFrame chunks.
+    """
+    return _cap_chunks(_redis_stream_chunks(query, chunk_size, scan_count, enriched), max_rows, max_bytes)
+
+def execute_query(db_type, db_config, query, enriched=False):
+    """
+    Execute a generated query on any supported backend.
+    Args:
+        db_type (str): One of 'sqlite', 'postgresql', 'mongodb' or 'redis'.
+        db_config (dict): {"db_path"} for SQLite, connection parameters for PostgreSQL,
+            {"db_name"} for MongoDB and {} for Redis.
+        query (str or list or dict): SQL text, or the JSON query (as a string or already parsed)
+            for MongoDB and Redis.
+        enriched (bool): Redis only; see wants_enriched_view and execute_redis_query.
+    Returns:
+        pd.DataFrame: The query result, served from the result cache while the data is unchanged.
+    """
+    if db_type in ['mongodb', 'redis'] and isinstance(query, str):
+        query = json.loads(query)
+    options = {"enriched": enriched} if db_type == 'redis' else None
+    return cached_result(db_type, db_config, query, lambda: _execute_query(db_type, db_config, query, enriched), options)
+
+def _execute_query(db_type, db_config, query, enriched=False):
+    if db_type == 'sqlite':
+        return execute_sqlite_query(db_config["db_path"], query)
+    elif db_type == 'postgresql':
+        return execute_postgres_query(db_config, query)
+    elif db_type == 'mongodb':
+        return execute_mongodb_query(db_config["db_name"], query)
+    elif db_type == 'redis':
+        return execute_redis_query(query, enriched=enriched)
+    raise ValueError(f"Unsupported database type: {db_type}")
@@ -0,0 +1,308 @@
+import argparse
+import io
+import os
+import sqlite3
+import time
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from connection_manager import default_db_config, postgres_connection, get_mongo_client, get_redis_client
+from redis_indexes import REDIS_USE_INDEXES, build_indexes, drop_indexes, write_hashes
+from redis_utils import scan_keys, chunked
+from nlq_logging import get_logger
+
+load_dotenv()
+logger = get_logger(__name__)
+
+DB_TYPES = ['sqlite', 'postgresql', 'mongodb', 'redis']
+# Rows sent per executemany/COPY buffer/insert_many/pipeline
+GENERATE_BATCH_ROWS = int(os.getenv("GENERATE_BATCH_ROWS", 50000))
+
+# Same schema as create_sqlite_db.py; PostgreSQL gets DOUBLE PRECISION for REAL
+SQL_TABLES = {
+    "customers": """
+        customer_id INTEGER PRIMARY KEY,
+        first_name TEXT NOT NULL,
+        last_name TEXT NOT NULL,
+        email TEXT UNIQUE NOT NULL,
+        phone TEXT,
+        address TEXT,
+        city TEXT,
+        country TEXT,
+        credit_limit REAL,
+        registration_date TEXT""",
+    "products": """
+        product_id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        price REAL NOT NULL,
+        category TEXT,
+        stock_quantity INTEGER,
+        manufacturer TEXT,
+        release_date TEXT,
+        discount REAL""",
+    "orders": """
+        order_id INTEGER PRIMARY KEY,
+        customer_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL,
+        order_date TEXT NOT NULL,
+        status TEXT,
+        total_price REAL,
+        shipping_address TEXT,
+        payment_method TEXT,
+        FOREIGN KEY (customer_id) REFERENCES customers (customer_id),
+        FOREIGN KEY (product_id) REFERENCES products (product_id)""",
+}
+# (table, column) indexes, created after loading; the same ones create_sqlite_db.py adds
+SQL_INDEXES = [("orders", "customer_id"), ("orders", "product_id"), ("orders", "order_date"), ("products", "category")]
+
+FIRST_NAMES = ['John', 'Jane', 'Alice', 'Bob', 'Maria', 'David', 'Emma', 'Liam', 'Olivia', 'Noah', 'Sofia', 'Lucas']
+LAST_NAMES = ['Doe', 'Smith', 'Johnson', 'Brown', 'Garcia', 'Miller', 'Davis', 'Wilson', 'Taylor', 'Lee', 'Martin']
+STREETS = ['Maple St', 'Oak St', 'Pine St', 'Elm St', 'Cedar Ave', 'Main St', 'Park Ave', 'Lake Rd']
+CITIES = [('New York', 'USA'), ('Los Angeles', 'USA'), ('Chicago', 'USA'), ('Miami', 'USA'),
+          ('London', 'UK'), ('Toronto', 'Canada'), ('Sydney', 'Australia')]
+# (name, category, manufacturer, list price)
+CATALOG = [('Laptop', 'Electronics', 'TechCorp', 999.99), ('Smartphone', 'Electronics', 'TechCorp', 699.99),
+           ('Headphones', 'Electronics', 'SoundTech', 49.99), ('Speaker', 'Electronics', 'SoundTech', 129.99),
+           ('T-Shirt', 'Clothing', 'FashionInc', 19.99), ('Jacket', 'Clothing', 'FashionInc', 89.99),
+           ('Sneakers', 'Clothing', 'FashionInc', 74.99)]
+STATUSES = (['Shipped', 'Delivered', 'Pending', 'Cancelled'], [0.35, 0.4, 0.17, 0.08])
+PAYMENT_METHODS = (['Credit Card', 'PayPal', 'Bank Transfer'], [0.6, 0.3, 0.1])
+CREDIT_LIMITS = [1000.0, 3000.0, 4000.0, 5000.0, 7000.0, 10000.0]
+DISCOUNTS = [0.0, 5.0, 10.0, 15.0, 20.0]
+
+def _dates(rng, start, end, size):
+    # Index into the precomputed strings of every day in [start, end) instead of formatting each row
+    days = pd.date_range(start, end, inclusive='left').strftime('%Y-%m-%d').to_numpy(dtype=object)
+    return days[rng.integers(0, len(days), size)]
+
+def _pick(rng, choices, size):
+    values, weights = choices
+    return np.asarray(values, dtype=object)[rng.choice(len(values), size=size, p=weights)]
+
+def _skewed_ids(rng, count, size, skew):
+    """
+    Draw `size` ids from 1..count. skew=0 is uniform; skew>0 follows a Zipf-like law where
+    id k is drawn with weight 1/k**skew, so low ids are the hot customers/products.
+    """
+    if skew <= 0:
+        return rng.integers(1, count + 1, size)
+    weights = 1.0 / np.arange(1, count + 1) ** skew
+    return rng.choice(count, size=size, p=weights / weights.sum()) + 1
+
+def generate_dataset(orders, customers=None, products=None, skew=0.0, seed=42):
+    """
+    Generate customers, products and orders with the sample schema, deterministically for a seed.
+    Columns are built with vectorized numpy/pandas operations, so millions of rows take seconds.
+    Args:
+        orders (int): Number of orders.
+        customers (int): Number of customers; defaults to orders / 10 (at least 10).
+        products (int): Number of products; defaults to orders / 100 (at least 10).
+        skew (float): Zipf exponent for which customers place orders and which products are
+            ordered; 0 is uniform, about 1 gives a realistic long tail.
+        seed (int): Random seed.
+    Returns:
+        dict: Table name -> DataFrame, with the SQL column order.
+    """
+    rng = np.random.default_rng(seed)
+    customers = customers or max(10, orders // 10)
+    products = products or max(10, orders // 100)
+
+    customer_ids = np.arange(1, customers + 1)
+    first_names = np.asarray(FIRST_NAMES, dtype=object)[rng.integers(0, len(FIRST_NAMES), customers)]
+    last_names = np.asarray(LAST_NAMES, dtype=object)[rng.integers(0, len(LAST_NAMES), customers)]
+    cities = rng.integers(0, len(CITIES), customers)
+    ids = pd.Series(customer_ids).astype(str).to_numpy(dtype=object)
+    addresses = (pd.Series(rng.integers(1, 1000, customers)).astype(str) + ' '
+                 + np.asarray(STREETS, dtype=object)[rng.integers(0, len(STREETS), customers)]).to_numpy(dtype=object)
+    customer_df = pd.DataFrame({
+        "customer_id": customer_ids,
+        "first_name": first_names,
+        "last_name": last_names,
+        # The id keeps emails unique
+        "email": pd.Series(first_names).str.lower() + '.' + pd.Series(last_names).str.lower() + ids + '@email.com',
+        "phone": pd.Series(rng.integers(100, 1000, customers)).astype(str) + '-'
+                 + pd.Series(rng.integers(100, 1000, customers)).astype(str) + '-'
+                 + pd.Series(customer_ids % 10000).astype(str).str.zfill(4),
+        "address": addresses,
+        "city": np.asarray([city for city, _ in CITIES], dtype=object)[cities],
+        "country": np.asarray([country for _, country in CITIES], dtype=object)[cities],
+        "credit_limit": np.asarray(CREDIT_LIMITS)[rng.integers(0, len(CREDIT_LIMITS), customers)],
+        "registration_date": _dates(rng, '2023-01-01', '2025-01-01', customers),
+    })
+
+    product_ids = np.arange(1, products + 1)
+    items = rng.integers(0, len(CATALOG), products)
+    list_prices = np.asarray([price for *_, price in CATALOG])[items]
+    product_df = pd.DataFrame({
+        "product_id": product_ids,
+        "name": pd.Series(np.asarray([name for name, *_ in CATALOG], dtype=object)[items]) + ' '
+                + pd.Series(product_ids).astype(str),
+        "price": np.round(list_prices * rng.uniform(0.8, 1.2, products), 2),
+        "category": np.asarray([category for _, category, *_ in CATALOG], dtype=object)[items],
+        "stock_quantity": rng.integers(0, 500, products),
+        "manufacturer": np.asarray([manufacturer for _, _, manufacturer, _ in CATALOG], dtype=object)[items],
+        "release_date": _dates(rng, '2022-01-01', '2025-01-01', products),
+        "discount": np.asarray(DISCOUNTS)[rng.integers(0, len(DISCOUNTS), products)],
+    })
+
+    order_customers = _skewed_ids(rng, customers, orders, skew)
+    order_products = _skewed_ids(rng, products, orders, skew)
+    quantities = rng.integers(1, 6, orders)
+    prices = product_df["price"].to_numpy()[order_products - 1]
+    discounts = product_df["discount"].to_numpy()[order_products - 1]
+    full_addresses = (customer_df["address"] + ', ' + customer_df["city"] + ', ' + customer_df["country"]).to_numpy(dtype=object)
+    order_df = pd.DataFrame({
+        "order_id": np.arange(1, orders + 1),
+        "customer_id": order_customers,
+        "product_id": order_products,
+        "quantity": quantities,
+        "order_date": _dates(rng, '2024-01-01', '2026-01-01', orders),
+        "status": _pick(rng, STATUSES, orders),
+        "total_price": np.round(prices * quantities * (1 - discounts / 100), 2),
+        "shipping_address": full_addresses[order_customers - 1],
+        "payment_method": _pick(rng, PAYMENT_METHODS, orders),
+    })
+    return {"customers": customer_df, "products": product_df, "orders": order_df}
+
+def _batches(df, size=None):
+    size = size or GENERATE_BATCH_ROWS
+    for start in range(0, len(df), size):
+        yield df.iloc[start:start + size]
+
+def _rows(df):
+    # Native Python values: the drivers reject numpy scalars
+    return zip(*(df[column].tolist() for column in df.columns))
+
+def load_sqlite(db_path, data):
+    """
+    Replace the customers/products/orders tables of a SQLite file with `data`.
+    All rows go in through executemany inside one transaction; indexes are built afterwards.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        # Nothing to protect if the load fails halfway: the tables are recreated on the next run
+        conn.execute("PRAGMA journal_mode=MEMORY")
+        conn.execute("PRAGMA synchronous=OFF")
+        with conn:
+            for table in reversed(list(SQL_TABLES)):
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+            for table, columns in SQL_TABLES.items():
+                conn.execute(f"CREATE TABLE {table} ({columns})")
+                df = data[table]
+                conn.executemany(f"INSERT INTO {table} ({', '.join(df.columns)}) VALUES ({', '.join('?' * len(df.columns))})",
+                                 _rows(df))
+            for table, column in SQL_INDEXES:
+                conn.execute(f"CREATE INDEX idx_{table}_{column} ON {table} ({column})")
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
+
+def load_postgres(db_config, data):
+    """
+    Replace the customers/products/orders tables of a PostgreSQL database with `data`.
+    Rows are streamed with COPY ... FROM STDIN in CSV batches and committed once.
+    """
+    with postgres_connection(db_config) as conn:
+        with conn.cursor() as cursor:
+            for table in reversed(list(SQL_TABLES)):
+                cursor.execute(f"DROP TABLE IF EXISTS {table}")
+            for table, columns in SQL_TABLES.items():
+                cursor.execute(f"CREATE TABLE {table} ({columns.replace('REAL', 'DOUBLE PRECISION')})")
+                for batch in _batches(data[table]):
+                    buffer = io.StringIO()
+                    batch.to_csv(buffer, index=False, header=False)
+                    buffer.seek(0)
+                    cursor.copy_expert(f"COPY {table} ({', '.join(batch.columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+            for table, column in SQL_INDEXES:
+                cursor.execute(f"CREATE INDEX idx_{table}_{column} ON {table} ({column})")
+        conn.commit()
+        # ANALYZE outside the load transaction so the planner sees the new statistics right away
+        with conn.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        conn.commit()
+
+def load_mongodb(db_name, data):
+    """
+    Replace the customers/products/orders collections of a MongoDB database with `data`,
+    using unordered insert_many batches, then index the fields queries join and filter on.
+    """
+    db = get_mongo_client()[db_name]
+    for collection, df in data.items():
+        db[collection].drop()
+        for batch in _batches(df):
+            db[collection].insert_many(batch.to_dict('records'), ordered=False)
+    db["customers"].create_index("customer_id", unique=True)
+    db["products"].create_index("product_id", unique=True)
+    for table, column in SQL_INDEXES:
+        db[table].create_index(column)
+
+def load_redis(data, index=None):
+    """
+    Replace the customer:/product:/order: hashes in Redis with `data` through write_hashes,
+    one MULTI/EXEC per 1000 rows.
+    Args:
+        data (dict): As returned by generate_dataset.
+        index (bool): Rebuild the secondary indexes afterwards; defaults to REDIS_USE_INDEXES.
+            Stale indexes are always dropped.
+    """
+    index = REDIS_USE_INDEXES if index is None else index
+    r = get_redis_client()
+    try:
+        drop_indexes(r)
+        for table in data:
+            for keys in chunked(scan_keys(r, f"{table[:-1]}:*"), 1000):
+                r.unlink(*keys)
+        for table, df in data.items():
+            prefix = table[:-1]
+            id_column = f"{prefix}_id"
+            for batch in _batches(df):
+                write_hashes(r, ((f"{prefix}:{record[id_column]}", record) for record in batch.to_dict('records')))
+        if index:
+            build_indexes(r)
+    finally:
+        r.close()
+
+def load_dataset(db_type, db_config, data):
+    """
+    Bulk-load a generated dataset into any supported backend, replacing existing sample data.
+    Args:
+        db_type (str): One of 'sqlite', 'postgresql', 'mongodb' or 'redis'.
+        db_config (dict): The backend configuration, as for schema_detector.get_schema.
+        data (dict): As returned by generate_dataset.
+    """
+    if db_type == 'sqlite':
+        load_sqlite(db_config["db_path"], data)
+    elif db_type == 'postgresql':
+        load_postgres(db_config, data)
+    elif db_type == 'mongodb':
+        load_mongodb(db_config["db_name"], data)
+    elif db_type == 'redis':
+        load_redis(data)
+    else:
+        raise ValueError(f"Unsupported database type: {db_type}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate customers/products/orders data and bulk-load it.")
+    parser.add_argument("--db", nargs="+", choices=DB_TYPES, default=['sqlite'], help="Backends to load (existing sample data is replaced)")
+    parser.add_argument("--orders", type=int, default=100000, help="Number of orders")
+    parser.add_argument("--customers", type=int, help="Number of customers (default: orders / 10)")
+    parser.add_argument("--products", type=int, help="Number of products (default: orders / 100)")
+    parser.add_argument("--skew", type=float, default=0.0, help="Zipf exponent for customer/product popularity (0 = uniform)")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    parser.add_argument("--sqlite-path", help="SQLite file to write (default: SQLITE_DB_PATH)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    data = generate_dataset(args.orders, args.customers, args.products, args.skew, args.seed)
+    print(f"Generated {', '.join(f'{len(df)} {table}' for table, df in data.items())} in {time.perf_counter() - start:.1f}s")
+    for db_type in args.db:
+        db_config = default_db_config(db_type)
+        if db_type == 'sqlite' and args.sqlite_path:
+            db_config["db_path"] = args.sqlite_path
+        start = time.perf_counter()
+        load_dataset(db_type, db_config, data)
+        print(f"Loaded {db_type} in {time.perf_counter() - start:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,443 @@
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import psycopg2
+from pymongo.errors import PyMongoError
+from dotenv import load_dotenv
+from connection_manager import sqlite_connection, postgres_connection, get_mongo_client, get_redis_client, default_db_config
+from cost_guard import SQL_KEYWORDS, sql_tables
+from db_connectors import parse_mongodb_query, plan_redis_filters
+from redis_indexes import indexes_available, build_indexes
+from result_cache import normalize_executed_query, target_name
+from schema_detector import get_schema
+from nlq_logging import get_logger
+
+load_dotenv()
+logger = get_logger(__name__)
+
+INDEX_ADVISOR_ENABLED = os.getenv("INDEX_ADVISOR_ENABLED", "1") == "1"
+INDEX_ADVISOR_LOG_PATH = os.getenv("INDEX_ADVISOR_LOG_PATH", "nlq_workload.db")
+# Most frequent logged queries that get EXPLAINed when building recommendations
+INDEX_ADVISOR_EXPLAIN_LIMIT = int(os.getenv("INDEX_ADVISOR_EXPLAIN_LIMIT", 50))
+
+# How much one use of a column in each role counts towards its recommendation score
+KIND_WEIGHTS = {'eq': 3, 'join': 3, 'range': 2, 'sort': 1}
+
+# column <op> value, or column <op> other.column for joins; wrapped columns (e.g., strftime(..., col)) don't match
+SQL_PREDICATE_PATTERN = re.compile(
+    r'(?<![\w.(])(?:"?(\w+)"?\.)?"?(\w+)"?\s*(<>|!=|<=|>=|=|<|>|\bNOT\s+IN\b|\bIN\b|\bBETWEEN\b|\bLIKE\b)\s*'
+    r'(?:"?(\w+)"?\."?(\w+)"?|(\'%|\S))',
+    re.IGNORECASE,
+)
+SQL_ORDER_PATTERN = re.compile(r'\b(?:ORDER|GROUP)\s+BY\s+(.+?)(?=\bLIMIT\b|\bHAVING\b|\bORDER\b|\bOFFSET\b|;|\)|$)',
+                               re.IGNORECASE | re.DOTALL)
+SQL_OPERATOR_KINDS = {'=': 'eq', 'IN': 'eq', '<': 'range', '>': 'range', '<=': 'range', '>=': 'range',
+                      'BETWEEN': 'range', 'LIKE': 'range'}
+
+def _resolve_column(qualifier, column, aliases, tables, schema):
+    # Map a (possibly aliased) column reference to its table, using the schema for unqualified names
+    if qualifier:
+        return aliases.get(qualifier.lower())
+    if len(tables) == 1:
+        return tables[0]
+    owners = [table for table in tables if column in {col[0] for col in (schema or {}).get(table, [])}]
+    return owners[0] if len(owners) == 1 else None
+
+def extract_sql_predicates(sql, schema=None):
+    """
+    Find the columns a SQL query filters, joins or sorts on.
+    Only plain column references count: a column wrapped in a function can't use an index anyway.
+    Args:
+        sql (str): The executed query.
+        schema (dict): Table -> [(column, type)], used to place unqualified columns in multi-table queries.
+    Returns:
+        set: (table, column, kind) tuples, kind being 'eq', 'range', 'join' or 'sort'.
+    """
+    tables, aliases = sql_tables(sql)
+    predicates = set()
+    for qualifier, column, op, right_qualifier, right_column, literal_start in SQL_PREDICATE_PATTERN.findall(sql):
+        op = ' '.join(op.upper().split())
+        if column.upper() in SQL_KEYWORDS or column.isdigit() or op in ('<>', '!=', 'NOT IN'):
+            continue
+        table = _resolve_column(qualifier, column, aliases, tables, schema)
+        if right_column:
+            right_table = _resolve_column(right_qualifier, right_column, aliases, tables, schema)
+            if table and right_table and table != right_table:
+                predicates.add((table, column, 'join'))
+                predicates.add((right_table, right_column, 'join'))
+            continue
+        if op == 'LIKE' and literal_start == "'%":
+            # A leading wildcard can't use an index
+            continue
+        if table:
+            predicates.add((table, column, SQL_OPERATOR_KINDS[op]))
+    for clause in SQL_ORDER_PATTERN.findall(sql):
+        for term in clause.split(','):
+            match = re.fullmatch(r'\s*(?:"?(\w+)"?\.)?"?(\w+)"?(?:\s+(?:ASC|DESC))?\s*', term, re.IGNORECASE)
+            if match and not match.group(2).isdigit():
+                table = _resolve_column(match.group(1), match.group(2), aliases, tables, schema)
+                if table:
+                    predicates.add((table, match.group(2), 'sort'))
+    return predicates
+
+def extract_mongodb_predicates(query):
+    """
+    Find the fields a MongoDB query filters, joins or sorts on.
+    Only the leading $match/$sort stages of the base collection can use its indexes; $lookup
+    foreignFields are lookups on the joined collection.
+    Args:
+        query (list or dict): As accepted by db_connectors.parse_mongodb_query.
+    Returns:
+        set: (collection, field, kind) tuples.
+    """
+    collection, operation, spec = parse_mongodb_query(query)
+    predicates = set()
+
+    def add_match(match):
+        for field, condition in match.items():
+            if field.startswith('$'):
+                continue
+            is_range = isinstance(condition, dict) and any(op in condition for op in ('$gt', '$gte', '$lt', '$lte'))
+            predicates.add((collection, field, 'range' if is_range else 'eq'))
+
+    if operation == 'find':
+        add_match(spec)
+        return predicates
+    leading = True
+    for stage in spec:
+        if not isinstance(stage, dict) or len(stage) != 1:
+            continue
+        name, body = next(iter(stage.items()))
+        if name == '$lookup' and isinstance(body, dict) and body.get('from') and body.get('foreignField'):
+            predicates.add((body['from'], body['foreignField'], 'join'))
+        if leading and name == '$match' and isinstance(body, dict):
+            add_match(body)
+        elif leading and name == '$sort' and isinstance(body, dict):
+            predicates.update((collection, field, 'sort') for field in body)
+        elif name not in ('$match', '$sort'):
+            leading = False
+    return predicates
+
+def extract_predicates(db_type, query, schema=None):
+    """Dispatch to the predicate extractor for db_type; Redis filters come from plan_redis_filters."""
+    if db_type in ['sqlite', 'postgresql']:
+        return extract_sql_predicates(query, schema)
+    elif db_type == 'mongodb':
+        return extract_mongodb_predicates(query)
+    elif db_type == 'redis':
+        try:
+            predicates = plan_redis_filters(query)
+        except ValueError:
+            return set()
+        entity = query.get('key', '').split(':')[0]
+        return {(entity if predicate_entity == 'base' else predicate_entity, column, op)
+                for predicate_entity, column, op, _ in predicates}
+    raise ValueError(f"Unsupported database type: {db_type}")
+
+class WorkloadLog:
+    """
+    Counts of executed queries and the columns they use, per backend and target, kept in a
+    SQLite file so recommendations reflect the workload across restarts.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or INDEX_ADVISOR_LOG_PATH
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS predicate_log (
+                db_type TEXT NOT NULL,
+                target TEXT NOT NULL,
+                table_name TEXT NOT NULL,
+                column_name TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                uses INTEGER NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (db_type, target, table_name, column_name, kind)
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS query_log (
+                db_type TEXT NOT NULL,
+                target TEXT NOT NULL,
+                query TEXT NOT NULL,
+                uses INTEGER NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (db_type, target, query)
+            )
+        """)
+        self._conn.commit()
+
+    def record(self, db_type, db_config, query, schema=None):
+        """
+        Log one executed query and the predicates it uses.
+        Args:
+            db_type (str): The backend.
+            db_config (dict): The backend configuration.
+            query (str or list or dict): The query as executed (parsed JSON for MongoDB/Redis).
+            schema (dict): The schema the query was generated against, if known.
+        """
+        target = target_name(db_type, db_config)
+        predicates = extract_predicates(db_type, query, schema)
+        text = normalize_executed_query(query)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """INSERT INTO query_log VALUES (?, ?, ?, 1, ?)
+                   ON CONFLICT (db_type, target, query) DO UPDATE SET uses = uses + 1, last_used = excluded.last_used""",
+                (db_type, target, text, now),
+            )
+            self._conn.executemany(
+                """INSERT INTO predicate_log VALUES (?, ?, ?, ?, ?, 1, ?)
+                   ON CONFLICT (db_type, target, table_name, column_name, kind)
+                   DO UPDATE SET uses = uses + 1, last_used = excluded.last_used""",
+                [(db_type, target, table, column, kind, now) for table, column, kind in predicates],
+            )
+            self._conn.commit()
+
+    def predicates(self, db_type, target):
+        """Returns: list of (table, column, kind, uses)."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT table_name, column_name, kind, uses FROM predicate_log WHERE db_type = ? AND target = ?",
+                (db_type, target),
+            ).fetchall()
+
+    def hot_queries(self, db_type, target, limit=None):
+        """Returns: list of (query text, uses), most used first."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT query, uses FROM query_log WHERE db_type = ? AND target = ? ORDER BY uses DESC LIMIT ?",
+                (db_type, target, limit or INDEX_ADVISOR_EXPLAIN_LIMIT),
+            ).fetchall()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM predicate_log")
+            self._conn.execute("DELETE FROM query_log")
+            self._conn.commit()
+
+_default_log = None
+_default_log_lock = threading.Lock()
+
+def get_workload_log():
+    """Return the process-wide WorkloadLog backed by INDEX_ADVISOR_LOG_PATH."""
+    global _default_log
+    with _default_log_lock:
+        if _default_log is None:
+            _default_log = WorkloadLog()
+        return _default_log
+
+def record_query(db_type, db_config, query, schema=None):
+    """Log an executed query for the advisor; never lets logging break the query path."""
+    if not INDEX_ADVISOR_ENABLED:
+        return
+    try:
+        if db_type in ['mongodb', 'redis'] and isinstance(query, str):
+            query = json.loads(query)
+        get_workload_log().record(db_type, db_config, query, schema)
+    except (sqlite3.Error, ValueError, TypeError, AttributeError) as e:
+        logger.warning("Could not log query for the index advisor: %s", e)
+
+def _walk_plan(node):
+    # Yield every dict nested anywhere in an EXPLAIN document
+    if isinstance(node, dict):
+        yield node
+        for value in node.values():
+            yield from _walk_plan(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _walk_plan(value)
+
+def explain_full_scans(db_type, db_config, query):
+    """
+    EXPLAIN a query without running it and report which tables/collections it scans in full.
+    Args:
+        db_type (str): 'sqlite', 'postgresql' or 'mongodb'.
+        db_config (dict): The backend configuration.
+        query (str or list or dict): The query as executed.
+    Returns:
+        set: Names of fully scanned tables or collections.
+    """
+    if db_type == 'sqlite':
+        with sqlite_connection(db_config["db_path"]) as conn:
+            rows = conn.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()
+        # 'SCAN o' is a table scan (reported under the alias); 'SEARCH ... USING INDEX' and 'SCAN ... USING ... INDEX' are not
+        _, aliases = sql_tables(query)
+        scans = [re.match(r'SCAN (?:TABLE )?(\w+)(?!.*USING)', row[-1]) for row in rows]
+        return {aliases.get(match.group(1).lower(), match.group(1)) for match in scans if match}
+    elif db_type == 'postgresql':
+        with postgres_connection(db_config) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(f"EXPLAIN (FORMAT JSON) {query.strip().rstrip(';')}")
+                plan = cursor.fetchone()[0]
+        return {node['Relation Name'] for node in _walk_plan(plan) if node.get('Node Type') == 'Seq Scan'}
+    elif db_type == 'mongodb':
+        collection, operation, spec = parse_mongodb_query(query)
+        db = get_mongo_client()[db_config["db_name"]]
+        if operation == 'aggregate':
+            plan = db.command('explain', {'aggregate': collection, 'pipeline': spec, 'cursor': {}}, verbosity='queryPlanner')
+        else:
+            plan = db[collection].find(spec).explain()
+        return {collection} if any(node.get('stage') == 'COLLSCAN' for node in _walk_plan(plan)) else set()
+    raise ValueError(f"EXPLAIN is not supported for {db_type}")
+
+def existing_indexes(db_type, db_config):
+    """
+    Returns:
+        set: (table, column) pairs that already lead an index (including primary keys).
+    """
+    indexed = set()
+    if db_type == 'sqlite':
+        with sqlite_connection(db_config["db_path"]) as conn:
+            tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+            for table in tables:
+                for column in conn.execute(f'PRAGMA table_info("{table}")'):
+                    if column[5] == 1:
+                        indexed.add((table, column[1]))
+                for index in conn.execute(f'PRAGMA index_list("{table}")').fetchall():
+                    first = conn.execute(f'PRAGMA index_info("{index[1]}")').fetchone()
+                    if first:
+                        indexed.add((table, first[2]))
+    elif db_type == 'postgresql':
+        with postgres_connection(db_config) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT t.relname, a.attname
+                    FROM pg_index i
+                    JOIN pg_class t ON t.oid = i.indrelid
+                    JOIN pg_namespace n ON n.oid = t.relnamespace
+                    JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = i.indkey[0]
+                    WHERE n.nspname = 'public';
+                """)
+                indexed.update(cursor.fetchall())
+    elif db_type == 'mongodb':
+        db = get_mongo_client()[db_config["db_name"]]
+        for collection in db.list_collection_names():
+            for info in db[collection].index_information().values():
+                indexed.add((collection, info['key'][0][0]))
+    return indexed
+
+def _index_statement(db_type, table, column):
+    name = f"idx_{table}_{column}"
+    if db_type == 'mongodb':
+        return f"db.{table}.createIndex({{\"{column}\": 1}}, {{\"name\": \"{name}\"}})"
+    return f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" ("{column}")'
+
+def recommend(db_type, db_config=None, limit=10, explain=True):
+    """
+    Rank index candidates from the logged workload.
+    A column's score is the sum of its uses weighted by role (KIND_WEIGHTS), doubled when one of
+    the hot queries full-scans its table. Columns that already lead an index are skipped.
+    Args:
+        db_type (str): The backend.
+        db_config (dict): The backend configuration; defaults to default_db_config(db_type).
+        limit (int): Maximum recommendations.
+        explain (bool): EXPLAIN the hot queries to find full scans.
+    Returns:
+        list: Dicts with db_type, table, column, kinds, uses, full_scan, score and statement.
+    """
+    db_config = db_config or default_db_config(db_type)
+    log = get_workload_log()
+    target = target_name(db_type, db_config)
+
+    if db_type == 'redis':
+        # Redis indexes are a fixed set maintained by redis_indexes.py
+        uses = sum(row[3] for row in log.predicates(db_type, target))
+        r = get_redis_client()
+        try:
+            built = indexes_available(r)
+        finally:
+            r.close()
+        if uses and not built:
+            return [{"db_type": db_type, "table": "*", "column": "*", "kinds": [], "uses": uses, "full_scan": True,
+                     "score": uses, "statement": "python redis_indexes.py build"}]
+        return []
+
+    scanned = set()
+    if explain:
+        for text, _ in log.hot_queries(db_type, target):
+            query = json.loads(text) if db_type == 'mongodb' else text
+            try:
+                scanned |= explain_full_scans(db_type, db_config, query)
+            except (sqlite3.Error, psycopg2.Error, PyMongoError, ValueError, TimeoutError) as e:
+                logger.warning("EXPLAIN failed for %s: %s", text, e)
+
+    schema = get_schema(db_type, db_config)
+    columns = {table: {col[0] for col in cols} for table, cols in schema.items() if isinstance(cols, list)}
+    indexed = existing_indexes(db_type, db_config)
+    candidates = {}
+    for table, column, kind, uses in log.predicates(db_type, target):
+        if column not in columns.get(table, set()) or (table, column) in indexed:
+            continue
+        candidate = candidates.setdefault((table, column), {
+            "db_type": db_type, "table": table, "column": column, "kinds": [], "uses": 0,
+            "full_scan": table in scanned, "score": 0, "statement": _index_statement(db_type, table, column),
+        })
+        candidate["kinds"].append(kind)
+        candidate["uses"] += uses
+        candidate["score"] += KIND_WEIGHTS[kind] * uses * (2 if candidate["full_scan"] else 1)
+    return sorted(candidates.values(), key=lambda candidate: -candidate["score"])[:limit]
+
+def create_indexes(recommendations, db_type, db_config=None):
+    """
+    Create the recommended indexes (opt-in).
+    Args:
+        recommendations (list): Output of recommend().
+        db_type (str): The backend.
+        db_config (dict): The backend configuration; defaults to default_db_config(db_type).
+    Returns:
+        list: The statements that were applied.
+    """
+    db_config = db_config or default_db_config(db_type)
+    applied = []
+    if db_type == 'redis':
+        if recommendations:
+            build_indexes()
+            applied.append(recommendations[0]["statement"])
+        return applied
+    for recommendation in recommendations:
+        table, column = recommendation["table"], recommendation["column"]
+        if db_type == 'sqlite':
+            with sqlite_connection(db_config["db_path"]) as conn:
+                conn.execute(recommendation["statement"])
+                conn.commit()
+        elif db_type == 'postgresql':
+            with postgres_connection(db_config) as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(recommendation["statement"])
+                conn.commit()
+        elif db_type == 'mongodb':
+            get_mongo_client()[db_config["db_name"]][table].create_index([(column, 1)], name=f"idx_{table}_{column}")
+        applied.append(recommendation["statement"])
+    return applied
+
+def main():
+    parser = argparse.ArgumentParser(description="Recommend (and optionally create) indexes for the logged query workload.")
+    parser.add_argument("command", choices=["recommend", "apply", "clear"])
+    parser.add_argument("--db", choices=["sqlite", "postgresql", "mongodb", "redis"], default="sqlite")
+    parser.add_argument("--limit", type=int, default=10, help="Maximum recommendations")
+    parser.add_argument("--no-explain", action="store_true", help="Skip EXPLAIN of the hot queries")
+    args = parser.parse_args()
+    if args.command == "clear":
+        get_workload_log().clear()
+        print("Cleared the workload log")
+        return
+    recommendations = recommend(args.db, limit=args.limit, explain=not args.no_explain)
+    if not recommendations:
+        print("No index recommendations")
+        return
+    for rank, recommendation in enumerate(recommendations, start=1):
+        print(f"{rank}. {recommendation['statement']}  -- score {recommendation['score']}, "
+              f"{recommendation['uses']} uses as {'/'.join(sorted(set(recommendation['kinds'])))}"
+              f"{', table is full-scanned' if recommendation['full_scan'] else ''}")
+    if args.command == "apply":
+        for statement in create_indexes(recommendations, args.db):
+            print(f"Applied: {statement}")
+
+if __name__ == "__main__":
+    main()
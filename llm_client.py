@@ -0,0 +1,52 @@
+import os
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LLM_MODEL = os.getenv("LLM_MODEL", "gemini-1.5-flash")
+
+_lock = threading.Lock()
+_llm = None
+_prompt_templates = {}
+
+def get_llm():
+    """
+    Return the process-wide chat model, creating it on first use.
+    langchain is imported here rather than at module import so app startup doesn't pay for it.
+    Returns:
+        ChatGoogleGenerativeAI: The shared client.
+    """
+    global _llm
+    with _lock:
+        if _llm is None:
+            from langchain_google_genai import ChatGoogleGenerativeAI
+            _llm = ChatGoogleGenerativeAI(model=LLM_MODEL, api_key=os.getenv("GEMINI_API_KEY"))
+        return _llm
+
+def set_llm(llm):
+    """
+    Replace the shared chat model, e.g., with a deterministic fake for benchmarks.
+    Args:
+        llm: Any object with invoke(prompt) returning a message with .content; None restores
+            lazy creation of the Gemini client.
+    """
+    global _llm
+    with _lock:
+        _llm = llm
+
+def get_prompt_template(name, template, input_variables):
+    """
+    Return a compiled PromptTemplate, building it only the first time `name` is requested.
+    Args:
+        name (str): Cache key for the template (e.g., the db_type it serves).
+        template (str): The template text.
+        input_variables (list): The template's input variables.
+    Returns:
+        PromptTemplate: The shared compiled template.
+    """
+    with _lock:
+        if name not in _prompt_templates:
+            from langchain_core.prompts import PromptTemplate
+            _prompt_templates[name] = PromptTemplate(input_variables=input_variables, template=template)
+        return _prompt_templates[name]
@@ -0,0 +1,274 @@
+import contextvars
+import math
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pyarrow as pa
+from dotenv import load_dotenv
+from nlq_logging import get_logger
+
+load_dotenv()
+logger = get_logger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+# Most recent durations kept per (backend, stage) for the p50/p95 estimates
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", 1000))
+# Port for the Prometheus /metrics endpoint; 0 leaves it off
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+QUANTILES = (0.5, 0.95)
+# Counter name -> help text for the Prometheus output
+COUNTERS = {
+    "nlq_requests_total": "Traced requests by backend and outcome.",
+    "nlq_result_rows_total": "Rows returned by executed queries.",
+    "nlq_result_bytes_total": "In-memory size of returned results.",
+    "nlq_llm_tokens_total": "LLM tokens used, by kind (input/output).",
+    "nlq_cache_requests_total": "Cache lookups by cache and result (hit/miss).",
+}
+
+_current_trace = contextvars.ContextVar("nlq_trace", default=None)
+
+def percentile(values, quantile):
+    """Nearest-rank percentile of a sorted, non-empty list."""
+    return values[max(0, math.ceil(quantile * len(values)) - 1)]
+
+def _labels(labels):
+    return ",".join(f'{name}="{str(value)}"' for name, value in labels)
+
+class MetricsRegistry:
+    """
+    Process-wide counters and stage durations. Durations keep a running sum and count, plus
+    the last `window` samples per (backend, stage) for percentiles.
+    """
+
+    def __init__(self, window=None):
+        self.window = window or METRICS_WINDOW
+        self._lock = threading.Lock()
+        self._counters = {}   # (name, sorted label pairs) -> value
+        self._durations = {}  # (backend, stage) -> [recent samples deque, sum, count]
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, backend, stage, seconds):
+        with self._lock:
+            entry = self._durations.setdefault((backend, stage), [deque(maxlen=self.window), 0.0, 0])
+            entry[0].append(seconds)
+            entry[1] += seconds
+            entry[2] += 1
+
+    def percentiles(self, backend=None):
+        """
+        Args:
+            backend (str): Only this backend; all if None.
+        Returns:
+            dict: (backend, stage) -> {"p50", "p95", "count"} over the recent window.
+        """
+        with self._lock:
+            samples = {key: sorted(entry[0]) for key, entry in self._durations.items()
+                       if backend is None or key[0] == backend}
+        return {key: {"p50": percentile(values, 0.5), "p95": percentile(values, 0.95), "count": len(values)}
+                for key, values in samples.items() if values}
+
+    def render_prometheus(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            counters = dict(self._counters)
+            durations = {key: (sorted(entry[0]), entry[1], entry[2]) for key, entry in self._durations.items()}
+        lines = [
+            "# HELP nlq_stage_duration_seconds Wall time per request stage; quantiles over the recent window.",
+            "# TYPE nlq_stage_duration_seconds summary",
+        ]
+        for (backend, stage), (values, total, count) in sorted(durations.items()):
+            labels = _labels([("backend", backend), ("stage", stage)])
+            for quantile in QUANTILES:
+                lines.append(f'nlq_stage_duration_seconds{{{labels},quantile="{quantile}"}} {percentile(values, quantile)}')
+            lines.append(f"nlq_stage_duration_seconds_sum{{{labels}}} {total}")
+            lines.append(f"nlq_stage_duration_seconds_count{{{labels}}} {count}")
+        for name, help_text in COUNTERS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for (counter, labels), value in sorted(counters.items()):
+                if counter == name:
+                    lines.append(f"{name}{{{_labels(labels)}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._durations.clear()
+
+_registry = MetricsRegistry()
+
+def get_registry():
+    """Return the process-wide MetricsRegistry."""
+    return _registry
+
+class Trace:
+    """
+    Per-request record of stage spans, result sizes, LLM tokens and cache outcomes.
+    Spans may be added from worker threads; asyncio.to_thread carries the active trace along.
+    """
+
+    def __init__(self, backend, nl_query=None):
+        self.request_id = uuid.uuid4().hex[:12]
+        self.backend = backend
+        self.nl_query = nl_query
+        self.status = None
+        self.started = time.perf_counter()
+        self.spans = []   # (stage, start offset in seconds, duration in seconds)
+        self.values = {}  # e.g. rows, bytes, llm_input_tokens
+        self.caches = {}  # cache name -> 'hit' or 'miss' (the last lookup)
+        self._lock = threading.Lock()
+
+    def add_span(self, stage, start, seconds):
+        with self._lock:
+            self.spans.append((stage, start - self.started, seconds))
+
+    def add(self, name, value):
+        with self._lock:
+            self.values[name] = self.values.get(name, 0) + value
+
+    def set_cache(self, cache, outcome):
+        with self._lock:
+            self.caches[cache] = outcome
+
+    def to_dict(self):
+        """Returns: dict with request_id, backend, nl_query, status, spans, values and caches."""
+        with self._lock:
+            return {
+                "request_id": self.request_id,
+                "backend": self.backend,
+                "nl_query": self.nl_query,
+                "status": self.status,
+                "spans": [{"stage": stage, "start": round(start, 6), "seconds": round(seconds, 6)}
+                          for stage, start, seconds in sorted(self.spans, key=lambda span: span[1])],
+                "values": dict(self.values),
+                "caches": dict(self.caches),
+            }
+
+def current_trace():
+    """Return the Trace of the request being handled in this context, or None."""
+    return _current_trace.get()
+
+@contextmanager
+def trace(backend, nl_query=None):
+    """
+    Trace one request: stages, counts and cache outcomes recorded inside the block are attached
+    to the yielded Trace, and its total time is recorded as stage 'total'.
+    Args:
+        backend (str): The db_type, used as the metrics label.
+        nl_query (str): The question, kept on the trace for display.
+    Yields:
+        Trace: The active trace.
+    """
+    active = Trace(backend, nl_query)
+    token = _current_trace.set(active)
+    try:
+        yield active
+        # A caller that handles a failure itself can set status = "error" before leaving the block
+        active.status = active.status or "ok"
+    except BaseException:
+        active.status = "error"
+        raise
+    finally:
+        _current_trace.reset(token)
+        seconds = time.perf_counter() - active.started
+        active.add_span("total", active.started, seconds)
+        if METRICS_ENABLED:
+            _registry.observe(backend, "total", seconds)
+            _registry.inc("nlq_requests_total", backend=backend, status=active.status)
+
+@contextmanager
+def stage(name):
+    """Time a block as stage `name` of the current request; a no-op outside trace()."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, start, time.perf_counter() - start)
+
+def record_stage(name, start, seconds):
+    """Record an already timed stage (start from time.perf_counter()) on the current request."""
+    active = _current_trace.get()
+    if active is not None:
+        active.add_span(name, start, seconds)
+        if METRICS_ENABLED:
+            _registry.observe(active.backend, name, seconds)
+
+def record_result(result):
+    """Count the rows and in-memory bytes of a DataFrame or pa.Table returned to the current request."""
+    active = _current_trace.get()
+    if active is None:
+        return
+    rows = len(result)
+    size = result.nbytes if isinstance(result, pa.Table) else int(result.memory_usage(index=False, deep=True).sum())
+    active.add("rows", rows)
+    active.add("bytes", size)
+    if METRICS_ENABLED:
+        _registry.inc("nlq_result_rows_total", rows, backend=active.backend)
+        _registry.inc("nlq_result_bytes_total", size, backend=active.backend)
+
+def record_llm_usage(response):
+    """Count the input/output tokens reported on a LangChain chat response, if any."""
+    active = _current_trace.get()
+    usage = getattr(response, "usage_metadata", None) or {}
+    if active is None or not usage:
+        return
+    for kind in ("input", "output"):
+        tokens = usage.get(f"{kind}_tokens", 0)
+        active.add(f"llm_{kind}_tokens", tokens)
+        if METRICS_ENABLED:
+            _registry.inc("nlq_llm_tokens_total", tokens, backend=active.backend, kind=kind)
+
+def record_cache(cache, hit):
+    """Record a lookup in `cache` (e.g., 'query', 'result', 'schema') for the current request."""
+    active = _current_trace.get()
+    if active is None:
+        return
+    active.set_cache(cache, "hit" if hit else "miss")
+    if METRICS_ENABLED:
+        _registry.inc("nlq_cache_requests_total", backend=active.backend, cache=cache, result="hit" if hit else "miss")
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = _registry.render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("metrics endpoint: " + format, *args)
+
+_server = None
+_server_lock = threading.Lock()
+
+def start_metrics_server(port=None, host=None):
+    """
+    Serve /metrics over HTTP from a daemon thread, once per process.
+    Args:
+        port (int): Defaults to METRICS_PORT; nothing is started if it is 0.
+        host (str): Defaults to METRICS_HOST.
+    Returns:
+        ThreadingHTTPServer: The running server, or None.
+    """
+    global _server
+    port = METRICS_PORT if port is None else port
+    with _server_lock:
+        if _server is None and port:
+            _server = ThreadingHTTPServer((host or METRICS_HOST, port), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="nlq-metrics", daemon=True).start()
+            logger.info("Serving metrics on http://%s:%d/metrics", host or METRICS_HOST, port)
+        return _server
@@ -0,0 +1,60 @@
+import json
+import logging
+import os
+import sys
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# DEBUG adds per-step diagnostics such as intermediate DataFrames and pushed-down filters
+NLQ_LOG_LEVEL = os.getenv("NLQ_LOG_LEVEL", "INFO").upper()
+# 'text' for human-readable lines, 'json' for one JSON object per line
+NLQ_LOG_FORMAT = os.getenv("NLQ_LOG_FORMAT", "text")
+ROOT_LOGGER = "nlq"
+
+_lock = threading.Lock()
+_configured = False
+
+class JsonFormatter(logging.Formatter):
+    """Format records as JSON with time, level, logger, message and any fields passed via `extra`."""
+
+    STANDARD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update({field: value for field, value in vars(record).items() if field not in self.STANDARD_FIELDS})
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def get_logger(name):
+    """
+    Return a logger in the 'nlq' hierarchy, configuring its stderr handler on first use.
+    Pass expensive values (DataFrames, key lists) as %-style arguments, e.g.
+    logger.debug("Filtered DataFrame:\\n%s", df), so their repr is only built when the level is enabled.
+    Args:
+        name (str): The module name (e.g., __name__).
+    Returns:
+        logging.Logger: The logger 'nlq.<name>'.
+    """
+    global _configured
+    with _lock:
+        if not _configured:
+            root = logging.getLogger(ROOT_LOGGER)
+            handler = logging.StreamHandler(sys.stderr)
+            if NLQ_LOG_FORMAT == 'json':
+                handler.setFormatter(JsonFormatter())
+            else:
+                handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+            root.addHandler(handler)
+            root.setLevel(NLQ_LOG_LEVEL)
+            # Keep records out of the root logger so Streamlit's own handlers don't print them twice
+            root.propagate = False
+            _configured = True
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
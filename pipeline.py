@@ -0,0 +1,165 @@
+import asyncio
+import os
+import time
+from dotenv import load_dotenv
+from schema_cache import get_cached_schema, get_cached_schema_description
+from query_generator import generate_query, invalidate_query
+from db_connectors import execute_query, wants_enriched_view
+from cost_guard import QueryRejectedError
+from index_advisor import record_query
+from nlq_logging import get_logger
+from metrics import trace, record_stage, record_result
+from profiling import profile_call
+
+load_dotenv()
+logger = get_logger(__name__)
+
+# Per-stage and end-to-end timeouts in seconds
+STAGE_TIMEOUT = float(os.getenv("PIPELINE_STAGE_TIMEOUT", 60))
+PIPELINE_TIMEOUT = float(os.getenv("PIPELINE_TIMEOUT", 180))
+
+class RateLimiter:
+    """
+    Async limiter allowing at most `rate` acquisitions per `period` seconds, spaced evenly.
+    Used to keep concurrent pipelines under the LLM provider's request quota.
+    """
+
+    def __init__(self, rate, period=60.0):
+        self.interval = period / rate
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+async def _run_stage(name, timings, timeout, func, *args):
+    # Blocking DB and LLM calls run in worker threads so independent stages overlap.
+    # Cancelling a stage stops waiting for it; the thread itself finishes in the background.
+    # Inside profile_request() the stage is profiled in its worker thread.
+    start = time.perf_counter()
+    try:
+        return await asyncio.wait_for(asyncio.to_thread(profile_call, name, func, *args), timeout)
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"Pipeline stage '{name}' timed out after {timeout}s")
+    finally:
+        timings[name] = time.perf_counter() - start
+        record_stage(name, start, timings[name])
+
+async def fetch_schemas(targets, timeout=None):
+    """
+    Detect the schemas of several backends concurrently.
+    Args:
+        targets (dict): db_type -> db_config.
+        timeout (float): Per-backend timeout; defaults to PIPELINE_STAGE_TIMEOUT.
+    Returns:
+        dict: db_type -> schema dict, or the exception raised for that backend.
+    """
+    timings = {}
+    db_types = list(targets)
+    results = await asyncio.gather(
+        *(_run_stage(f"schema:{db_type}", timings, timeout or STAGE_TIMEOUT, get_cached_schema, db_type, targets[db_type])
+          for db_type in db_types),
+        return_exceptions=True,
+    )
+    return {db_type: result if isinstance(result, BaseException) else result[0]
+            for db_type, result in zip(db_types, results)}
+
+async def _describe(schema, timings, stage_timeout, llm_limiter):
+    if llm_limiter:
+        await llm_limiter.acquire()
+    return await _run_stage("describe", timings, stage_timeout, get_cached_schema_description, schema)
+
+async def run_nlq(nl_query, db_type, db_config, schema=None, describe=True, stage_timeout=None, llm_limiter=None):
+    """
+    Answer one question, overlapping independent stages.
+    The schema description runs concurrently with query generation and execution, so it adds
+    no latency unless it is the slowest stage. If any stage fails or is cancelled, the
+    outstanding description task is cancelled too. A SQL query the cost guard rejects is
+    regenerated once, with the rejection reason as feedback.
+    Args:
+        nl_query (str): The user's question.
+        db_type (str): One of 'sqlite', 'postgresql', 'mongodb' or 'redis'.
+        db_config (dict): The backend configuration, as for schema_detector.get_schema.
+        schema (dict): A schema that was already detected; fetched (cached) if None.
+        describe (bool): Also produce the LLM schema description.
+        stage_timeout (float): Per-stage timeout; defaults to PIPELINE_STAGE_TIMEOUT.
+        llm_limiter (RateLimiter): Acquired before each LLM stage, if given.
+    Returns:
+        dict: nl_query, db_type, query, result (DataFrame), description, per-stage timings in
+        seconds and the request trace (metrics.Trace.to_dict()).
+    """
+    with trace(db_type, nl_query) as request_trace:
+        answer = await _run_nlq(nl_query, db_type, db_config, schema, describe, stage_timeout, llm_limiter)
+    answer["trace"] = request_trace.to_dict()
+    return answer
+
+async def _execute(name, timings, stage_timeout, nl_query, schema, db_type, db_config, query):
+    # Run a generated query; one that fails (other than a cost guard rejection, which regenerates it) leaves the query cache
+    enriched = wants_enriched_view(nl_query)
+    try:
+        return await _run_stage(name, timings, stage_timeout, execute_query, db_type, db_config, query, enriched)
+    except QueryRejectedError:
+        raise
+    except Exception:
+        await asyncio.to_thread(invalidate_query, schema, db_type, query)
+        raise
+
+async def _run_nlq(nl_query, db_type, db_config, schema, describe, stage_timeout, llm_limiter):
+    stage_timeout = stage_timeout or STAGE_TIMEOUT
+    timings = {}
+    start = time.perf_counter()
+    if schema is None:
+        schema, _ = await _run_stage("schema", timings, stage_timeout, get_cached_schema, db_type, db_config)
+    description_task = None
+    if describe:
+        description_task = asyncio.create_task(_describe(schema, timings, stage_timeout, llm_limiter))
+    try:
+        if llm_limiter:
+            await llm_limiter.acquire()
+        query = await _run_stage("generate", timings, stage_timeout, generate_query, nl_query, schema, db_type)
+        try:
+            result = await _execute("execute", timings, stage_timeout, nl_query, schema, db_type, db_config, query)
+        except QueryRejectedError as e:
+            # The cost guard refused the query before it ran; ask once for a cheaper one
+            logger.warning("Query rejected for %r: %s", nl_query, e)
+            if llm_limiter:
+                await llm_limiter.acquire()
+            query = await _run_stage("regenerate", timings, stage_timeout, generate_query, nl_query, schema, db_type, True, str(e))
+            result = await _execute("execute:retry", timings, stage_timeout, nl_query, schema, db_type, db_config, query)
+        record_result(result)
+        await asyncio.to_thread(record_query, db_type, db_config, query, schema)
+        description = await description_task if description_task else None
+    except BaseException:
+        if description_task:
+            description_task.cancel()
+        raise
+    timings["total"] = time.perf_counter() - start
+    return {
+        "nl_query": nl_query,
+        "db_type": db_type,
+        "query": query,
+        "result": result,
+        "description": description,
+        "timings": timings,
+    }
+
+def run_nlq_sync(nl_query, db_type, db_config, schema=None, describe=True, timeout=None):
+    """
+    Blocking wrapper around run_nlq with an end-to-end timeout, for Streamlit and scripts.
+    Args:
+        timeout (float): End-to-end timeout; defaults to PIPELINE_TIMEOUT.
+    Returns:
+        dict: See run_nlq.
+    """
+    async def _run():
+        try:
+            return await asyncio.wait_for(run_nlq(nl_query, db_type, db_config, schema, describe),
+                                          timeout or PIPELINE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Pipeline timed out after {timeout or PIPELINE_TIMEOUT}s")
+    return asyncio.run(_run())
@@ -0,0 +1,273 @@
+import cProfile
+import contextvars
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from nlq_logging import get_logger
+
+load_dotenv()
+logger = get_logger(__name__)
+
+# Profile every request by default (the app can also switch it on from the sidebar, batch mode with --profile)
+NLQ_PROFILE = os.getenv("NLQ_PROFILE", "0") == "1"
+# Artifacts are written to <PROFILE_DIR>/<request id>/
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+# Seconds between stack samples for the collapsed-stack (flame graph) output
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", 0.005))
+# Functions and allocation sites kept in the summary and allocations.txt
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", 25))
+
+_current_profile = contextvars.ContextVar("nlq_profile", default=None)
+_thread_state = threading.local()
+
+_sampler_lock = threading.Lock()
+_sampled_threads = {}  # thread id -> (RequestProfile, stage name, depth of the frame that entered the stage)
+_sampler = None
+
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0       # profiled requests in flight
+_tracemalloc_started = False  # whether tracing was started here (and so should be stopped here)
+
+def _frame_label(code):
+    # ';' separates frames in the collapsed format, so it can't appear in a label
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}:{code.co_name}".replace(';', ',')
+
+def _stack(frame):
+    # Root-first list of frames
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    return frames[::-1]
+
+def _sample_stacks():
+    # Runs while any profiled stage is active; exits (and clears _sampler) once none is
+    global _sampler
+    while True:
+        with _sampler_lock:
+            if not _sampled_threads:
+                _sampler = None
+                return
+            targets = dict(_sampled_threads)
+        frames = sys._current_frames()
+        for ident, (profile, stage_name, depth) in targets.items():
+            frame = frames.get(ident)
+            if frame is not None:
+                # Drop the frames below the stage (event loop, Streamlit script runner, thread bootstrap)
+                labels = [_frame_label(entry.f_code) for entry in _stack(frame)[depth:]]
+                profile.add_sample(";".join([stage_name, *labels]))
+        del frames
+        time.sleep(PROFILE_SAMPLE_INTERVAL)
+
+class RequestProfile:
+    """
+    cProfile statistics, sampled call stacks and tracemalloc allocations of one request.
+    Each profile_stage() block gets its own cProfile.Profile (profilers are per thread and stages
+    may run in worker threads); they are merged into one pstats file when the profile is saved.
+    On Python 3.12+ only one cProfile can be active per process, so a stage that overlaps another
+    profiled stage is timed and sampled but has no cProfile statistics.
+    """
+
+    def __init__(self, label=None):
+        self.request_id = uuid.uuid4().hex[:12]
+        self.label = label
+        self.stages = []  # (stage name, seconds)
+        self.samples = Counter()  # collapsed stack -> sample count
+        self.allocations = []  # tracemalloc.StatisticDiff, largest first
+        self.peak_bytes = None
+        self._profilers = []
+        self._start_snapshot = None
+        self._lock = threading.Lock()
+
+    def add_profiler(self, stage_name, profiler, seconds):
+        with self._lock:
+            if profiler is not None:
+                self._profilers.append(profiler)
+            self.stages.append((stage_name, seconds))
+
+    def add_sample(self, stack):
+        with self._lock:
+            self.samples[stack] += 1
+
+    def stats(self):
+        """Returns: pstats.Stats merged over all stages, or None if no stage was profiled."""
+        with self._lock:
+            profilers = list(self._profilers)
+        if not profilers:
+            return None
+        return pstats.Stats(*profilers)
+
+    def collapsed_stacks(self):
+        """
+        Return the sampled stacks in the collapsed format ('stage;module:function;... count' per line)
+        read by flamegraph.pl, speedscope and most other flame graph tools.
+        """
+        with self._lock:
+            return "".join(f"{stack} {count}\n" for stack, count in sorted(self.samples.items()))
+
+    def summary(self, top=None):
+        """
+        Args:
+            top (int): Functions and allocation sites to include; defaults to PROFILE_TOP.
+        Returns:
+            dict: request_id, label, stages, functions (by cumulative time), allocations
+            (by bytes still held at the end of the request), peak_bytes and samples.
+        """
+        top = top or PROFILE_TOP
+        stats = self.stats()
+        functions = []
+        if stats is not None:
+            entries = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+            functions = [{"function": f"{name} ({os.path.basename(filename)}:{line})", "calls": calls,
+                          "tottime": round(tottime, 6), "cumtime": round(cumtime, 6)}
+                         for (filename, line, name), (_, calls, tottime, cumtime, _) in entries]
+        return {
+            "request_id": self.request_id,
+            "label": self.label,
+            "stages": [{"stage": stage_name, "seconds": round(seconds, 6)} for stage_name, seconds in self.stages],
+            "functions": functions,
+            "allocations": [{"site": str(stat.traceback[0]), "bytes": stat.size_diff, "blocks": stat.count_diff}
+                            for stat in self.allocations[:top]],
+            "peak_bytes": self.peak_bytes,
+            "samples": sum(self.samples.values()),
+        }
+
+    def save(self, output_dir):
+        """
+        Write profile.pstats, stacks.collapsed, allocations.txt and summary.json to output_dir.
+        Returns:
+            dict: The summary, with the artifact paths under "files".
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        files = {name: os.path.join(output_dir, name)
+                 for name in ("profile.pstats", "stacks.collapsed", "allocations.txt", "summary.json")}
+        stats = self.stats()
+        if stats is not None:
+            stats.dump_stats(files["profile.pstats"])
+        else:
+            files.pop("profile.pstats")
+        with open(files["stacks.collapsed"], "w", encoding="utf-8") as f:
+            f.write(self.collapsed_stacks())
+        with open(files["allocations.txt"], "w", encoding="utf-8") as f:
+            if self.peak_bytes is not None:
+                f.write(f"Peak traced memory: {self.peak_bytes / 1e6:.1f} MB\n")
+            for stat in self.allocations[:PROFILE_TOP]:
+                f.write(f"{stat.size_diff / 1024:+.1f} KiB in {stat.count_diff:+d} blocks: {stat.traceback[0]}\n")
+        summary = dict(self.summary(), files=files)
+        with open(files["summary.json"], "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        return summary
+
+    def _start_allocations(self):
+        global _tracemalloc_users, _tracemalloc_started
+        with _tracemalloc_lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                _tracemalloc_started = True
+            _tracemalloc_users += 1
+            # The peak is process-wide: with concurrent profiled requests it covers all of them
+            tracemalloc.reset_peak()
+        self._start_snapshot = tracemalloc.take_snapshot()
+
+    def _finish_allocations(self):
+        global _tracemalloc_users, _tracemalloc_started
+        snapshot = tracemalloc.take_snapshot()
+        self.peak_bytes = tracemalloc.get_traced_memory()[1]
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__),
+                  tracemalloc.Filter(False, "<frozen importlib._bootstrap*>")]
+        diff = snapshot.filter_traces(ignore).compare_to(self._start_snapshot.filter_traces(ignore), 'lineno')
+        self.allocations = [stat for stat in diff if stat.size_diff > 0]
+        self._start_snapshot = None
+        with _tracemalloc_lock:
+            _tracemalloc_users -= 1
+            if _tracemalloc_users == 0 and _tracemalloc_started:
+                tracemalloc.stop()
+                _tracemalloc_started = False
+
+def current_profile():
+    """Return the RequestProfile of the request being handled in this context, or None."""
+    return _current_profile.get()
+
+@contextmanager
+def profile_request(label=None, output_dir=None, enabled=None):
+    """
+    Profile one request: stages entered with profile_stage() inside the block are run under
+    cProfile and stack sampling, and allocations are traced with tracemalloc until it ends.
+    On exit the artifacts are saved (see RequestProfile.save).
+    Args:
+        label (str): Shown in the summary, e.g., the question.
+        output_dir (str): Artifact directory; defaults to <PROFILE_DIR>/<request id>.
+        enabled (bool): Defaults to NLQ_PROFILE; when False the block runs unprofiled.
+    Yields:
+        RequestProfile: The active profile, or None if profiling is off.
+    """
+    enabled = NLQ_PROFILE if enabled is None else enabled
+    if not enabled:
+        yield None
+        return
+    active = RequestProfile(label)
+    active._start_allocations()
+    token = _current_profile.set(active)
+    try:
+        yield active
+    finally:
+        _current_profile.reset(token)
+        active._finish_allocations()
+        output_dir = output_dir or os.path.join(PROFILE_DIR, active.request_id)
+        try:
+            summary = active.save(output_dir)
+            logger.info("Saved profile of %r to %s (%d stack samples)", label, output_dir, summary["samples"])
+        except OSError as e:
+            logger.warning("Could not save profile to %s: %s", output_dir, e)
+
+@contextmanager
+def profile_stage(name):
+    """
+    Run a block of the current request under cProfile and the stack sampler; a no-op outside
+    profile_request() or inside another profiled stage on the same thread.
+    """
+    global _sampler
+    active = _current_profile.get()
+    if active is None or getattr(_thread_state, "profiling", False):
+        yield
+        return
+    # Samples keep the frames from the one entering this block upward (skipping this generator and contextlib)
+    depth = len(_stack(sys._getframe(2)))
+    ident = threading.get_ident()
+    with _sampler_lock:
+        _sampled_threads[ident] = (active, name, depth - 1)
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sample_stacks, name="nlq-profile-sampler", daemon=True)
+            _sampler.start()
+    _thread_state.profiling = True
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        # Python 3.12+: "Another profiling tool is already active" (a concurrent stage or an outside profiler)
+        logger.debug("Stage %r runs without cProfile: %s", name, e)
+        profiler = None
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        _thread_state.profiling = False
+        with _sampler_lock:
+            _sampled_threads.pop(ident, None)
+        active.add_profiler(name, profiler, time.perf_counter() - start)
+
+def profile_call(name, func, *args):
+    """Call func(*args) as profiled stage `name`; used to profile work handed to worker threads."""
+    with profile_stage(name):
+        return func(*args)
@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+QUERY_CACHE_ENABLED = os.getenv("NLQ_CACHE_ENABLED", "1") == "1"
+QUERY_CACHE_PATH = os.getenv("NLQ_CACHE_PATH", "nlq_cache.db")
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("NLQ_CACHE_MAX_ENTRIES", 5000))
+QUERY_CACHE_TTL = float(os.getenv("NLQ_CACHE_TTL", 7 * 24 * 3600))
+# Minimum word overlap (Jaccard) for a near-duplicate question to reuse a cached query; 1 disables fuzzy matching
+QUERY_CACHE_SIMILARITY = float(os.getenv("NLQ_CACHE_SIMILARITY", 1.0))
+# Most recently used entries compared when looking for a near-duplicate
+QUERY_CACHE_FUZZY_CANDIDATES = 500
+
+STOPWORDS = {'a', 'an', 'the', 'all', 'me', 'show', 'list', 'get', 'find', 'display', 'please', 'what', 'are', 'is', 'of'}
+# Tokens that change a question's meaning as much as its literal values; near-duplicates must agree on them
+COMPARISON_TOKENS = {'<', '>', '<=', '>=', '=', '!=', 'not', 'no', 'greater', 'less', 'more', 'fewer',
+                     'above', 'below', 'over', 'under', 'before', 'after', 'least', 'most'}
+
+# Comparison operators, then numbers with an optional sign (a '-' right after a letter or digit
+# is a joiner, e.g., 't-shirt' or '2025-01-01'), then words
+TOKEN_PATTERN = re.compile(r"[<>!]=|[<>=]|(?<![a-z0-9])-?\d[a-z0-9]*(?:[.\-:@][a-z0-9]+)*|[a-z0-9_]+(?:[.\-:@][a-z0-9_]+)*")
+
+def normalize_query(nl_query):
+    """
+    Normalize a natural language question for cache lookups.
+    Lowercases, drops punctuation and collapses whitespace while keeping numbers (with their sign),
+    dates, identifiers with underscores and the comparison operators <, >, <=, >=, = and != intact.
+    Args:
+        nl_query (str): The user's question.
+    Returns:
+        str: The normalized question.
+    """
+    return " ".join(TOKEN_PATTERN.findall(nl_query.lower().replace('<>', '!=')))
+
+def schema_fingerprint(schema):
+    """
+    Hash a schema dict so cached entries are tied to the schema they were generated for.
+    Args:
+        schema (dict): Table/collection name -> columns, as returned by the get_*_schema functions.
+    Returns:
+        str: A short hex digest.
+    """
+    return hashlib.sha256(json.dumps(schema, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+def _is_literal(token):
+    return token in COMPARISON_TOKENS or any(ch.isdigit() for ch in token)
+
+def _split_tokens(normalized):
+    # Literal values (numbers, dates, ids) and comparisons must match exactly; the remaining words are compared fuzzily
+    tokens = normalized.split()
+    literals = sorted(token for token in tokens if _is_literal(token))
+    words = {token for token in tokens if token not in STOPWORDS and not _is_literal(token)}
+    return literals, words
+
+class QueryCache:
+    """
+    Generated-query cache keyed on (normalized question, schema fingerprint, db_type).
+    Entries live in a SQLite file so they survive restarts, expire after ttl seconds and the
+    least recently used entries are evicted beyond max_entries.
+    """
+
+    def __init__(self, path=None, max_entries=None, ttl=None, similarity=None):
+        self.path = path or QUERY_CACHE_PATH
+        self.max_entries = max_entries or QUERY_CACHE_MAX_ENTRIES
+        self.ttl = ttl or QUERY_CACHE_TTL
+        self.similarity = QUERY_CACHE_SIMILARITY if similarity is None else similarity
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS query_cache (
+                cache_key TEXT PRIMARY KEY,
+                db_type TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                normalized_query TEXT NOT NULL,
+                generated_query TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_query_cache_scope ON query_cache (db_type, fingerprint, last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def _key(normalized, fingerprint, db_type):
+        return hashlib.sha256(f"{db_type}\x00{fingerprint}\x00{normalized}".encode()).hexdigest()
+
+    def get(self, nl_query, schema, db_type):
+        """
+        Look up a previously generated query.
+        Args:
+            nl_query (str): The user's question.
+            schema (dict): The schema the query would be generated against.
+            db_type (str): The target database type.
+        Returns:
+            str: The cached query, or None on a miss.
+        """
+        normalized = normalize_query(nl_query)
+        fingerprint = schema_fingerprint(schema)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT cache_key, generated_query FROM query_cache WHERE cache_key = ? AND created_at > ?",
+                (self._key(normalized, fingerprint, db_type), now - self.ttl),
+            ).fetchone()
+            if row is None and self.similarity < 1:
+                row = self._find_near_duplicate(normalized, fingerprint, db_type, now)
+                if row is not None:
+                    self.near_hits += 1
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE query_cache SET last_used = ? WHERE cache_key = ?", (now, row[0]))
+            self._conn.commit()
+            return row[1]
+
+    def _find_near_duplicate(self, normalized, fingerprint, db_type, now):
+        literals, words = _split_tokens(normalized)
+        best, best_score = None, self.similarity
+        candidates = self._conn.execute(
+            """SELECT cache_key, generated_query, normalized_query FROM query_cache
+               WHERE db_type = ? AND fingerprint = ? AND created_at > ?
+               ORDER BY last_used DESC LIMIT ?""",
+            (db_type, fingerprint, now - self.ttl, QUERY_CACHE_FUZZY_CANDIDATES),
+        )
+        for cache_key, generated_query, candidate in candidates:
+            candidate_literals, candidate_words = _split_tokens(candidate)
+            if candidate_literals != literals or not (words or candidate_words):
+                continue
+            score = len(words & candidate_words) / len(words | candidate_words)
+            if score >= best_score:
+                best, best_score = (cache_key, generated_query), score
+        return best
+
+    def put(self, nl_query, schema, db_type, generated_query):
+        """Store a generated query, then drop expired entries and evict beyond max_entries."""
+        normalized = normalize_query(nl_query)
+        fingerprint = schema_fingerprint(schema)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO query_cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self._key(normalized, fingerprint, db_type), db_type, fingerprint, normalized, generated_query, now, now),
+            )
+            self._conn.execute("DELETE FROM query_cache WHERE created_at <= ?", (now - self.ttl,))
+            self._conn.execute(
+                """DELETE FROM query_cache WHERE cache_key IN (
+                       SELECT cache_key FROM query_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)""",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def invalidate(self, schema, db_type, generated_query):
+        """
+        Drop every entry that maps to generated_query (e.g., because it failed to run), so the
+        questions it answered, including near-duplicates, are generated again.
+        Returns:
+            int: The number of entries removed.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM query_cache WHERE db_type = ? AND fingerprint = ? AND generated_query = ?",
+                (db_type, schema_fingerprint(schema), generated_query),
+            )
+            self._conn.commit()
+            return cursor.rowcount
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM query_cache")
+            self._conn.commit()
+
+    def stats(self):
+        """
+        Returns:
+            dict: hits (including near_hits), near_hits, misses, hit_rate and current entries.
+        """
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM query_cache").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_query_cache():
+    """Return the process-wide QueryCache backed by NLQ_CACHE_PATH."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = QueryCache()
+        return _default_cache
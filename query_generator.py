@@ -1,11 +1,28 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.prompts import PromptTemplate
 from dotenv import load_dotenv
-import os
 import json
 import re
+from query_cache import get_query_cache, QUERY_CACHE_ENABLED
+from llm_client import get_llm, get_prompt_template
+from nlq_logging import get_logger
+from metrics import stage, record_cache, record_llm_usage
 
 load_dotenv()
+logger = get_logger(__name__)
+
+# Prompt templates, compiled once per db_type by _get_prompt_template
+SQL_PROMPT_TEMPLATE = "Given the schema:\n{schema}\nGenerate an SQL query for the following natural language query in {db_type}:\n{query}\nReturn only the SQL query as a string, without any Markdown formatting or additional text. For example, return 'SELECT * FROM customers;' directly. Use EXTRACT(YEAR FROM column) for year extraction in PostgreSQL, and strftime('%Y', column) for SQLite. For date comparisons (e.g., 'before 2025-05-20'), use direct comparisons like 'column < ''2025-05-20''' if the column is in 'YYYY-MM-DD' format; avoid unnecessary strftime or EXTRACT unless extracting specific parts (e.g., year). For 'after' date conditions (e.g., 'after 2024-01-01'), use 'column > ''2024-01-01''' (strictly greater than). Interpret 'ordered more than once' as quantity > 1 in a single order unless specified otherwise. For discount calculations, assume discount is stored as a percentage (e.g., 15.00 for 15%) and adjust conditions accordingly (e.g., 'discount greater than 10%' means discount > 10). For phrases like 'products costing more than X', interpret as the unit price (products.price), not the total order price (orders.total_price), unless the prompt explicitly mentions 'total cost' or 'total price'. Ensure GROUP BY includes all non-aggregated columns in the SELECT clause. Add DISTINCT to SELECT when querying for emails to avoid duplicates. Add meaningful aliases for aggregated columns (e.g., AVG(column) AS avg_column)."
+
+MONGODB_PROMPT_TEMPLATE = "Given the schema:\n{schema}\nGenerate a MongoDB aggregation pipeline for the following natural language query:\n{query}\nReturn a JSON object in the format {{\"collection\": \"<collection name>\", \"pipeline\": [{{\"stage\": \"value\"}}, ...]}} using aggregation pipeline stages ($lookup, $match, $group, $project, etc.) for joins, filtering, and aggregation. Set 'collection' to the schema collection the pipeline starts from: the collection being asked about for single-entity queries (e.g., 'customers' for 'show all customers'), and 'orders' for queries involving multiple entities (e.g., customers and products). Use $lookup to join with other collections, $match for filtering, $group for aggregations, and $project for selecting fields. For customer names, concatenate first_name and last_name using $concat (e.g., {{ \"$concat\": [\"$customer.first_name\", \" \", \"$customer.last_name\"] }}). For year-based filtering (e.g., 'in 2025'), use date range comparisons like {{ \"$gte\": \"2025-01-01\", \"$lte\": \"2025-12-31\" }} instead of $regex. Ensure all aggregation pipelines include a $project stage to exclude _id unless explicitly needed. If the prompt asks for fields not in the schema (e.g., 'address'), use available fields like 'city' or 'country' instead. For example, to join orders with customers, return {{\"collection\": \"orders\", \"pipeline\": [{{\"$lookup\": {{ \"from\": \"customers\", \"localField\": \"customer_id\", \"foreignField\": \"customer_id\", \"as\": \"customer\" }} }}]}}. Do not use $out or $merge. Ensure the output is a valid JSON string without any Markdown formatting or additional text."
+
+REDIS_PROMPT_TEMPLATE = "Given the schema:\n{schema}\nGenerate a Redis query for the following natural language query:\n{query}\nReturn the query as a JSON string in the format {{\"key\": \"<key_name>\"}}. Match the query to the schema: for queries requesting all records of a type (e.g., 'show all customers'), use a pattern like 'customer:*'; for queries requesting a specific record with an ID (e.g., 'show customer with ID 1'), use the exact key like 'customer:1'; for queries involving multiple entities (e.g., 'customers who ordered products'), use 'order:*'. Add conditions as fields: for numeric filtering (e.g., 'price greater than 500'), include 'price_condition' with 'gt' or 'lt' subfields; for date filtering (e.g., 'before 2025-03-01'), include 'date_condition'; for year filtering (e.g., 'in 2025'), include 'year'; for categorical filtering (e.g., 'category Electronics'), include 'category'; for manufacturer, include 'manufacturer'; for city, include 'customer_city'; for discount (stored as percentage, e.g., 15.00 for 15%), include 'discount_condition'; for stock quantity or credit limit, include 'stock_condition' or 'credit_limit_condition'. Do not include aggregation instructions like 'avg_total_price' in the query; aggregations should be handled by the application. Examples: for 'products with price greater than 500', return {{\"key\": \"product:*\", \"price_condition\": {{\"gt\": 500}}}}; for 'orders in 2025 with category Electronics', return {{\"key\": \"order:*\", \"year\": 2025, \"category\": \"Electronics\"}}. Ensure the output is a valid JSON string without any Markdown formatting or additional text."
+
+def _get_prompt_template(db_type):
+    if db_type in ['sqlite', 'postgresql']:
+        return get_prompt_template('sql', SQL_PROMPT_TEMPLATE, ["schema", "query", "db_type"])
+    elif db_type == 'mongodb':
+        return get_prompt_template('mongodb', MONGODB_PROMPT_TEMPLATE, ["schema", "query"])
+    else:  # redis
+        return get_prompt_template('redis', REDIS_PROMPT_TEMPLATE, ["schema", "query"])
 
 def clean_sql_query(query_str):
     """
@@ -70,40 +87,78 @@ def clean_json_query(query_str):
 
     return query_str
 
-def generate_query(nl_query, schema, db_type):
-    llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", api_key=os.getenv("GEMINI_API_KEY"))
-    
-    schema_str = "\n".join([f"Table/Collection: {table}\nColumns/Fields: {cols}" for table, cols in schema.items()])
-    
-    if db_type in ['sqlite', 'postgresql']:
-        prompt_template = PromptTemplate(
-            input_variables=["schema", "query", "db_type"],
-            template="Given the schema:\n{schema}\nGenerate an SQL query for the following natural language query in {db_type}:\n{query}\nReturn only the SQL query as a string, without any Markdown formatting or additional text. For example, return 'SELECT * FROM customers;' directly. Use EXTRACT(YEAR FROM column) for year extraction in PostgreSQL, and strftime('%Y', column) for SQLite. For date comparisons (e.g., 'before 2025-05-20'), use direct comparisons like 'column < ''2025-05-20''' if the column is in 'YYYY-MM-DD' format; avoid unnecessary strftime or EXTRACT unless extracting specific parts (e.g., year). For 'after' date conditions (e.g., 'after 2024-01-01'), use 'column > ''2024-01-01''' (strictly greater than). Interpret 'ordered more than once' as quantity > 1 in a single order unless specified otherwise. For discount calculations, assume discount is stored as a percentage (e.g., 15.00 for 15%) and adjust conditions accordingly (e.g., 'discount greater than 10%' means discount > 10). For phrases like 'products costing more than X', interpret as the unit price (products.price), not the total order price (orders.total_price), unless the prompt explicitly mentions 'total cost' or 'total price'. Ensure GROUP BY includes all non-aggregated columns in the SELECT clause. Add DISTINCT to SELECT when querying for emails to avoid duplicates. Add meaningful aliases for aggregated columns (e.g., AVG(column) AS avg_column)."
-        )
-    elif db_type == 'mongodb':
-        prompt_template = PromptTemplate(
-            input_variables=["schema", "query"],
-            template="Given the schema:\n{schema}\nGenerate a MongoDB aggregation pipeline for the following natural language query:\n{query}\nReturn the pipeline as a JSON string in the format [{{\"stage\": \"value\"}}, ...] using aggregation pipeline stages ($lookup, $match, $group, $project, etc.) for joins, filtering, and aggregation. Assume the pipeline will be applied to the 'orders' collection for queries involving multiple entities (e.g., customers and products). Use $lookup to join with other collections, $match for filtering, $group for aggregations, and $project for selecting fields. For customer names, concatenate first_name and last_name using $concat (e.g., {{ \"$concat\": [\"$customer.first_name\", \" \", \"$customer.last_name\"] }}). For year-based filtering (e.g., 'in 2025'), use date range comparisons like {{ \"$gte\": \"2025-01-01\", \"$lte\": \"2025-12-31\" }} instead of $regex. Ensure all aggregation pipelines include a $project stage to exclude _id unless explicitly needed. If the prompt asks for fields not in the schema (e.g., 'address'), use available fields like 'city' or 'country' instead. For example, to join orders with customers, return [{{\"$lookup\": {{ \"from\": \"customers\", \"localField\": \"customer_id\", \"foreignField\": \"customer_id\", \"as\": \"customer\" }} }}]. Ensure the output is a valid JSON string without any Markdown formatting or additional text."
-        )
-    else:  # redis
-        prompt_template = PromptTemplate(
-            input_variables=["schema", "query"],
-            template="Given the schema:\n{schema}\nGenerate a Redis query for the following natural language query:\n{query}\nReturn the query as a JSON string in the format {{\"key\": \"<key_name>\"}}. Match the query to the schema: for queries requesting all records of a type (e.g., 'show all customers'), use a pattern like 'customer:*'; for queries requesting a specific record with an ID (e.g., 'show customer with ID 1'), use the exact key like 'customer:1'; for queries involving multiple entities (e.g., 'customers who ordered products'), use 'order:*'. Add conditions as fields: for numeric filtering (e.g., 'price greater than 500'), include 'price_condition' with 'gt' or 'lt' subfields; for date filtering (e.g., 'before 2025-03-01'), include 'date_condition'; for year filtering (e.g., 'in 2025'), include 'year'; for categorical filtering (e.g., 'category Electronics'), include 'category'; for manufacturer, include 'manufacturer'; for city, include 'customer_city'; for discount (stored as percentage, e.g., 15.00 for 15%), include 'discount_condition'; for stock quantity or credit limit, include 'stock_condition' or 'credit_limit_condition'. Do not include aggregation instructions like 'avg_total_price' in the query; aggregations should be handled by the application. Examples: for 'products with price greater than 500', return {{\"key\": \"product:*\", \"price_condition\": {{\"gt\": 500}}}}; for 'orders in 2025 with category Electronics', return {{\"key\": \"order:*\", \"year\": 2025, \"category\": \"Electronics\"}}. Ensure the output is a valid JSON string without any Markdown formatting or additional text."
-        )
+def generate_query(nl_query, schema, db_type, use_cache=True, feedback=None):
+    """
+    Generate a database query for a natural language question, reusing cached results when possible.
+    Args:
+        nl_query (str): The user's question.
+        schema (dict): The database schema from schema_detector.
+        db_type (str): One of 'sqlite', 'postgresql', 'mongodb' or 'redis'.
+        use_cache (bool): Look up and store the result in the generated-query cache.
+        feedback (str): Why the previous query for this question was rejected (e.g., a
+            cost_guard.QueryRejectedError message). The cache is bypassed and the new query replaces it.
+    Returns:
+        str: The generated query (SQL, or a JSON string for MongoDB and Redis).
+    """
+    cache = get_query_cache() if use_cache and QUERY_CACHE_ENABLED else None
+    if cache is not None and feedback is None:
+        cached_query = cache.get(nl_query, schema, db_type)
+        record_cache('query', cached_query is not None)
+        if cached_query is not None:
+            logger.debug("Query cache hit for %r: %s", nl_query, cached_query)
+            return cached_query
+
+    generated_query, parsed = _generate_query(nl_query, schema, db_type, feedback)
+    # Don't cache the fallbacks (empty MongoDB pipeline, keyword-built Redis query) used when the LLM output could not be parsed
+    if cache is not None and parsed:
+        cache.put(nl_query, schema, db_type, generated_query)
+    return generated_query
 
+def invalidate_query(schema, db_type, generated_query):
+    """
+    Drop a generated query that failed to run from the generated-query cache, so the next
+    request for the same question asks the LLM again instead of reusing it until it expires.
+    Args:
+        schema (dict): The schema the query was generated against.
+        db_type (str): The target database type.
+        generated_query (str): The query as returned by generate_query.
+    """
+    if not QUERY_CACHE_ENABLED or not isinstance(generated_query, str):
+        return
+    removed = get_query_cache().invalidate(schema, db_type, generated_query)
+    if removed:
+        logger.info("Dropped %d cached entries for failing query %s", removed, generated_query)
+
+def _generate_query(nl_query, schema, db_type, feedback=None):
+    schema_str = "\n".join([f"Table/Collection: {table}\nColumns/Fields: {cols}" for table, cols in schema.items()])
+    prompt_template = _get_prompt_template(db_type)
     prompt = prompt_template.format(schema=schema_str, query=nl_query, db_type=db_type.upper())
-    response = llm.invoke(prompt)
+    if feedback:
+        prompt += f"\nA previous query for this question was rejected before running: {feedback}. Generate a cheaper query that still answers the question."
+    with stage("llm"):
+        response = get_llm().invoke(prompt)
+    record_llm_usage(response)
     generated_query = response.content.strip()
-    print(f"Generated query for '{nl_query}': {generated_query}")  # Debug log
+    logger.debug("Generated query for %r: %s", nl_query, generated_query)
+    with stage("clean"):
+        return _clean_generated_query(nl_query, schema, db_type, generated_query)
 
-    # Clean the query based on database type
+def _clean_generated_query(nl_query, schema, db_type, generated_query):
+    # Clean the query based on database type; returns (query, whether the LLM output was usable)
     if db_type in ['sqlite', 'postgresql']:
         generated_query = clean_sql_query(generated_query)
     elif db_type in ['mongodb', 'redis']:
         generated_query = clean_json_query(generated_query)
-        print(f"Cleaned query for '{nl_query}': {generated_query}")  # Debug log
+        logger.debug("Cleaned query for %r: %s", nl_query, generated_query)
         try:
             query_dict = json.loads(generated_query)
+            if db_type == 'mongodb' and isinstance(query_dict, dict):
+                if not isinstance(query_dict.get("pipeline"), list):
+                    raise ValueError("MongoDB query must have a 'pipeline' list")
+                if query_dict.get("collection") not in schema:
+                    logger.warning("Unknown collection %s, using 'orders'", query_dict.get('collection'))
+                    query_dict["collection"] = "orders"
+                generated_query = json.dumps(query_dict)
             if db_type == 'redis':
                 if "key" not in query_dict:
                     raise ValueError("Redis query must have a 'key' field")
@@ -172,9 +227,9 @@ def generate_query(nl_query, schema, db_type):
                                 query_dict[condition_key] = {"lt": value}
                 generated_query = json.dumps(query_dict)  # Convert back to JSON string
         except (json.JSONDecodeError, ValueError) as e:
-            print(f"Error parsing generated query: {str(e)}")  # Debug log
+            logger.warning("Error parsing generated query: %s", e)
             if db_type == 'mongodb':
-                return '[]'  # Empty pipeline as fallback
+                return '[]', False  # Empty pipeline as fallback
             else:  # redis
                 query_dict = {"key": "order:*"}  # Default to orders for joins
                 if "id" in nl_query.lower():
@@ -239,6 +294,6 @@ def generate_query(nl_query, schema, db_type):
                             query_dict[condition_key] = {"gt": value}
                         elif "less than" in condition or "below" in condition:
                             query_dict[condition_key] = {"lt": value}
-                return json.dumps(query_dict)
+                return json.dumps(query_dict), False
     
-    return generated_query
\ No newline at end of file
+    return generated_query, True
\ No newline at end of file
@@ -0,0 +1,321 @@
+import argparse
+import os
+import re
+import time
+import redis
+from dotenv import load_dotenv
+from redis_utils import scan_keys, chunked
+from connection_manager import get_redis_client
+from nlq_logging import get_logger
+
+load_dotenv()
+logger = get_logger(__name__)
+
+REDIS_USE_INDEXES = os.getenv("REDIS_USE_INDEXES", "1") == "1"
+INDEX_PREFIX = "idx"
+INDEX_META_KEY = "idx:meta"
+
+# Sorted sets (idx:<entity>:<field>, member = id) for range conditions; dates are scored as YYYYMMDD
+NUMERIC_INDEXES = {
+    'order': ['order_date', 'total_price'],
+    'product': ['price', 'discount', 'stock_quantity', 'release_date'],
+    'customer': ['credit_limit'],
+}
+# Sets (idx:<entity>:<field>:<value>, member = id) for equality conditions
+CATEGORICAL_INDEXES = {
+    'order': ['status'],
+    'product': ['category', 'manufacturer'],
+    'customer': ['city'],
+}
+# Sets (idx:order:<field>:<id>, member = order id) to go from matching customers/products to their orders
+FOREIGN_KEY_INDEXES = {
+    'order': ['customer_id', 'product_id'],
+}
+
+DATE_PATTERN = re.compile(r'^(\d{4})-(\d{2})-(\d{2})')
+
+# Entity -> (built_at, indexed count, DBSIZE) last confirmed against a live count of its hashes
+_verified = {}
+
+def _score(value):
+    # Dates sort as YYYYMMDD integers; anything else must be numeric to be indexed
+    match = DATE_PATTERN.match(str(value))
+    if match:
+        return int("".join(match.groups()))
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return None
+
+def _index_entries(entity, entity_id, fields):
+    """Yield (kind, index key, member, score) for every index entry a hash contributes."""
+    for field in NUMERIC_INDEXES.get(entity, []):
+        if field in fields:
+            score = _score(fields[field])
+            if score is not None:
+                yield 'zset', f"{INDEX_PREFIX}:{entity}:{field}", entity_id, score
+    for field in CATEGORICAL_INDEXES.get(entity, []) + FOREIGN_KEY_INDEXES.get(entity, []):
+        if fields.get(field) not in (None, ''):
+            yield 'set', f"{INDEX_PREFIX}:{entity}:{field}:{fields[field]}", entity_id, None
+
+def _add_entries(pipe, entries):
+    for kind, index_key, member, score in entries:
+        if kind == 'zset':
+            pipe.zadd(index_key, {member: score})
+        else:
+            pipe.sadd(index_key, member)
+
+def _remove_entries(pipe, entries):
+    for kind, index_key, member, _ in entries:
+        if kind == 'zset':
+            pipe.zrem(index_key, member)
+        else:
+            pipe.srem(index_key, member)
+
+def drop_indexes(r):
+    """Delete every index key."""
+    for keys in chunked(scan_keys(r, f"{INDEX_PREFIX}:*"), 1000):
+        r.unlink(*keys)
+
+def build_indexes(r=None, chunk_size=1000):
+    """
+    Rebuild all secondary indexes from the customer, product and order hashes.
+    Each chunk of hashes is read with one pipeline and indexed with another.
+    Args:
+        r (redis.Redis): The Redis client; defaults to the shared pool.
+        chunk_size (int): Hashes read and indexed per round trip.
+    Returns:
+        dict: Entity -> number of hashes indexed.
+    """
+    r = r or get_redis_client()
+    drop_indexes(r)
+    counts = {}
+    for entity in NUMERIC_INDEXES:
+        counts[entity] = 0
+        for keys in chunked(scan_keys(r, f"{entity}:*", key_type='hash'), chunk_size):
+            pipe = r.pipeline(transaction=False)
+            for key in keys:
+                pipe.hgetall(key)
+            hashes = pipe.execute()
+            pipe = r.pipeline(transaction=False)
+            for key, fields in zip(keys, hashes):
+                _add_entries(pipe, _index_entries(entity, key.split(':', 1)[1], fields))
+            pipe.execute()
+            counts[entity] += len(keys)
+    r.hset(INDEX_META_KEY, mapping={"built_at": time.time(), **{f"{entity}_count": count for entity, count in counts.items()}})
+    return counts
+
+def indexes_available(r):
+    return REDIS_USE_INDEXES and bool(r.exists(INDEX_META_KEY))
+
+def indexes_current(r, entities):
+    """
+    Check that the indexes of `entities` still cover every hash. build_indexes, write_hashes and
+    delete_hash keep a per-entity hash count in idx:meta; a hash added or deleted any other way
+    (e.g., a plain HSET) makes it disagree with the live count, and the indexes must not be trusted.
+    The live count walks the keyspace, so it is skipped while DBSIZE hasn't changed since it last
+    matched. Fields edited in place without update_hash are not detected.
+    Args:
+        r (redis.Redis): The Redis client.
+        entities (iterable): Entities whose indexes a query would use (e.g., {'order', 'customer'}).
+    Returns:
+        bool: True if the indexes are enabled, built and current for every entity.
+    """
+    if not REDIS_USE_INDEXES:
+        return False
+    pipe = r.pipeline(transaction=False)
+    pipe.hgetall(INDEX_META_KEY)
+    pipe.dbsize()
+    meta, dbsize = pipe.execute()
+    if not meta:
+        return False
+    for entity in entities:
+        indexed = meta.get(f"{entity}_count")
+        if indexed is None:
+            return False
+        token = (meta.get("built_at"), indexed, dbsize)
+        if _verified.get(entity) == token:
+            continue
+        live = sum(1 for _ in scan_keys(r, f"{entity}:*", key_type='hash'))
+        if live != int(indexed):
+            logger.warning("Redis indexes for %s are stale (%s indexed, %d hashes); scanning instead. "
+                           "Rebuild them with: python redis_indexes.py build", entity, indexed, live)
+            return False
+        _verified[entity] = token
+    return True
+
+def _write_chunk(r, updates):
+    # Write {key: mapping} in one MULTI/EXEC, with the index entries and counts if indexes are built
+    with r.pipeline() as pipe:
+        while True:
+            try:
+                pipe.watch(INDEX_META_KEY, *updates)
+                if not pipe.exists(INDEX_META_KEY):
+                    pipe.multi()
+                    for key, mapping in updates.items():
+                        pipe.hset(key, mapping=mapping)
+                    pipe.execute()
+                    return
+                # Read the current hashes in one round trip; the WATCH still covers them
+                reads = r.pipeline(transaction=False)
+                for key in updates:
+                    reads.hgetall(key)
+                old_hashes = reads.execute()
+                pipe.multi()
+                for (key, mapping), old_fields in zip(updates.items(), old_hashes):
+                    entity, entity_id = key.split(':', 1)
+                    _remove_entries(pipe, _index_entries(entity, entity_id, old_fields))
+                    pipe.hset(key, mapping=mapping)
+                    _add_entries(pipe, _index_entries(entity, entity_id, {**old_fields, **mapping}))
+                    if not old_fields and entity in NUMERIC_INDEXES:
+                        pipe.hincrby(INDEX_META_KEY, f"{entity}_count", 1)
+                pipe.execute()
+                return
+            except redis.WatchError:
+                # A hash or the indexes changed between the reads and EXEC; retry with the new contents
+                continue
+
+def write_hashes(r, items, chunk_size=1000):
+    """
+    Write fields to many hashes, keeping their index entries and idx:meta counts in sync.
+    Every writer of customer:/product:/order: hashes should go through this (or update_hash);
+    anything else leaves the indexes stale until they are rebuilt.
+    Args:
+        r (redis.Redis): The Redis client.
+        items (iterable): (key, mapping) pairs, e.g., ('order:17', {'status': 'Shipped'}).
+        chunk_size (int): Hashes written per MULTI/EXEC.
+    """
+    for chunk in chunked(items, chunk_size):
+        updates = {}
+        for key, mapping in chunk:
+            updates.setdefault(key, {}).update(mapping)
+        _write_chunk(r, updates)
+
+def update_hash(r, key, mapping):
+    """
+    Write fields to a hash and keep its index entries in sync, atomically.
+    Args:
+        r (redis.Redis): The Redis client.
+        key (str): The hash key (e.g., 'order:17').
+        mapping (dict): Fields to set.
+    """
+    _write_chunk(r, {key: mapping})
+
+def delete_hash(r, key):
+    """Delete a hash and its index entries, atomically."""
+    entity, entity_id = key.split(':', 1)
+    with r.pipeline() as pipe:
+        while True:
+            try:
+                pipe.watch(INDEX_META_KEY, key)
+                indexed = pipe.exists(INDEX_META_KEY)
+                old_fields = pipe.hgetall(key)
+                pipe.multi()
+                if indexed and old_fields:
+                    _remove_entries(pipe, _index_entries(entity, entity_id, old_fields))
+                    if entity in NUMERIC_INDEXES:
+                        pipe.hincrby(INDEX_META_KEY, f"{entity}_count", -1)
+                pipe.delete(key)
+                pipe.execute()
+                return
+            except redis.WatchError:
+                continue
+
+def _queue_lookup(pipe, entity, field, op, value):
+    # Queue the index read for one predicate; returns False if no index covers it
+    if field in NUMERIC_INDEXES.get(entity, []):
+        if op == 'startswith' and re.fullmatch(r'\d{4}', value):
+            pipe.zrangebyscore(f"{INDEX_PREFIX}:{entity}:{field}", int(value + "0101"), int(value + "1231"))
+            return True
+        score = _score(value)
+        if score is None:
+            return False
+        if op == 'gt':
+            pipe.zrangebyscore(f"{INDEX_PREFIX}:{entity}:{field}", f"({score}", "+inf")
+        elif op == 'lt':
+            pipe.zrangebyscore(f"{INDEX_PREFIX}:{entity}:{field}", "-inf", f"({score}")
+        elif op == 'eq':
+            pipe.zrangebyscore(f"{INDEX_PREFIX}:{entity}:{field}", score, score)
+        else:
+            return False
+        return True
+    if field in CATEGORICAL_INDEXES.get(entity, []) and op == 'eq':
+        pipe.smembers(f"{INDEX_PREFIX}:{entity}:{field}:{value}")
+        return True
+    return False
+
+def _resolve_entity_ids(r, entity, conditions):
+    # Intersect the index results for (field, op, value) conditions on one entity; None if none are indexed
+    pipe = r.pipeline(transaction=False)
+    queued = sum(_queue_lookup(pipe, entity, *condition) for condition in conditions)
+    if not queued:
+        return None
+    ids = None
+    for members in pipe.execute():
+        ids = set(members) if ids is None else ids & set(members)
+    return ids
+
+def resolve_candidate_keys(r, key_pattern, predicates):
+    """
+    Use the secondary indexes to narrow a pattern query to the keys that can match.
+    Callers must still check the predicates on the fetched hashes, since indexes only narrow.
+    Args:
+        r (redis.Redis): The Redis client.
+        key_pattern (str): The query's key pattern; only '<entity>:*' patterns are resolved.
+        predicates (list): Predicates from db_connectors.plan_redis_filters.
+    Returns:
+        list: Candidate keys sorted by id, or None if the indexes can't help (scan instead).
+    """
+    match = re.fullmatch(r'(\w+):\*', key_pattern)
+    if not predicates or not match or match.group(1) not in NUMERIC_INDEXES:
+        return None
+    entity = match.group(1)
+
+    # Group conditions by the entity whose index answers them
+    conditions = {}
+    for predicate_entity, column, op, value in predicates:
+        target = entity if predicate_entity == 'base' else predicate_entity
+        field = column if predicate_entity == 'base' else column[len(predicate_entity) + 1:]
+        conditions.setdefault(target, []).append((field, op, value))
+    if not indexes_current(r, {entity, *conditions} & set(NUMERIC_INDEXES)):
+        return None
+
+    candidate_ids = None
+    for target, target_conditions in conditions.items():
+        ids = _resolve_entity_ids(r, target, target_conditions)
+        if ids is None:
+            continue
+        if target != entity:
+            if f"{target}_id" not in FOREIGN_KEY_INDEXES.get(entity, []):
+                continue
+            # Map matching customers/products to the orders that reference them
+            pipe = r.pipeline(transaction=False)
+            for target_id in ids:
+                pipe.smembers(f"{INDEX_PREFIX}:{entity}:{target}_id:{target_id}")
+            ids = set().union(*pipe.execute()) if ids else set()
+        candidate_ids = ids if candidate_ids is None else candidate_ids & ids
+        if not candidate_ids:
+            break
+
+    if candidate_ids is None:
+        return None
+    return [f"{entity}:{entity_id}" for entity_id in
+            sorted(candidate_ids, key=lambda value: (not value.isdigit(), int(value) if value.isdigit() else 0, value))]
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain secondary indexes for the Redis dataset.")
+    parser.add_argument("command", choices=["build", "drop", "status"])
+    args = parser.parse_args()
+    r = get_redis_client()
+    if args.command == "build":
+        start = time.perf_counter()
+        counts = build_indexes(r)
+        print(f"Indexed {counts} in {time.perf_counter() - start:.1f}s")
+    elif args.command == "drop":
+        drop_indexes(r)
+        print("Dropped all indexes")
+    else:
+        print(r.hgetall(INDEX_META_KEY) or "No indexes built")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import os
+import pandas as pd
+from dotenv import load_dotenv
+from nlq_logging import get_logger
+
+load_dotenv()
+logger = get_logger(__name__)
+
+# COUNT hint passed to SCAN; bounds the work Redis does per call
+REDIS_SCAN_COUNT = int(os.getenv("REDIS_SCAN_COUNT", 1000))
+
+GLOB_CHARS = set('*?[\\')
+
+# Types of the numeric hash fields, shared by the query connector, schema detection and the app.
+# Every other field, including dates (compared as ISO strings), stays a string.
+FIELD_TYPES = {
+    'price': 'float',
+    'total_price': 'float',
+    'discount': 'float',
+    'stock_quantity': 'float',
+    'credit_limit': 'float',
+    'order_id': 'int',
+    'customer_id': 'int',
+    'product_id': 'int',
+    'quantity': 'int',
+}
+
+def scan_keys(r, pattern, count=None, key_type=None):
+    """
+    Stream the keys matching a pattern with incremental SCAN calls instead of KEYS.
+    Args:
+        r (redis.Redis): The Redis client.
+        pattern (str): The key pattern (e.g., 'order:*') or an exact key name.
+        count (int): COUNT hint per SCAN call; defaults to REDIS_SCAN_COUNT.
+        key_type (str): Only yield keys of this Redis type (e.g., 'hash'), filtered server-side.
+    Yields:
+        str: Matching key names. SCAN may yield a key more than once if the
+        keyspace is rehashed mid-iteration, so callers that aggregate should dedupe.
+    """
+    if not GLOB_CHARS.intersection(pattern):
+        # Exact key: no need to walk the keyspace
+        yield pattern
+        return
+    yield from r.scan_iter(match=pattern, count=count or REDIS_SCAN_COUNT, _type=key_type)
+
+def chunked(iterable, size):
+    """
+    Group an iterable into lists of at most `size` items without materializing it.
+    Args:
+        iterable: Any iterable, typically a key generator from scan_keys.
+        size (int): Maximum chunk length.
+    Yields:
+        list: Consecutive chunks.
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def decode_column(values, field_type):
+    """
+    Convert a column of raw hash strings to a FIELD_TYPES type in one vectorized pass.
+    Args:
+        values (list or pd.Series): Raw values; None marks a missing field.
+        field_type (str): 'int' or 'float'.
+    Returns:
+        pd.Series: The converted column; int columns with missing values become float.
+    Raises:
+        ValueError: If any present value doesn't convert.
+    """
+    numbers = pd.to_numeric(pd.Series(values), errors='raise')
+    if field_type == 'float':
+        return numbers.astype(float)
+    if (numbers.dropna() % 1 != 0).any():
+        raise ValueError("non-integer value in integer field")
+    return numbers if numbers.isna().any() else numbers.astype('int64')
+
+def decode_frame(df, prefixes=('',)):
+    """
+    Convert the typed columns of a DataFrame built from raw hashes, one column at a time.
+    A column that doesn't fully convert is left as strings.
+    Args:
+        df (pd.DataFrame): Columns of raw hash strings.
+        prefixes (tuple): Column prefixes to strip before looking up FIELD_TYPES
+            (e.g., 'customer_' for joined customer fields).
+    Returns:
+        pd.DataFrame: df, converted in place.
+    """
+    for column in df.columns:
+        field = next((column[len(prefix):] for prefix in prefixes
+                      if column.startswith(prefix) and column[len(prefix):] in FIELD_TYPES), None)
+        if field is None:
+            continue
+        try:
+            df[column] = decode_column(df[column], FIELD_TYPES[field])
+        except (ValueError, TypeError) as e:
+            logger.warning("Error converting column %s: %s", column, e)
+    return df
@@ -0,0 +1,262 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import psycopg2
+import pyarrow as pa
+import redis
+from pymongo.errors import PyMongoError
+from dotenv import load_dotenv
+from connection_manager import postgres_connection, get_mongo_client, get_redis_client
+from nlq_logging import get_logger
+from metrics import record_cache
+
+load_dotenv()
+logger = get_logger(__name__)
+
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "1") == "1"
+# Total size of the cached Arrow blobs kept in memory
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", 128 * 1024 * 1024))
+# Upper bound on staleness for changes the data-version probes can't see (e.g., same-size Mongo updates)
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", 300))
+
+# String literals are kept verbatim; whitespace elsewhere collapses to one space
+SQL_TOKEN_PATTERN = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|\s+")
+
+_probe_lock = threading.Lock()
+_sqlite_probes = {}  # db_path -> dedicated connection whose data_version tracks other connections' commits
+
+def normalize_executed_query(query):
+    """
+    Normalize an executed query for cache keys.
+    Args:
+        query (str or list or dict): SQL text, or a parsed MongoDB/Redis query.
+    Returns:
+        str: SQL with insignificant whitespace and trailing semicolons removed, or canonical JSON.
+    """
+    if not isinstance(query, str):
+        return json.dumps(query, sort_keys=True, default=str)
+    sql = SQL_TOKEN_PATTERN.sub(lambda match: match.group(0) if match.group(0)[0] in "'\"" else " ", query)
+    return sql.strip().rstrip(';').strip()
+
+def target_name(db_type, db_config):
+    """Name the physical database a config points at, without credentials (e.g., 'localhost:5432/sample')."""
+    if db_type == 'sqlite':
+        return os.path.abspath(db_config["db_path"])
+    elif db_type == 'postgresql':
+        dbname = db_config.get("dbname", os.getenv("POSTGRES_DBNAME"))
+        return f"{os.getenv('POSTGRES_HOST', 'localhost')}:{os.getenv('POSTGRES_PORT', '5432')}/{dbname}"
+    elif db_type == 'mongodb':
+        return f"{os.getenv('MONGODB_URI', 'mongodb://localhost:27017/')}{db_config['db_name']}"
+    elif db_type == 'redis':
+        return f"{os.getenv('REDIS_HOST', 'localhost')}:{os.getenv('REDIS_PORT', 6379)}/{os.getenv('REDIS_DB', 0)}"
+    raise ValueError(f"Unsupported database type: {db_type}")
+
+def _sqlite_version(db_path):
+    # data_version changes whenever another connection commits; mtime/size catch other processes' writers
+    stats = [(os.stat(path).st_mtime_ns, os.stat(path).st_size) if os.path.exists(path) else None
+             for path in (db_path, db_path + "-wal")]
+    with _probe_lock:
+        if db_path not in _sqlite_probes:
+            _sqlite_probes[db_path] = sqlite3.connect(db_path, check_same_thread=False)
+        data_version = _sqlite_probes[db_path].execute("PRAGMA data_version").fetchone()[0]
+    return [data_version, stats]
+
+def _postgres_version(db_config):
+    # Cumulative write counters; the statistics system can lag a commit by about a second
+    with postgres_connection(db_config) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT count(*), sum(n_tup_ins), sum(n_tup_upd), sum(n_tup_del), max(last_autoanalyze)
+                FROM pg_stat_user_tables;
+            """)
+            return list(cursor.fetchone())
+
+def _mongodb_version(db_config):
+    stats = get_mongo_client()[db_config["db_name"]].command("dbStats")
+    return [stats.get(field) for field in ("collections", "objects", "dataSize", "indexes")]
+
+def _redis_version():
+    r = get_redis_client()
+    try:
+        # Only keys/expires per db: avg_ttl drifts on its own whenever any key has an expiry
+        keyspace = {db: [stats.get("keys"), stats.get("expires")] for db, stats in r.info("keyspace").items()}
+        persistence = r.info("persistence")
+        return [keyspace, persistence.get("rdb_changes_since_last_save"), persistence.get("rdb_last_save_time")]
+    finally:
+        r.close()
+
+def data_version(db_type, db_config):
+    """
+    Probe a cheap token that changes when the target's data changes.
+    Args:
+        db_type (str): One of 'sqlite', 'postgresql', 'mongodb' or 'redis'.
+        db_config (dict): The backend configuration, as for db_connectors.execute_query.
+    Returns:
+        str: A short hex digest, or None if the probe failed (the result is then not cached).
+    """
+    try:
+        if db_type == 'sqlite':
+            version = _sqlite_version(db_config["db_path"])
+        elif db_type == 'postgresql':
+            version = _postgres_version(db_config)
+        elif db_type == 'mongodb':
+            version = _mongodb_version(db_config)
+        elif db_type == 'redis':
+            version = _redis_version()
+        else:
+            raise ValueError(f"Unsupported database type: {db_type}")
+    except (sqlite3.Error, OSError, psycopg2.Error, PyMongoError, redis.RedisError, TimeoutError) as e:
+        logger.warning("Data version probe failed for %s: %s", db_type, e)
+        return None
+    return hashlib.sha256(json.dumps(version, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+class ResultCache:
+    """
+    In-memory cache of query results keyed on (backend, target, normalized query, options, kind),
+    where kind is 'table' for pa.Table results and 'frame' for DataFrames, so each caller gets
+    back the type it stored.
+    Results are stored as Arrow IPC blobs tagged with the data version they were read at; an
+    entry is served only while the version is unchanged and it is younger than ttl. The least
+    recently used entries are evicted once the blobs exceed max_bytes.
+    """
+
+    def __init__(self, max_bytes=None, ttl=None):
+        self.max_bytes = max_bytes or RESULT_CACHE_MAX_BYTES
+        self.ttl = ttl or RESULT_CACHE_TTL
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self._entries = OrderedDict()  # key -> (version, created_at, blob, DataFrame attrs or None for tables)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(db_type, db_config, query, options, kind):
+        text = f"{db_type}\x00{target_name(db_type, db_config)}\x00{normalize_executed_query(query)}\x00{json.dumps(options, sort_keys=True)}\x00{kind}"
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def get(self, db_type, db_config, query, options=None, kind='frame'):
+        """
+        Look up a result and probe the target's current data version.
+        Args:
+            db_type (str): The backend.
+            db_config (dict): The backend configuration.
+            query (str or list or dict): The query as executed.
+            options (dict): Execution options that change the result (e.g., {"enriched": True}).
+            kind (str): 'table' to look up a stored pa.Table, 'frame' for a DataFrame.
+        Returns:
+            tuple: (cached result of that kind or None, current data version to pass to put).
+        """
+        key = self._key(db_type, db_config, query, options, kind)
+        version = data_version(db_type, db_config)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or version is None or entry[0] != version or time.time() - entry[1] > self.ttl:
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None, version
+            self._entries.move_to_end(key)
+            self.hits += 1
+        table = pa.ipc.open_stream(entry[2]).read_all()
+        if entry[3] is None:
+            return table, version
+        df = table.to_pandas()
+        df.attrs.update(entry[3])
+        return df, version
+
+    def put(self, db_type, db_config, query, result, version, options=None):
+        """
+        Store a DataFrame or pa.Table read at `version`, evicting least recently used entries beyond max_bytes.
+        Tables are stored as they are; DataFrames are converted and their attrs kept alongside.
+        """
+        if version is None or len(result.columns) == 0:
+            # Connectors return a column-less frame on errors; don't pin those
+            return
+        if isinstance(result, pa.Table):
+            table, attrs = result, None
+        else:
+            try:
+                table, attrs = pa.Table.from_pandas(result, preserve_index=False), dict(result.attrs)
+            except (pa.ArrowException, ValueError, TypeError) as e:
+                # Mixed-type or non-Arrow columns (e.g., nested documents) are simply not cached
+                logger.info("Result not cached: %s", e)
+                return
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        blob = sink.getvalue()
+        if blob.size > self.max_bytes:
+            return
+        key = self._key(db_type, db_config, query, options, 'table' if attrs is None else 'frame')
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (version, time.time(), blob, attrs)
+            self.size += blob.size
+            while self.size > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2].size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """
+        Returns:
+            dict: hits, misses, hit_rate, current entries and bytes.
+        """
+        with self._lock:
+            entries = len(self._entries)
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": self.size,
+        }
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_result_cache():
+    """Return the process-wide ResultCache."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ResultCache()
+        return _default_cache
+
+def cached_result(db_type, db_config, query, run, options=None, kind='frame'):
+    """
+    Serve a result from the cache, or run the query and cache what it returns.
+    Args:
+        db_type (str): The backend.
+        db_config (dict): The backend configuration.
+        query (str or list or dict): The query as executed.
+        run (callable): Executes the query and returns a DataFrame, or a pa.Table for kind='table'.
+        options (dict): Execution options that change the result.
+        kind (str): 'table' if run returns a pa.Table, 'frame' if it returns a DataFrame.
+    Returns:
+        pd.DataFrame or pa.Table: The (possibly cached) result, of the type run returns.
+    """
+    if not RESULT_CACHE_ENABLED:
+        return run()
+    cache = get_result_cache()
+    result, version = cache.get(db_type, db_config, query, options, kind)
+    record_cache('result', result is not None)
+    if result is not None:
+        return result
+    result = run()
+    cache.put(db_type, db_config, query, result, version, options)
+    return result
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import threading
+from dotenv import load_dotenv
+from connection_manager import sqlite_connection, postgres_connection, get_mongo_client, get_redis_client
+from redis_utils import scan_keys
+from redis_indexes import INDEX_PREFIX
+from schema_detector import get_schema, generate_schema_description
+from query_cache import schema_fingerprint
+from metrics import record_cache
+
+load_dotenv()
+
+# Keys examined when fingerprinting the Redis keyspace by prefix
+REDIS_FINGERPRINT_SCAN_LIMIT = int(os.getenv("REDIS_FINGERPRINT_SCAN_LIMIT", 1000))
+
+_lock = threading.Lock()
+_schemas = {}       # target -> (fingerprint, schema)
+_descriptions = {}  # schema fingerprint -> LLM description
+
+def _digest(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+def _redis_fingerprint():
+    # Prefixes seen in a bounded hash sample, plus the field names of one hash per prefix
+    r = get_redis_client()
+    try:
+        prefix_keys = {}
+        for scanned, key in enumerate(scan_keys(r, '*:*', key_type='hash'), start=1):
+            # Skip idx:meta, which changes on every index rebuild
+            if key.split(':')[0] != INDEX_PREFIX:
+                prefix_keys.setdefault(key.split(':')[0], key)
+            if scanned >= REDIS_FINGERPRINT_SCAN_LIMIT:
+                break
+        prefixes = sorted(prefix_keys)
+        pipe = r.pipeline(transaction=False)
+        for prefix in prefixes:
+            pipe.hkeys(prefix_keys[prefix])
+        return [(prefix, sorted(fields)) for prefix, fields in zip(prefixes, pipe.execute())]
+    finally:
+        r.close()
+
+def get_schema_fingerprint(db_type, db_config):
+    """
+    Compute a cheap fingerprint that changes when the schema does, without a full schema walk.
+    Args:
+        db_type (str): One of 'sqlite', 'postgresql', 'mongodb' or 'redis'.
+        db_config (dict): The same configuration passed to schema_detector.get_schema.
+    Returns:
+        str: A short hex digest.
+    """
+    if db_type == 'sqlite':
+        with sqlite_connection(db_config["db_path"]) as conn:
+            rows = conn.execute("SELECT type, name, sql FROM sqlite_master ORDER BY type, name").fetchall()
+        return _digest(rows)
+    elif db_type == 'postgresql':
+        with postgres_connection(db_config) as conn:
+            with conn.cursor() as cursor:
+                # Hash the table/column list server-side so only one row comes back
+                cursor.execute("""
+                    SELECT md5(string_agg(table_name || '.' || column_name || ':' || data_type, ','
+                                          ORDER BY table_name, ordinal_position))
+                    FROM information_schema.columns
+                    WHERE table_schema = 'public';
+                """)
+                return cursor.fetchone()[0] or _digest([])
+    elif db_type == 'mongodb':
+        return _digest(sorted(get_mongo_client()[db_config["db_name"]].list_collection_names()))
+    elif db_type == 'redis':
+        return _digest(_redis_fingerprint())
+    raise ValueError(f"Unsupported database type: {db_type}")
+
+def get_cached_schema(db_type, db_config):
+    """
+    Return the schema for a target, re-running detection only when its fingerprint changes.
+    Args:
+        db_type (str): One of 'sqlite', 'postgresql', 'mongodb' or 'redis'.
+        db_config (dict): The same configuration passed to schema_detector.get_schema.
+    Returns:
+        tuple: (schema dict, fingerprint string).
+    """
+    target = (db_type, _digest(db_config))
+    fingerprint = get_schema_fingerprint(db_type, db_config)
+    with _lock:
+        cached = _schemas.get(target)
+    record_cache('schema', cached is not None and cached[0] == fingerprint)
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1], fingerprint
+    schema = get_schema(db_type, db_config)
+    with _lock:
+        _schemas[target] = (fingerprint, schema)
+    return schema, fingerprint
+
+def get_cached_schema_description(schema):
+    """
+    Return the LLM description of a schema, calling the LLM once per distinct schema.
+    Args:
+        schema (dict): The schema to describe.
+    Returns:
+        str: The natural language description.
+    """
+    fingerprint = schema_fingerprint(schema)
+    with _lock:
+        description = _descriptions.get(fingerprint)
+    record_cache('description', description is not None)
+    if description is not None:
+        return description
+    description = generate_schema_description(schema)
+    with _lock:
+        _descriptions[fingerprint] = description
+    return description
+
+def invalidate(db_type=None):
+    """Forget cached schemas (for one db_type, or all) and all cached descriptions."""
+    with _lock:
+        for target in [target for target in _schemas if db_type is None or target[0] == db_type]:
+            del _schemas[target]
+        _descriptions.clear()
@@ -1,135 +1,152 @@
-import sqlite3
-import psycopg2
-from pymongo import MongoClient
 import redis
+from redis_utils import scan_keys, FIELD_TYPES, decode_column
+from redis_indexes import INDEX_PREFIX
+from connection_manager import sqlite_connection, postgres_connection, get_mongo_client, get_redis_client
 import json
-from langchain_google_genai import ChatGoogleGenerativeAI
+from llm_client import get_llm
 from dotenv import load_dotenv
 import os
+from nlq_logging import get_logger
+from metrics import record_llm_usage
 
 load_dotenv()
+logger = get_logger(__name__)
+
+# Hashes sampled per key prefix when inferring the Redis schema
+REDIS_SCHEMA_SAMPLE_SIZE = int(os.getenv("REDIS_SCHEMA_SAMPLE_SIZE", 20))
+# Upper bound on keys examined while sampling, so detection time does not grow with the dataset
+REDIS_SCHEMA_SCAN_LIMIT = int(os.getenv("REDIS_SCHEMA_SCAN_LIMIT", 10000))
 
 def get_sqlite_schema(db_path):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-    tables = cursor.fetchall()
-    schema = {}
-    for table in tables:
-        table_name = table[0]
-        cursor.execute(f"PRAGMA table_info({table_name});")
-        columns = cursor.fetchall()
-        schema[table_name] = [(col[1], col[2]) for col in columns]
-    conn.close()
+    with sqlite_connection(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
+        tables = cursor.fetchall()
+        schema = {}
+        for table in tables:
+            table_name = table[0]
+            cursor.execute(f"PRAGMA table_info({table_name});")
+            columns = cursor.fetchall()
+            schema[table_name] = [(col[1], col[2]) for col in columns]
     return schema
 
 def get_postgres_schema(db_params):
-    # Update connection parameters for PostgreSQL
-    conn = psycopg2.connect(
-        dbname=db_params.get("dbname", os.getenv("POSTGRES_DBNAME")),
-        user=db_params.get("user", os.getenv("POSTGRES_USER")),
-        password=db_params.get("password", os.getenv("POSTGRES_PASSWORD")),
-        host=os.getenv("POSTGRES_HOST", "localhost"),
-        port=os.getenv("POSTGRES_PORT", "5432")
-    )
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT table_name, column_name, data_type
-        FROM information_schema.columns
-        WHERE table_schema = 'public';
-    """)
-    rows = cursor.fetchall()
+    with postgres_connection(db_params) as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT table_name, column_name, data_type
+            FROM information_schema.columns
+            WHERE table_schema = 'public';
+        """)
+        rows = cursor.fetchall()
     schema = {}
     for table_name, column_name, data_type in rows:
         if table_name not in schema:
             schema[table_name] = []
         schema[table_name].append((column_name, data_type))
-    conn.close()
     return schema
 
 def get_mongodb_schema(db_name):
-    # Update MongoDB connection
-    mongodb_uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017/")
-    client = MongoClient(mongodb_uri)
-    db = client[db_name]
+    db = get_mongo_client()[db_name]
     schema = {}
     for collection_name in db.list_collection_names():
         collection = db[collection_name]
         sample_doc = collection.find_one()
         if sample_doc:
             schema[collection_name] = [(k, type(v).__name__) for k, v in sample_doc.items() if k != '_id']
-    client.close()
     return schema
 
-def get_redis_schema():
-    # Update Redis connection
-    r = redis.Redis(
-        host=os.getenv("REDIS_HOST", "localhost"),
-        port=int(os.getenv("REDIS_PORT", 6379)),
-        password=os.getenv("REDIS_PASSWORD", None),
-        decode_responses=True
-    )
+def _infer_redis_field_type(field, values):
+    # A field keeps its FIELD_TYPES type only if every sampled value converts
+    field_type = FIELD_TYPES.get(field)
+    if field_type is None:
+        return 'str'
     try:
-        schema = {}
-        keys = r.keys('*:*')
-        for key in keys:
-            try:
+        decode_column(values, field_type)
+    except (ValueError, TypeError):
+        return 'str'
+    return field_type
+
+def get_redis_schema(sample_size=None, scan_limit=None):
+    """
+    Infer the Redis schema from a bounded sample of hashes per key prefix.
+    Args:
+        sample_size (int): Hashes sampled per prefix; defaults to REDIS_SCHEMA_SAMPLE_SIZE.
+        scan_limit (int): Maximum keys examined while sampling; defaults to REDIS_SCHEMA_SCAN_LIMIT.
+    Returns:
+        dict: Pluralized prefix (e.g., "customers") -> list of (field, type name) pairs,
+        merged across the sample, or {"error": ...} if no hashes were found.
+    """
+    sample_size = sample_size or REDIS_SCHEMA_SAMPLE_SIZE
+    scan_limit = scan_limit or REDIS_SCHEMA_SCAN_LIMIT
+    r = get_redis_client()
+    try:
+        # Collect up to sample_size hash keys per prefix, examining at most scan_limit keys
+        samples = {}
+        for scanned, key in enumerate(scan_keys(r, '*:*', key_type='hash'), start=1):
+            parts = key.split(':')
+            # idx:meta is the secondary index bookkeeping hash, not data
+            if len(parts) == 2 and parts[0] != INDEX_PREFIX:
                 # Split the key into type and ID (e.g., "customer:1" -> "customer", "1")
-                key_type, key_id = key.split(':')
-                if key_type not in schema:
-                    schema[key_type + "s"] = []  # Pluralize to match other DBs (e.g., "customers")
-                
-                # Check the type of the key
-                redis_type = r.type(key)
-                print(f"Type of {key}: {redis_type}")  # Debug log
-                if redis_type != "hash":
-                    print(f"Skipping {key} because type is {redis_type}, expected hash")
-                    continue
-                
-                # Retrieve the value using HGETALL for hash keys
-                hash_data = r.hgetall(key)
-                if not hash_data:
-                    print(f"No data found for {key}")
-                    continue
-                
-                # Convert hash data to a dictionary with proper type inference
-                fields = {}
-                for field, value in hash_data.items():
-                    try:
-                        if field in ['price', 'total_price', 'credit_limit', 'discount', 'stock_quantity', 'quantity']:
-                            fields[field] = float(value)
-                        elif field in ['customer_id', 'product_id', 'order_id']:
-                            fields[field] = int(value)
-                        else:
-                            fields[field] = value
-                    except (ValueError, TypeError):
-                        fields[field] = value  # Fallback to string if conversion fails
-                
-                # Add the fields and their types to the schema
-                schema[key_type + "s"].append([(k, type(v).__name__) for k, v in fields.items()])
-            except (ValueError, redis.RedisError) as e:
-                print(f"Error processing key {key}: {str(e)}")  # Debug log
-                continue
-        
-        # Flatten the schema to match the format expected by other functions
-        for key_type in schema:
-            if schema[key_type]:
-                # Take the first sample's fields as the schema (assuming consistency)
-                schema[key_type] = schema[key_type][0]
-            else:
-                del schema[key_type]  # Remove empty schemas
-        
+                keys = samples.setdefault(parts[0], [])
+                if len(keys) < sample_size:
+                    keys.append(key)
+            if scanned >= scan_limit:
+                break
+
+        # Fetch every sampled hash in a single pipeline
+        sampled_keys = [key for keys in samples.values() for key in keys]
+        pipe = r.pipeline(transaction=False)
+        for key in sampled_keys:
+            pipe.hgetall(key)
+        hashes = dict(zip(sampled_keys, pipe.execute()))
+
+        schema = {}
+        for key_type, keys in samples.items():
+            # Merge field sets across the sample, keeping first-seen field order
+            field_values = {}
+            for key in keys:
+                for field, value in hashes[key].items():
+                    field_values.setdefault(field, []).append(value)
+            if field_values:
+                # Pluralize to match other DBs (e.g., "customers")
+                schema[key_type + "s"] = [(field, _infer_redis_field_type(field, values))
+                                          for field, values in field_values.items()]
+
         if not schema:
-            print("No valid hash keys found to determine schema")
+            logger.warning("No valid hash keys found to determine schema")
             return {"error": "No valid hash keys found to determine schema"}
-        
+
         return schema
+    except redis.RedisError as e:
+        logger.error("Error sampling Redis schema: %s", e)
+        return {"error": f"Error sampling Redis schema: {str(e)}"}
     finally:
         r.close()
 
+def get_schema(db_type, db_config):
+    """
+    Detect the schema for any supported backend.
+    Args:
+        db_type (str): One of 'sqlite', 'postgresql', 'mongodb' or 'redis'.
+        db_config (dict): {"db_path"} for SQLite, connection parameters for PostgreSQL,
+            {"db_name"} for MongoDB and {} for Redis.
+    Returns:
+        dict: Table/collection name -> list of (column, type) pairs.
+    """
+    if db_type == 'sqlite':
+        return get_sqlite_schema(db_config["db_path"])
+    elif db_type == 'postgresql':
+        return get_postgres_schema(db_config)
+    elif db_type == 'mongodb':
+        return get_mongodb_schema(db_config["db_name"])
+    elif db_type == 'redis':
+        return get_redis_schema()
+    raise ValueError(f"Unsupported database type: {db_type}")
+
 def generate_schema_description(schema):
-    llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", api_key=os.getenv("GEMINI_API_KEY"))
     schema_str = "\n".join([f"Table/Collection: {table}\nColumns/Fields: {cols}" for table, cols in schema.items()])
     prompt = f"Describe the following database schema in natural language:\n{schema_str}"
-    response = llm.invoke(prompt)
+    response = get_llm().invoke(prompt)
+    record_llm_usage(response)
     return response.content
\ No newline at end of file
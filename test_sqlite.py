@@ -8,4 +8,46 @@ try:
     print("Tables in the database:", tables)
     conn.close()
 except sqlite3.DatabaseError as e:
-    print(f"Error accessing database: {e}")
\ No newline at end of file
+    print(f"Error accessing database: {e}")
+
+# A join that returns a column name twice (orders.product_id and products.product_id) must
+# still come back through the Arrow result path, with the repeated name suffixed
+import os
+import tempfile
+from arrow_results import execute_sqlite_arrow
+
+with tempfile.TemporaryDirectory() as tmp_dir:
+    db_path = os.path.join(tmp_dir, 'join.db')
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE orders (order_id INTEGER PRIMARY KEY, product_id INTEGER, quantity INTEGER)")
+    conn.execute("CREATE TABLE products (product_id INTEGER PRIMARY KEY, name TEXT)")
+    conn.executemany("INSERT INTO orders VALUES (?, ?, ?)", [(1, 1, 2), (2, 2, 5), (3, 1, 1)])
+    conn.executemany("INSERT INTO products VALUES (?, ?)", [(1, 'Laptop'), (2, 'T-Shirt')])
+    conn.commit()
+    conn.close()
+    table = execute_sqlite_arrow(db_path, "SELECT * FROM orders o JOIN products p ON o.product_id = p.product_id")
+    assert table.num_rows == 3, table
+    assert table.column_names == ['order_id', 'product_id', 'quantity', 'product_id_1', 'name'], table.column_names
+    print("Duplicate-column join via Arrow:", table.column_names)
+
+# Questions that differ only in a comparison operator or a sign must not share a cached query,
+# and a query that failed to run is dropped from the cache
+from query_cache import QueryCache, normalize_query
+
+for first, second in [("orders with price > 500", "orders with price < 500"),
+                      ("orders with price >= 500", "orders with price > 500"),
+                      ("customers with city = Miami", "customers with city != Miami"),
+                      ("orders with quantity 5", "orders with quantity -5"),
+                      ("products with stock_quantity below 10", "products with stock quantity below 10")]:
+    assert normalize_query(first) != normalize_query(second), (first, second)
+
+with tempfile.TemporaryDirectory() as tmp_dir:
+    cache = QueryCache(path=os.path.join(tmp_dir, 'cache.db'), similarity=0.5)
+    schema = {'orders': [('price', 'REAL')]}
+    cache.put("orders with price > 500", schema, 'sqlite', "SELECT * FROM orders WHERE price > 500;")
+    assert cache.get("orders with price < 500", schema, 'sqlite') is None
+    assert cache.get("Orders with price > 500!", schema, 'sqlite') == "SELECT * FROM orders WHERE price > 500;"
+    assert cache.invalidate(schema, 'sqlite', "SELECT * FROM orders WHERE price > 500;") == 1
+    assert cache.get("orders with price > 500", schema, 'sqlite') is None
+    cache.close()
+    print("Query cache keeps operators and signs:", normalize_query("orders with price >= -5"))